@@ -2,22 +2,115 @@
 
 import asyncio
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import BOT_TOKEN, RUN_MODE, TELEGRAM_API_URL, METRICS_PORT, TRACING_FILE
 from handlers.user import user_router
 from handlers.admin import admin_router
-# from handlers.worker import worker_router  
+from utils.crypto_rate import rate_prefetcher
+from utils.http_client import http_client
+from utils.telegram_limiter import outbound_limiter
+from utils.commission import commission_cache
+from utils.payment_catalog import payment_catalog
+from utils.action_log import action_log
+from database import engine, async_session
+from migrations import run_migrations
+from middlewares.db import DbSessionMiddleware
+from middlewares.fsm import setup_fsm_buffer
+from middlewares.metrics import setup_metrics, telegram_metrics
+from middlewares.sql_profiler import setup_sql_profiler
+from middlewares.tracing import setup_tracing, telegram_tracing
+from utils.metrics import metrics
+from utils.sql_profiler import sql_profiler
+from utils.tracing import tracer
+from utils.fsm_storage import fsm_storage
+from webhook import run_webhook
+# from handlers.worker import worker_router
 
-async def main():
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def create_bot_session():
+    # Собственный сервер Bot API (или его заглушка в нагрузочном тесте)
+    if TELEGRAM_API_URL:
+        return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return None
+
+def create_bot() -> Bot:
+    bot = Bot(token=BOT_TOKEN, session=create_bot_session())
+    # Запросы к Bot API в трассе апдейта, вместе с ожиданием в очереди
+    if tracer.enabled:
+        bot.session.middleware(telegram_tracing)
+    # Все исходящие сообщения проходят через очередь с лимитами Telegram
+    bot.session.middleware(outbound_limiter)
+    # Время самих запросов к Bot API, без ожидания в очереди
+    bot.session.middleware(telegram_metrics)
+    return bot
+
+def create_dispatcher() -> Dispatcher:
+    # Состояния FSM хранятся в базе и переживают перезапуск
+    dp = Dispatcher(storage=fsm_storage)
+    # Трассы апдейтов по участкам (если включено TRACING_ENABLED)
+    setup_tracing(dp, admin_router, user_router)
+    # Время апдейтов и хендлеров для эндпоинта метрик и команды /metrics
+    setup_metrics(dp, admin_router, user_router)
+    # Запросы к базе по хендлерам (если включено SQL_PROFILER)
+    setup_sql_profiler(dp, admin_router, user_router)
+    # Одно чтение и одна запись состояния FSM на апдейт
+    setup_fsm_buffer(dp)
+    # Одна сессия и одна транзакция базы данных на апдейт
+    dp.update.outer_middleware(DbSessionMiddleware(async_session))
 
     # Регистрация роутеров
     dp.include_router(admin_router)
     dp.include_router(user_router)
-    # dp.include_router(worker_router)  
+    # dp.include_router(worker_router)
+    return dp
+
+async def startup(migrate: bool = True, purge_fsm: bool = True, metrics_port: int = METRICS_PORT,
+                  trace_file: str = TRACING_FILE):
+    """
+    Готовит процесс к приёму апдейтов.
+    В режиме кластера миграции и очистку FSM выполняет только один процесс,
+    а эндпоинт метрик и файл трасс у каждого процесса свои.
+    """
+    # Доводим схему базы до актуальной версии
+    if migrate:
+        await run_migrations(engine)
 
-    await dp.start_polling(bot)
+    # Загружаем комиссию и реквизиты в память до приёма апдейтов
+    await commission_cache.load()
+    await payment_catalog.reload()
+
+    # Общий HTTP-клиент для внешних API и фоновое обновление курсов
+    await http_client.start()
+    rate_prefetcher.start()
+    # Пакетная запись журналов действий и очистка брошенных состояний FSM
+    action_log.start()
+    if purge_fsm:
+        fsm_storage.start()
+    await metrics.start_server(port=metrics_port)
+    sql_profiler.start()
+    tracer.start(trace_file)
+
+async def shutdown():
+    await metrics.stop_server()
+    await sql_profiler.stop()
+    await tracer.stop()
+    await rate_prefetcher.stop()
+    await http_client.close()
+    await action_log.stop()
+    await engine.dispose()
+
+async def main():
+    bot = create_bot()
+    dp = create_dispatcher()
+    await startup()
+    try:
+        if RUN_MODE == 'webhook':
+            # Апдейты приходят от Telegram на веб-сервер (можно ставить за балансировщик)
+            await run_webhook(bot, dp)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await shutdown()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+Бенчмарк записи заявок в SQLite.
+
+Сравнивает профиль движка по умолчанию (журнал отката, synchronous=FULL, без пула, echo)
+с профилем из database.py. Каждая заявка пишется отдельной транзакцией, как в боте.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_sqlite_inserts [количество заявок] [параллельность]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import create_engine
+from models import Base, User, Application
+
+
+async def run_profile(name, engine, total, concurrency):
+    """Вставляет total заявок в concurrency параллельных задач и возвращает число заявок в секунду"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+    async with session_factory() as session:
+        user = User(telegram_id=1, first_name='bench')
+        session.add(user)
+        await session.commit()
+
+    async def worker(count):
+        for _ in range(count):
+            async with session_factory() as session:
+                session.add(Application(
+                    user_id=user.id, crypto_type='BTC', amount=0.001, amount_rub=5000.0,
+                    wallet_address='bc1qar0srrr7xfkvy5l643lydnw9re59gtzzwf5mdq',
+                    payment_method='Bank', crypto_rub_rate=5000000.0
+                ))
+                await session.commit()
+
+    per_worker = total // concurrency
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(per_worker) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+
+    inserted = per_worker * concurrency
+    rate = inserted / elapsed
+    print(f"{name:<10} {inserted:>7} inserts  {elapsed:>7.2f} s  {rate:>9.1f} inserts/s")
+    return rate
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'legacy.db')}", echo=True)
+        # echo пишет в stdout; направляем его в /dev/null, форматирование записей при этом остаётся
+        devnull = open(os.devnull, 'w')
+        for handler in logging.getLogger('sqlalchemy.engine.Engine').handlers:
+            handler.setStream(devnull)
+        legacy_rate = await run_profile('legacy', legacy, total, concurrency)
+
+        tuned = create_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'tuned.db')}")
+        tuned_rate = await run_profile('tuned', tuned, total, concurrency)
+        devnull.close()
+
+    print(f"speedup: x{tuned_rate / legacy_rate:.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
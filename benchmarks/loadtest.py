@@ -0,0 +1,377 @@
+"""
+Нагрузочный тест бота целиком: от апдейта до ответа в чате.
+
+Скрипт поднимает локальную заглушку Telegram Bot API и CoinGecko, запускает бота
+в отдельном процессе (long polling к заглушке, временная база SQLite) и проводит
+синтетических пользователей по всему сценарию:
+/start → капча → покупка → сумма → способ оплаты → кошелёк → оплата,
+а воркер подтверждает созданные заявки.
+
+Для каждого шага считается задержка от отправки апдейта до ответа бота
+(p50/p95/p99), а также общая пропускная способность.
+
+Запуск из корня проекта:
+    python -m benchmarks.loadtest --users 100 --ramp-up 10
+    python -m benchmarks.loadtest --users 1000 --ramp-up 30 --no-telegram-limits
+"""
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import re
+import signal
+import tempfile
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+BOT_TOKEN = '123456789:LOADTEST-fake-token-AAAAAAAAAAAAAAAAAA'
+BOT_ID = 123456789
+WORKER_ID = 900000001
+ADMIN_ID = 900000002
+FIRST_USER_ID = 100000000
+BANK_NAME = 'Load Bank'
+WALLET = 'bc1qar0srrr7xfkvy5l643lydnw9re59gtzzwf5mdq'
+RATE_RUB = 5000000.0
+
+
+class FakeTelegram:
+    """
+    Заглушка Telegram Bot API: отдаёт апдейты через getUpdates и запоминает
+    сообщения бота, чтобы синтетические пользователи могли дождаться ответа.
+    """
+
+    def __init__(self):
+        self.updates = []
+        self.offset = 0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self.messages = defaultdict(list)  # chat_id -> [текст]
+        self._chat_events = defaultdict(asyncio.Event)
+        self.answered = {}  # callback_query_id -> время ответа
+        self._answer_events = defaultdict(asyncio.Event)
+        self.calls = defaultdict(int)
+
+    def _push(self, kind: str, payload: dict):
+        self.updates.append({'update_id': next(self._update_ids), kind: payload})
+        self._new_updates.set()
+
+    def send_text(self, user_id: int, text: str):
+        self._push('message', {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'user{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        })
+
+    def press_button(self, user_id: int, data: str) -> str:
+        callback_id = str(next(self._message_ids))
+        self._push('callback_query', {
+            'id': callback_id,
+            'chat_instance': str(user_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'data': data,
+            'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'bot'},
+                'text': '...',
+            },
+        })
+        return callback_id
+
+    async def wait_message(self, chat_id: int, pattern, start: int, timeout: float):
+        """Ждёт сообщение бота в чате (начиная с индекса start), подходящее под pattern"""
+        deadline = time.monotonic() + timeout
+        messages = self.messages[chat_id]
+        position = start
+        while True:
+            while position < len(messages):
+                match = pattern.search(messages[position])
+                position += 1
+                if match:
+                    return match, position
+            event = self._chat_events[chat_id]
+            event.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(event.wait(), remaining)
+
+    async def wait_answer(self, callback_id: str, timeout: float):
+        event = self._answer_events[callback_id]
+        if callback_id not in self.answered:
+            await asyncio.wait_for(event.wait(), timeout)
+        self._answer_events.pop(callback_id, None)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        self.calls[method] += 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == 'getme':
+            return self._ok({'id': BOT_ID, 'is_bot': True, 'first_name': 'bot', 'username': 'loadtest_bot'})
+        if method == 'getupdates':
+            return self._ok(await self._get_updates(params))
+        if method == 'sendmessage':
+            chat_id = int(params['chat_id'])
+            self.messages[chat_id].append(params.get('text', ''))
+            self._chat_events[chat_id].set()
+            return self._ok({
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            })
+        if method == 'answercallbackquery':
+            callback_id = params['callback_query_id']
+            self.answered[callback_id] = time.monotonic()
+            self._answer_events[callback_id].set()
+        # editMessageText, editMessageReplyMarkup, deleteMessage, deleteWebhook и т.п.
+        return self._ok(True)
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get('timeout') or 0) or 0.1)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get('limit') or 100)]
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({'ok': True, 'result': result})
+
+    async def coingecko_price(self, request: web.Request) -> web.Response:
+        self.calls['coingecko'] += 1
+        ids = request.query.get('ids', '').split(',')
+        return web.json_response({coin_id: {'rub': RATE_RUB} for coin_id in ids if coin_id})
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 2)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/api/v3/simple/price', self.coingecko_price)
+        return app
+
+
+class Recorder:
+    """Задержки по шагам сценария"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, step: str, seconds: float):
+        self.latencies[step].append(seconds)
+
+    def fail(self, step: str):
+        self.errors[step] += 1
+
+    @staticmethod
+    def percentile(values: list, q: float) -> float:
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+        return ordered[index]
+
+    def report(self, steps: list):
+        print(f"{'step':<18}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for step in steps:
+            values = self.latencies.get(step, [])
+            if values:
+                p50, p95, p99 = (self.percentile(values, q) * 1000 for q in (50, 95, 99))
+                worst = max(values) * 1000
+                print(f"{step:<18}{len(values):>7}{self.errors[step]:>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{worst:>10.1f}")
+            else:
+                print(f"{step:<18}{0:>7}{self.errors[step]:>8}{'-':>10}{'-':>10}{'-':>10}{'-':>10}")
+
+
+CAPTCHA = re.compile(r'\*\*(\d+)\*\*')
+STEPS = [
+    # (шаг, действие, ожидаемый ответ бота)
+    ('start', lambda user, ctx: ('text', '/start'), CAPTCHA),
+    ('captcha', lambda user, ctx: ('text', ctx['captcha']), re.compile('Выберите действие')),
+    ('buy_crypto', lambda user, ctx: ('button', 'menu_buy_crypto'), re.compile('Выберите криптовалюту')),
+    ('choose_crypto', lambda user, ctx: ('button', 'crypto_BTC'), re.compile('Введите нужную сумму')),
+    ('enter_amount', lambda user, ctx: ('text', '1000 ₽'), re.compile('Выберите способ оплаты')),
+    ('payment_method', lambda user, ctx: ('button', f"payment_method_{BANK_NAME.replace(' ', '_')}"),
+     re.compile('Укажите адрес')),
+    ('wallet', lambda user, ctx: ('text', WALLET), re.compile('Реквизиты для оплаты')),
+    ('payment_confirmed', lambda user, ctx: ('button', 'payment_confirmed'), re.compile('Дождитесь подтверждения')),
+]
+COMPLETED = re.compile('Ваша заявка выполнена')
+APPLICATION = re.compile(r'Заявка №(\d+)')
+REPORT_STEPS = [name for name, _, _ in STEPS] + ['worker_complete', 'user_notified', 'full_flow']
+
+
+async def run_user(fake: FakeTelegram, recorder: Recorder, user_id: int, think_time: float, timeout: float) -> bool:
+    context = {}
+    position = 0
+    flow_started = time.monotonic()
+    for step, action, expected in STEPS:
+        kind, value = action(user_id, context)
+        started = time.monotonic()
+        if kind == 'text':
+            fake.send_text(user_id, value)
+        else:
+            fake.press_button(user_id, value)
+        try:
+            match, position = await fake.wait_message(user_id, expected, position, timeout)
+        except asyncio.TimeoutError:
+            recorder.fail(step)
+            return False
+        recorder.add(step, time.monotonic() - started)
+        if step == 'start':
+            context['captcha'] = match.group(1)
+        if think_time:
+            await asyncio.sleep(think_time)
+
+    # Заявку подтверждает воркер; ждём уведомления о выполнении
+    confirmed = time.monotonic()
+    try:
+        await fake.wait_message(user_id, COMPLETED, position, timeout * 4)
+    except asyncio.TimeoutError:
+        recorder.fail('user_notified')
+        return False
+    recorder.add('user_notified', time.monotonic() - confirmed)
+    recorder.add('full_flow', time.monotonic() - flow_started)
+    return True
+
+
+async def run_worker(fake: FakeTelegram, recorder: Recorder, timeout: float, pending: set):
+    """Воркер нажимает «Выполнено» под каждой новой заявкой (задачи нажатий копятся в pending)"""
+    position = 0
+
+    async def complete(application_id: str):
+        started = time.monotonic()
+        callback_id = fake.press_button(WORKER_ID, f"application_{application_id}_completed")
+        try:
+            await fake.wait_answer(callback_id, timeout)
+        except asyncio.TimeoutError:
+            recorder.fail('worker_complete')
+            return
+        recorder.add('worker_complete', time.monotonic() - started)
+
+    while True:
+        match, position = await fake.wait_message(WORKER_ID, APPLICATION, position, float('inf'))
+        task = asyncio.create_task(complete(match.group(1)))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+
+def run_bot(overrides: dict):
+    """Точка входа процесса бота: подменяет настройки и запускает app.main"""
+    import config
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+    # Модули бота читают настройки при импорте, поэтому импортируем их после подмены
+    import app
+    from database import async_session, engine
+    from migrations import run_migrations
+    from models import PaymentDetails
+
+    async def seed():
+        await run_migrations(engine)
+        async with async_session() as session:
+            session.add(PaymentDetails(bank_name=BANK_NAME, card_number='2200000000000000', recipient_name='Load Test'))
+            await session.commit()
+
+    async def main():
+        await seed()
+        await app.main()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+async def main_async(args):
+    fake = FakeTelegram()
+    runner = web.AppRunner(fake.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.port).start()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        overrides = {
+            'BOT_TOKEN': BOT_TOKEN,
+            'TELEGRAM_API_URL': base_url,
+            'COINGECKO_API_URL': f"{base_url}/api/v3/simple/price",
+            'DATABASE_URL': args.database_url or f"sqlite+aiosqlite:///{os.path.join(tmp, 'loadtest.db')}",
+            'WORKER_ID': WORKER_ID,
+            'ADMIN_IDS': [ADMIN_ID],
+            'RUN_MODE': 'polling',
+        }
+        if args.no_telegram_limits:
+            overrides.update(TELEGRAM_GLOBAL_RATE=100000, TELEGRAM_CHAT_RATE=100000, TELEGRAM_CHAT_BURST=100000)
+
+        bot_process = multiprocessing.get_context('spawn').Process(target=run_bot, args=(overrides,), name='bot')
+        bot_process.start()
+
+        recorder = Recorder()
+        worker_pending = set()
+        worker = asyncio.create_task(run_worker(fake, recorder, args.timeout, worker_pending))
+        user_ids = [FIRST_USER_ID + index for index in range(args.users)]
+        delay = args.ramp_up / args.users if args.users else 0
+
+        # Ждём, пока бот начнёт опрашивать getUpdates
+        while not fake.calls['getupdates']:
+            if not bot_process.is_alive():
+                raise SystemExit("bot process exited during startup")
+            await asyncio.sleep(0.1)
+
+        async def start_user(index, user_id):
+            await asyncio.sleep(index * delay)
+            return await run_user(fake, recorder, user_id, args.think_time, args.timeout)
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(start_user(index, user_id) for index, user_id in enumerate(user_ids)))
+        elapsed = time.monotonic() - started
+
+        # Ответы воркеру идут через один чат с лимитом, поэтому дожидаем их отдельно
+        worker.cancel()
+        if worker_pending:
+            await asyncio.wait(worker_pending)
+        os.kill(bot_process.pid, signal.SIGINT)
+        bot_process.join(30)
+        if bot_process.is_alive():
+            bot_process.terminate()
+    await runner.cleanup()
+
+    completed = sum(results)
+    updates = next(fake._update_ids) - 1
+    print(f"\nusers: {args.users}, ramp-up: {args.ramp_up}s, telegram limits: {'off' if args.no_telegram_limits else 'on'}")
+    recorder.report(REPORT_STEPS)
+    print(f"\ncompleted flows: {completed}/{args.users} in {elapsed:.1f} s")
+    print(f"throughput: {completed / elapsed:.2f} flows/s, {updates / elapsed:.1f} updates/s")
+    print("Bot API calls: " + ", ".join(f"{name}={count}" for name, count in sorted(fake.calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test with a fake Telegram Bot API")
+    parser.add_argument('--users', type=int, default=100, help="число синтетических пользователей")
+    parser.add_argument('--ramp-up', type=float, default=10, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument('--think-time', type=float, default=0, help="пауза пользователя между шагами, с")
+    parser.add_argument('--timeout', type=float, default=60, help="сколько ждать ответа бота на шаг, с")
+    parser.add_argument('--port', type=int, default=8181, help="порт заглушки Bot API")
+    parser.add_argument('--database-url', default=None, help="база бота (по умолчанию временная SQLite)")
+    parser.add_argument('--no-telegram-limits', action='store_true',
+                        help="снять лимиты отправки, чтобы измерить пропускную способность самого бота")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Микробенчмарки чистых функций на пути обработки апдейта.
+
+Измеряет разбор суммы и расчёт цены из enter_amount (и пачкой для предпросмотра), проверку адреса
+кошелька (с кэшем, без него и пачкой для /audit_wallets), генерацию капчи, сборку инлайн-клавиатур и накладные расходы
+метрик на апдейт. Результаты сравниваются
+с сохранёнными базовыми значениями (benchmarks/micro_baselines.json), и
+скрипт завершается с кодом 1, если какой-то бенчмарк стал медленнее больше
+чем на допуск.
+
+Время каждого бенчмарка делится на время калибровочной нагрузки на чистом
+Python, измеренной вперемешку с ним, поэтому базовые значения,
+записанные на одной машине, можно проверять на другой. Бенчмарк, вышедший
+за допуск, перемеряется ещё RETRIES раз, чтобы не падать от случайного шума.
+
+Запуск из корня проекта:
+    python -m benchmarks.micro                # сравнить с базовыми значениями
+    python -m benchmarks.micro --update       # перезаписать базовые значения
+    python -m benchmarks.micro -k keyboard    # только бенчмарки с подстрокой в имени
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+from types import SimpleNamespace
+
+from handlers.user import (
+    parse_amount,
+    crypto_inline_keyboard,
+    payment_methods_inline_keyboard,
+)
+from handlers.admin import admin_delete_payment_kb
+from utils.captcha import generate_captcha
+from utils.metrics import Histogram
+from utils.pricing import make_quote, price_many
+from utils.wallet import validate_wallet_address, check_wallet_address, check_many
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'micro_baselines.json')
+DEFAULT_TOLERANCE = 0.25
+SAMPLES = 30
+SAMPLE_TIME = 0.02
+RETRIES = 2
+
+AMOUNT_INPUTS = ['1000', '1500.50 ₽', '0.00041 BTC', '0.5 ltc', '12 abc']
+# Суммы для предпросмотра цен администратором (price_many)
+PREVIEW_AMOUNTS = [str(amount) for amount in range(500, 100_500, 100)]
+BTC_ADDRESS = 'bc1qar0srrr7xfkvy5l643lydnw9re59gtzzwf5mdq'
+LTC_ADDRESS = 'LaMT348PWRnrqeeWArpwQPbuanpXDZGEUz'
+PAYMENT_METHODS = ['Сбербанк', 'Тинькофф', 'Альфа Банк']
+PAYMENT_DETAILS = [
+    SimpleNamespace(id=index, bank_name=bank, card_number='2200000000000000', recipient_name='Иван Иванов')
+    for index, bank in enumerate(PAYMENT_METHODS, start=1)
+]
+
+
+def calibration():
+    """Эталонная нагрузка на чистом Python: арифметика, строки и словари"""
+    values = {}
+    for index in range(200):
+        values[f"key{index}"] = index * 3 % 7
+    return sum(values.values())
+
+
+def run_coroutine(coro):
+    """Выполняет корутину без цикла событий (она не должна ничего ждать)"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("coroutine is not expected to suspend")
+
+
+def bench_parse_amount():
+    for text in AMOUNT_INPUTS:
+        parse_amount(text)
+
+
+def bench_make_quote():
+    make_quote(1000, '₽', 'BTC', 5_000_000.0, 2.5)
+    make_quote('0.00041', 'BTC', 'BTC', 5_000_000.0, 2.5)
+    make_quote(1000, None, 'BTC', 5_000_000.0, 2.5)
+
+
+def bench_price_many_1000():
+    price_many(PREVIEW_AMOUNTS, '₽', 'BTC', 5_000_000.0, 2.5)
+
+
+def bench_enter_amount_pricing():
+    # Чистая часть enter_amount: разбор ввода, расчёт и форматирование ответа
+    for text in AMOUNT_INPUTS:
+        parsed = parse_amount(text)
+        if parsed is None:
+            continue
+        quote = make_quote(*parsed, 'BTC', 5_000_000.0, 2.5)
+        quote.to_dict()
+        f"{quote.amount_crypto:.8f} BTC {quote.amount_to_pay:.2f} ₽"
+
+
+def bench_validate_wallet_address():
+    validate_wallet_address(BTC_ADDRESS, 'BTC')
+    validate_wallet_address(LTC_ADDRESS, 'LTC')
+    validate_wallet_address('not-an-address', 'BTC')
+
+
+def bench_check_wallet_address_uncached():
+    # Полная проверка контрольных сумм, без LRU-кэша (первый ввод адреса)
+    check = check_wallet_address.__wrapped__
+    check(BTC_ADDRESS, 'BTC')
+    check(LTC_ADDRESS, 'LTC')
+    check('not-an-address', 'BTC')
+
+
+# Пачка адресов заявок для проверки командой /audit_wallets: половина повторяется
+AUDIT_PAIRS = [(BTC_ADDRESS, 'BTC'), (LTC_ADDRESS, 'LTC')] * 25 + [
+    (BTC_ADDRESS[:-1] + char, 'BTC') for char in 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+] + [(LTC_ADDRESS, 'BTC')] * 18
+
+
+def bench_wallet_audit_batch():
+    check_many(AUDIT_PAIRS)
+
+
+def bench_generate_captcha():
+    run_coroutine(generate_captcha())
+
+
+def bench_crypto_inline_keyboard():
+    crypto_inline_keyboard()
+
+
+def bench_payment_methods_inline_keyboard():
+    payment_methods_inline_keyboard(PAYMENT_METHODS)
+
+
+def bench_admin_delete_payment_kb():
+    admin_delete_payment_kb(PAYMENT_DETAILS)
+
+
+UPDATE_HISTOGRAM = Histogram('bench_update_seconds', "Benchmark", ('type',))
+HANDLER_HISTOGRAM = Histogram('bench_handler_seconds', "Benchmark", ('router', 'handler'))
+
+
+def bench_metrics_per_update():
+    # Что добавляют UpdateMetricsMiddleware и HandlerMetricsMiddleware к одному апдейту
+    started = time.perf_counter()
+    handler_started = time.perf_counter()
+    HANDLER_HISTOGRAM.observe(time.perf_counter() - handler_started, 'handlers.user', 'enter_amount')
+    UPDATE_HISTOGRAM.observe(time.perf_counter() - started, 'message')
+
+
+BENCHMARKS = {
+    'parse_amount': bench_parse_amount,
+    'make_quote': bench_make_quote,
+    'price_many_1000': bench_price_many_1000,
+    'enter_amount_pricing': bench_enter_amount_pricing,
+    'validate_wallet_address': bench_validate_wallet_address,
+    'check_wallet_address_uncached': bench_check_wallet_address_uncached,
+    'wallet_audit_batch': bench_wallet_audit_batch,
+    'generate_captcha': bench_generate_captcha,
+    'crypto_inline_keyboard': bench_crypto_inline_keyboard,
+    'payment_methods_inline_keyboard': bench_payment_methods_inline_keyboard,
+    'admin_delete_payment_kb': bench_admin_delete_payment_kb,
+    'metrics_per_update': bench_metrics_per_update,
+}
+
+
+def calibrated_timer(func):
+    """Возвращает (таймер, число вызовов на один замер около SAMPLE_TIME секунд)"""
+    timer = timeit.Timer(func)
+    # autorange подбирает число вызовов так, чтобы замер занимал не меньше 0.2 с
+    number, elapsed = timer.autorange()
+    return timer, max(1, int(number * SAMPLE_TIME / elapsed))
+
+
+def measure_relative(func):
+    """
+    Возвращает (нс на вызов, время относительно калибровочной нагрузки).
+    Короткие замеры бенчмарка и калибровки чередуются, берётся лучший из
+    каждых: всплески нагрузки на машине не попадают во все замеры сразу.
+    """
+    calibration_timer, calibration_number = calibrated_timer(calibration)
+    timer, number = calibrated_timer(func)
+    calibration_best = best = float('inf')
+    for _ in range(SAMPLES):
+        calibration_best = min(calibration_best, calibration_timer.timeit(calibration_number) / calibration_number)
+        best = min(best, timer.timeit(number) / number)
+    return best * 1e9, best / calibration_best
+
+
+def load_baselines() -> dict:
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, encoding='utf-8') as file:
+        return json.load(file).get('benchmarks', {})
+
+
+def save_baselines(results: dict):
+    baselines = load_baselines()
+    baselines.update(results)
+    payload = {
+        'python': platform.python_version(),
+        'benchmarks': dict(sorted(baselines.items())),
+    }
+    with open(BASELINES_PATH, 'w', encoding='utf-8') as file:
+        json.dump(payload, file, indent=2, ensure_ascii=False)
+        file.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for hot-path pure functions")
+    parser.add_argument('-k', dest='keyword', default='', help="запускать только бенчмарки с подстрокой в имени")
+    parser.add_argument('--update', action='store_true', help="записать результаты как новые базовые значения")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="допустимое замедление относительно базового значения (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    selected = {name: func for name, func in BENCHMARKS.items() if args.keyword in name}
+    if not selected:
+        raise SystemExit(f"no benchmarks match {args.keyword!r}")
+
+    baselines = {} if args.update else load_baselines()
+    results = {}
+    regressions = []
+
+    print(f"{'benchmark':<32} {'ns/op':>10} {'relative':>10} {'baseline':>10} {'change':>8}")
+    for name, func in selected.items():
+        ns, relative = measure_relative(func)
+        baseline = baselines.get(name)
+        if baseline is None:
+            results[name] = {'ns': round(ns, 1), 'relative': round(relative, 4)}
+            print(f"{name:<32} {ns:>10.1f} {relative:>10.4f} {'-':>10} {'-':>8}")
+            continue
+
+        for _ in range(RETRIES):
+            if relative / baseline['relative'] - 1 <= args.tolerance:
+                break
+            ns, relative = min((ns, relative), measure_relative(func), key=lambda result: result[1])
+        results[name] = {'ns': round(ns, 1), 'relative': round(relative, 4)}
+        change = relative / baseline['relative'] - 1
+        mark = ''
+        if change > args.tolerance:
+            regressions.append(name)
+            mark = '  REGRESSION'
+        print(f"{name:<32} {ns:>10.1f} {relative:>10.4f} {baseline['relative']:>10.4f} {change:>+7.0%}{mark}")
+
+    if args.update:
+        save_baselines(results)
+        print(f"baselines written to {os.path.relpath(BASELINES_PATH)}")
+        return
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance:.0%}: "
+              + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
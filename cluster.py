@@ -0,0 +1,365 @@
+# cluster.py
+
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from aiohttp import web
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError, TelegramRetryAfter
+from config import (
+    BOT_TOKEN, RUN_MODE, TELEGRAM_GLOBAL_RATE, CLUSTER_WORKERS, CLUSTER_WORKER_CONCURRENCY,
+    CLUSTER_REPORT_INTERVAL, CLUSTER_POLLING_TIMEOUT, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+    WEBHOOK_URL, WEBHOOK_SECRET, METRICS_PORT, TRACING_FILE
+)
+
+logger = logging.getLogger(__name__)
+
+# Колбэки воркера по заявкам (application_<id>_completed и т.п.) не относятся
+# к сценарию конкретного пользователя и могут обрабатываться любым процессом
+SHARED_CALLBACK_PREFIXES = ('application_',)
+
+def update_user_id(update: dict):
+    """Telegram ID автора апдейта (или ID чата, если автора нет)"""
+    for key, payload in update.items():
+        if key == 'update_id' or not isinstance(payload, dict):
+            continue
+        author = payload.get('from') or payload.get('user')
+        if author:
+            return author['id']
+        chat = payload.get('chat') or payload.get('message', {}).get('chat')
+        if chat:
+            return chat['id']
+    return None
+
+def is_shared_update(update: dict) -> bool:
+    data = (update.get('callback_query') or {}).get('data') or ''
+    return data.startswith(SHARED_CALLBACK_PREFIXES)
+
+class UpdateRouter:
+    """
+    Распределяет апдейты главного процесса по процессам-обработчикам.
+
+    Апдейты одного пользователя всегда попадают в процесс ``telegram_id % N``,
+    поэтому шаги его FSM выполняются по порядку. Колбэки по заявкам уходят
+    в процесс с наименьшей очередью по последним отчётам о нагрузке.
+    """
+
+    def __init__(self, inboxes):
+        self.inboxes = inboxes
+        self.sent = [0] * len(inboxes)
+        self.done = [0] * len(inboxes)
+        self._round_robin = itertools.cycle(range(len(inboxes)))
+
+    def partition(self, update: dict) -> int:
+        if is_shared_update(update):
+            return min(range(len(self.inboxes)), key=self.backlog)
+        user_id = update_user_id(update)
+        if user_id is None:
+            return next(self._round_robin)
+        return user_id % len(self.inboxes)
+
+    def backlog(self, index: int) -> int:
+        return self.sent[index] - self.done[index]
+
+    def route(self, update: dict) -> int:
+        index = self.partition(update)
+        self.inboxes[index].put(('update', update))
+        self.sent[index] += 1
+        return index
+
+    def record_load(self, report: dict):
+        self.done[report['worker']] = report['processed'] + report['failed']
+
+class ClusterWorker:
+    """
+    Процесс-обработчик: получает апдейты от главного процесса и передаёт их
+    в диспетчер. Апдейты одного пользователя обрабатываются строго по очереди,
+    разных пользователей — параллельно, не более ``concurrency`` одновременно.
+    """
+
+    def __init__(self, index: int, workers: int, inbox, outbox, concurrency: int = CLUSTER_WORKER_CONCURRENCY,
+                 report_interval: float = CLUSTER_REPORT_INTERVAL):
+        self.index = index
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.report_interval = report_interval
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tails = {}  # telegram_id -> последняя задача пользователя
+        self._tasks = set()
+        self.processed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self._cpu_mark = (time.monotonic(), time.process_time())
+
+    async def run(self):
+        # Импортируем здесь: модули бота нужны только процессам-обработчикам
+        from app import create_bot, create_dispatcher, startup, shutdown
+        from utils.cluster_bus import cluster_bus
+        from utils.telegram_limiter import outbound_limiter
+        from utils.fsm_storage import fsm_storage
+
+        outbound_limiter.set_global_rate(TELEGRAM_GLOBAL_RATE / self.workers)
+        cluster_bus.attach(lambda topic, payload: self.outbox.put(('event', self.index, topic, payload)))
+
+        # Апдейты пользователя приходят только в этот процесс, поэтому его состояние FSM можно держать в памяти
+        fsm_storage.enable_cache()
+        self.bot = create_bot()
+        self.dp = create_dispatcher()
+        # Очисткой брошенных состояний FSM занимается только первый процесс
+        # Каждый процесс пишет трассы в свой файл: traces.jsonl -> traces-worker0.jsonl
+        base, extension = os.path.splitext(TRACING_FILE)
+        trace_file = f"{base}-worker{self.index}{extension}"
+        await startup(migrate=False, purge_fsm=self.index == 0,
+                      metrics_port=METRICS_PORT + 1 + self.index if METRICS_PORT else 0,
+                      trace_file=trace_file)
+        await self.dp.emit_startup(bot=self.bot)
+        reporter = asyncio.create_task(self._report_loop())
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                message = await loop.run_in_executor(None, self.inbox.get)
+                kind = message[0]
+                if kind == 'update':
+                    self.submit(message[1])
+                elif kind == 'event':
+                    await cluster_bus.deliver(message[1], message[2])
+                elif kind == 'stop':
+                    break
+            # Доводим до конца уже принятые апдейты
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            reporter.cancel()
+            self.report()
+            await self.dp.emit_shutdown(bot=self.bot)
+            await self.bot.session.close()
+            await shutdown()
+
+    def submit(self, update: dict):
+        key = update_user_id(update)
+        previous = self._tails.get(key) if key is not None else None
+        task = asyncio.create_task(self._process(update, previous))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if key is not None:
+            self._tails[key] = task
+            task.add_done_callback(lambda t: self._tails.pop(key, None) if self._tails.get(key) is t else None)
+
+    async def _process(self, update: dict, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                result = await self.dp.feed_raw_update(self.bot, update)
+                if result is not None:
+                    await self.dp.silent_call_request(bot=self.bot, result=result)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Worker {self.index} failed to process update {update.get('update_id')}")
+            finally:
+                self.total_latency += time.monotonic() - started
+
+    def report(self) -> dict:
+        now, cpu = time.monotonic(), time.process_time()
+        wall_elapsed = now - self._cpu_mark[0]
+        cpu_percent = (cpu - self._cpu_mark[1]) / wall_elapsed * 100 if wall_elapsed > 0 else 0.0
+        self._cpu_mark = (now, cpu)
+        handled = self.processed + self.failed
+        report = {
+            'worker': self.index,
+            'pid': os.getpid(),
+            'processed': self.processed,
+            'failed': self.failed,
+            'in_flight': len(self._tasks),
+            'avg_latency': self.total_latency / handled if handled else 0.0,
+            'cpu_percent': cpu_percent,
+        }
+        logger.info(
+            f"Worker {self.index} (pid {report['pid']}): processed={self.processed} failed={self.failed} "
+            f"in_flight={report['in_flight']} avg_latency={report['avg_latency'] * 1000:.1f}ms "
+            f"cpu={cpu_percent:.0f}%"
+        )
+        self.outbox.put(('load', report))
+        return report
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.report()
+
+def worker_main(index: int, workers: int, inbox, outbox):
+    # Ctrl+C получает главный процесс; обработчики останавливаются по его команде
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [worker {index}] %(name)s: %(message)s")
+    asyncio.run(ClusterWorker(index, workers, inbox, outbox).run())
+
+class ClusterMaster:
+    """
+    Главный процесс: один раз принимает апдейты (long polling или вебхук),
+    раздаёт их процессам-обработчикам, пересылает между ними события шины
+    ``cluster_bus`` и собирает их отчёты о нагрузке.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.context = multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue() for _ in range(workers)]
+        self.outbox = self.context.Queue()
+        self.router = UpdateRouter(self.inboxes)
+        self.processes = [None] * workers
+        self.loads = {}
+        self.restarts = 0
+
+    def start_worker(self, index: int):
+        process = self.context.Process(
+            target=worker_main,
+            args=(index, self.workers, self.inboxes[index], self.outbox),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    async def run(self):
+        from app import create_bot_session
+        from database import engine
+        from migrations import run_migrations
+
+        # Схему обновляет только главный процесс, до запуска обработчиков
+        await run_migrations(engine)
+        await engine.dispose()
+
+        for index in range(self.workers):
+            self.start_worker(index)
+        logger.info(f"Started {self.workers} worker processes")
+
+        bot = Bot(token=BOT_TOKEN, session=create_bot_session())
+        tasks = [
+            asyncio.create_task(self._read_outbox()),
+            asyncio.create_task(self._watch_workers()),
+        ]
+        try:
+            if RUN_MODE == 'webhook':
+                await self._serve_webhook(bot)
+            else:
+                await self._poll(bot)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await bot.session.close()
+            await self.stop()
+
+    async def _poll(self, bot: Bot):
+        offset = None
+        backoff = 1
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=CLUSTER_POLLING_TIMEOUT,
+                    allowed_updates=['message', 'callback_query'],
+                    request_timeout=int(bot.session.timeout + CLUSTER_POLLING_TIMEOUT),
+                )
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning(f"Polling failed: {e}, retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            backoff = 1
+            for update in updates:
+                self.router.route(update.model_dump(mode='json', exclude_unset=True, by_alias=True))
+                offset = update.update_id + 1
+
+    async def _serve_webhook(self, bot: Bot):
+        async def handle(request: web.Request) -> web.Response:
+            if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+                return web.Response(body="Unauthorized", status=401)
+            self.router.route(await request.json())
+            return web.json_response({})
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Cluster webhook listening on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        try:
+            if WEBHOOK_URL:
+                await bot.set_webhook(
+                    url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                    secret_token=WEBHOOK_SECRET or None,
+                    allowed_updates=['message', 'callback_query'],
+                )
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    async def _read_outbox(self):
+        loop = asyncio.get_running_loop()
+        last_summary = time.monotonic()
+        while True:
+            message = await loop.run_in_executor(None, self.outbox.get)
+            if message[0] == 'stop':
+                break
+            if message[0] == 'load':
+                report = message[1]
+                self.loads[report['worker']] = report
+                self.router.record_load(report)
+            elif message[0] == 'event':
+                # Событие шины из одного процесса применяется во всех остальных
+                _, sender, topic, payload = message
+                for index, inbox in enumerate(self.inboxes):
+                    if index != sender:
+                        inbox.put(('event', topic, payload))
+            if time.monotonic() - last_summary >= CLUSTER_REPORT_INTERVAL:
+                last_summary = time.monotonic()
+                self.log_summary()
+
+    def log_summary(self):
+        parts = [
+            f"#{index}: backlog={self.router.backlog(index)} cpu={load['cpu_percent']:.0f}%"
+            for index, load in sorted(self.loads.items())
+        ]
+        logger.info(f"Cluster load ({self.restarts} restarts): " + "; ".join(parts))
+
+    async def _watch_workers(self):
+        while True:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    self.restarts += 1
+                    self.start_worker(index)
+
+    async def stop(self, timeout: float = 30):
+        for inbox in self.inboxes:
+            inbox.put(('stop',))
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            if process is not None:
+                await loop.run_in_executor(None, process.join, timeout)
+                if process.is_alive():
+                    process.terminate()
+        # Освобождаем поток, который читает очередь отчётов
+        self.outbox.put(('stop',))
+        logger.info("Cluster stopped")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [master] %(name)s: %(message)s")
+    workers = CLUSTER_WORKERS or os.cpu_count() or 1
+    try:
+        asyncio.run(ClusterMaster(workers).run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,113 @@
+import time
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-DATABASE_URL = "sqlite+aiosqlite:///database.db"
+from config import (
+    DATABASE_URL, DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS,
+    SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE, SQLITE_MMAP_SIZE
+)
+from utils.metrics import metrics, db_statement_latency
+from utils.sql_profiler import sql_profiler
+from utils.tracing import tracer
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Прагмы, которые применяются к каждому новому соединению с SQLite
+SQLITE_PRAGMAS = {
+    'journal_mode': SQLITE_JOURNAL_MODE,
+    'synchronous': SQLITE_SYNCHRONOUS,
+    'busy_timeout': SQLITE_BUSY_TIMEOUT,
+    'cache_size': SQLITE_CACHE_SIZE,
+    'mmap_size': SQLITE_MMAP_SIZE,
+}
+
+
+def create_engine(url=DATABASE_URL, echo=DB_ECHO, pragmas=None):
+    """
+    Создаёт движок базы данных для SQLite (aiosqlite) или PostgreSQL (asyncpg).
+    """
+    backend = make_url(url).get_backend_name()
+    pool_options = {
+        'poolclass': AsyncAdaptedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+    }
+
+    if backend == 'postgresql':
+        # Соединения проверяются перед выдачей и периодически переоткрываются,
+        # подготовленные запросы кэшируются драйвером на каждом соединении
+        engine = create_async_engine(
+            url,
+            echo=echo,
+            pool_pre_ping=DB_POOL_PRE_PING,
+            pool_recycle=DB_POOL_RECYCLE,
+            connect_args={'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE},
+            **pool_options,
+        )
+        observe_statements(engine)
+        return engine
+
+    # По умолчанию (NullPool) aiosqlite открывает новое соединение и поток на каждую сессию,
+    # поэтому соединения держим в пуле, а прагмы выставляем один раз при подключении
+    engine = create_async_engine(url, echo=echo, **pool_options)
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine.sync_engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    observe_statements(engine)
+    return engine
+
+
+def observe_statements(engine):
+    """Замеряет время каждого SQL-запроса движка для метрик (по первому слову запроса)"""
+
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def statement_started(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def statement_finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        db_statement_latency.observe(elapsed, statement.split(None, 1)[0].upper())
+
+
+def pool_stats(engine) -> dict:
+    # У NullPool (например, у движков бенчмарков) счётчиков нет
+    pool = engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {}
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+    }
+
+
+def dialect_insert(session):
+    """
+    Возвращает insert() диалекта сессии, поддерживающий ON CONFLICT DO UPDATE.
+    Upsert есть и в SQLite, и в PostgreSQL, но конструкции у диалектов свои.
+    """
+    if session.bind.dialect.name == 'postgresql':
+        return postgresql.insert
+    return sqlite.insert
+
+
+engine = create_engine()
 async_session = sessionmaker(
     engine, expire_on_commit=False, class_=AsyncSession
-)
\ No newline at end of file
+)
+metrics.collector('db_pool', lambda: pool_stats(engine))
+# Профилировщик запросов подключается только при SQL_PROFILER = True
+sql_profiler.install(engine)
+# Участки SQL-запросов в трассах апдейтов (TRACING_ENABLED = True)
+tracer.install(engine)
@@ -10,11 +10,31 @@ from aiogram.types import (
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from sqlalchemy import select, func
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-from database import async_session
-from models import Commission, PaymentDetails, AdminActionLog, Application, User
-from config import ADMIN_IDS, BOT_TOKEN
+from models import Commission, PaymentDetails, User
+from config import ADMIN_IDS
+from utils.user_cache import USER_CHANGED
+from middlewares.db import after_commit
+from utils.commission import commission_cache, COMMISSION_CHANGED
+from utils.payment_catalog import payment_catalog, PAYMENT_CATALOG_CHANGED
+from utils.cluster_bus import cluster_bus
+from utils.action_log import action_log
+from utils.stats import get_counters, rebuild_counters, USERS, APPLICATIONS, TURNOVER, STATUS_PREFIX
+from utils.metrics import (
+    metrics,
+    update_latency,
+    handler_latency,
+    db_statement_latency,
+    rate_fetch_latency,
+    rate_fetch_errors,
+    telegram_request_latency,
+)
+from utils.tracing import tracer
+from utils.wallet import audit_wallet_addresses
+from utils.crypto_rate import get_crypto_rate, SUPPORTED_CRYPTOS
+from utils.pricing import price_many, RUB
 import re  # Для регулярных выражений
 
 admin_router = Router()
@@ -24,12 +44,14 @@ admin_router = Router()
 # Фильтр для проверки, что сообщение от администратора
 class IsAdminMessageFilter(Filter):
     async def __call__(self, message: Message) -> bool:
-        return message.from_user.id in ADMIN_IDS
+        with tracer.span('filter.IsAdminMessageFilter'):
+            return message.from_user.id in ADMIN_IDS
 
 # Фильтр для проверки, что CallbackQuery от администратора
 class IsAdminCallbackQueryFilter(Filter):
     async def __call__(self, callback_query: CallbackQuery) -> bool:
-        return callback_query.from_user.id in ADMIN_IDS
+        with tracer.span('filter.IsAdminCallbackQueryFilter'):
+            return callback_query.from_user.id in ADMIN_IDS
 
 # --- Определение Состояний ---
 
@@ -89,7 +111,7 @@ async def admin_start(message: Message, state: FSMContext):
 
 # Хендлер для обработки нажатий в главном меню
 @admin_router.callback_query(F.data.startswith("admin_"), IsAdminCallbackQueryFilter())
-async def admin_menu_handler(callback_query: CallbackQuery, state: FSMContext):
+async def admin_menu_handler(callback_query: CallbackQuery, state: FSMContext, session: AsyncSession):
     data = callback_query.data
 
     if data == "admin_set_commission":
@@ -124,11 +146,11 @@ async def admin_menu_handler(callback_query: CallbackQuery, state: FSMContext):
         await callback_query.answer()
 
     elif data == "admin_statistics":
-        await show_statistics(callback_query, state)
+        await show_statistics(callback_query, state, session)
         await callback_query.answer()
 
     elif data == "admin_view_blocked_users":
-        await view_blocked_users(callback_query, state)
+        await view_blocked_users(callback_query, state, session)
         await callback_query.answer()
 
     elif data.startswith("admin_cancel_"):
@@ -147,41 +169,81 @@ async def admin_menu_handler(callback_query: CallbackQuery, state: FSMContext):
     else:
         await callback_query.answer("❓ Неизвестная команда.", show_alert=True)
 
+# Суммы в рублях для предпросмотра цен при изменении комиссии
+PREVIEW_AMOUNTS = (1000, 5000, 10000, 50000)
+
+async def commission_preview(commission_rate) -> str:
+    """Цены на суммы PREVIEW_AMOUNTS по текущим курсам; криптовалюты без курса пропускаются"""
+    sections = []
+    for crypto in SUPPORTED_CRYPTOS:
+        crypto = crypto.upper()
+        try:
+            rate = await get_crypto_rate(crypto)
+        except Exception:
+            continue
+        quotes = price_many(PREVIEW_AMOUNTS, RUB, crypto, rate, commission_rate)
+        lines = [f"**{crypto}** (курс `{quotes[0].rate:.2f} ₽`):"]
+        lines.extend(
+            f"`{quote.amount_rub:.0f} ₽` → `{quote.amount_crypto:.8f} {crypto}`, к оплате `{quote.amount_to_pay:.2f} ₽`"
+            for quote in quotes
+        )
+        sections.append('\n'.join(lines))
+    return '\n\n'.join(sections)
+
 # Хендлер для установки комиссии
 @admin_router.message(AdminStates.SetCommission, IsAdminMessageFilter())
-async def set_commission(message: Message, state: FSMContext):
+async def set_commission(message: Message, state: FSMContext, session: AsyncSession):
+    await state.set_state(AdminStates.MainMenu)
     try:
         new_rate = float(message.text)
         if new_rate < 0:
             raise ValueError("Комиссия не может быть отрицательной.")
-        async with async_session() as session:
-            # Проверяем, есть ли запись комиссии
-            result = await session.execute(select(Commission).order_by(Commission.id.desc()))
-            commission = result.scalar_one_or_none()
-            if not commission:
-                # Если нет, создаем новую запись
-                commission = Commission(rate=new_rate)
-                session.add(commission)
-            else:
-                # Обновляем существующую запись
-                commission.rate = new_rate
-                commission.updated_at = datetime.utcnow()
-            await session.commit()
-            await message.answer(f"✅ Новая комиссия установлена: `{new_rate}%`", parse_mode="Markdown")
-            await log_admin_action(message.from_user.id, f"Установлена комиссия: {new_rate}%")
     except ValueError:
         await message.answer("❌ Пожалуйста, введите корректное положительное число для комиссии.")
+        await message.answer("🗂 **Выберите действие:**", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
         return
+
+    # Курс запрашивается до изменений в базе, чтобы не держать транзакцию на время запроса
+    preview = await commission_preview(new_rate)
+    try:
+        # Проверяем, есть ли запись комиссии
+        result = await session.execute(select(Commission).order_by(Commission.id.desc()).limit(1))
+        commission = result.scalars().first()
+        if not commission:
+            # Если нет, создаем новую запись
+            commission = Commission(rate=new_rate)
+            session.add(commission)
+        else:
+            # Обновляем существующую запись
+            commission.rate = new_rate
+            commission.updated_at = datetime.utcnow()
+        await session.flush()
     except Exception:
+        await session.rollback()
         await message.answer("⚠️ Произошла ошибка при установке комиссии. Попробуйте позже.")
-    finally:
-        await state.set_state(AdminStates.MainMenu)
         await message.answer("🗂 **Выберите действие:**", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
+        return
+
+    # Новая ставка применяется во всех процессах бота
+    after_commit(session, lambda: cluster_bus.broadcast(COMMISSION_CHANGED, new_rate))
+
+    # Подтверждение уходит после commit: транзакция не ждёт Telegram,
+    # а при откате администратор не увидит «установлена»
+    async def finish():
+        await log_admin_action(message.from_user.id, f"Установлена комиссия: {new_rate}%")
+        await message.answer(f"✅ Новая комиссия установлена: `{new_rate}%`", parse_mode="Markdown")
+        if preview:
+            await message.answer(f"🧮 **Цены с новой комиссией:**\n\n{preview}", parse_mode="Markdown")
+        await message.answer("🗂 **Выберите действие:**", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
+
+    after_commit(session, finish)
 
 # Хендлер для добавления реквизитов
 @admin_router.message(AdminStates.AddPaymentDetails, IsAdminMessageFilter())
-async def add_payment_details(message: Message, state: FSMContext):
+async def add_payment_details(message: Message, state: FSMContext, session: AsyncSession):
     content = message.text.strip()
+    # При успехе меню отправляется после commit вместе с подтверждением
+    menu_after_commit = False
     try:
         # Разбиваем сообщение на строки
         lines = content.split('\n')
@@ -209,29 +271,36 @@ async def add_payment_details(message: Message, state: FSMContext):
             return
 
         # Сохраняем реквизиты в базу данных
-        async with async_session() as session:
-            # Проверяем, существует ли уже такой номер карты
-            existing = await session.execute(
-                select(PaymentDetails).where(PaymentDetails.card_number == card_number)
-            )
-            existing_payment = existing.scalar_one_or_none()
-            if existing_payment:
-                await message.answer("❌ Реквизиты с таким номером карты уже существуют.")
-                return
-
-            payment_detail = PaymentDetails(
-                bank_name=bank_name,
-                card_number=card_number,
-                recipient_name=recipient_name
-                # min_limit и max_limit удалены
-            )
-            session.add(payment_detail)
-            await session.commit()
-            await message.answer("✅ Реквизиты успешно добавлены.", parse_mode="Markdown")
+        # Проверяем, существует ли уже такой номер карты
+        existing = await session.execute(
+            select(PaymentDetails).where(PaymentDetails.card_number == card_number)
+        )
+        existing_payment = existing.scalar_one_or_none()
+        if existing_payment:
+            await message.answer("❌ Реквизиты с таким номером карты уже существуют.")
+            return
+
+        payment_detail = PaymentDetails(
+            bank_name=bank_name,
+            card_number=card_number,
+            recipient_name=recipient_name
+            # min_limit и max_limit удалены
+        )
+        session.add(payment_detail)
+        await session.flush()
+        after_commit(session, lambda: cluster_bus.broadcast(PAYMENT_CATALOG_CHANGED))
+
+        # Подтверждение и меню уходят после commit, не удерживая транзакцию
+        async def finish():
             await log_admin_action(
                 message.from_user.id,
                 f"Добавлены реквизиты: {bank_name}, {card_number}, ФИО получателя: {recipient_name}"
             )
+            await message.answer("✅ Реквизиты успешно добавлены.", parse_mode="Markdown")
+            await message.answer("🗂 **Выберите действие:**", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
+
+        after_commit(session, finish)
+        menu_after_commit = True
 
     except ValueError:
         await message.answer(
@@ -244,30 +313,30 @@ async def add_payment_details(message: Message, state: FSMContext):
         )
         return
     except Exception:
+        await session.rollback()
         await message.answer("⚠️ Произошла ошибка при добавлении реквизитов. Попробуйте позже.", parse_mode="Markdown")
     finally:
         await state.set_state(AdminStates.MainMenu)
-        await message.answer("🗂 **Выберите действие:**", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
+        if not menu_after_commit:
+            await message.answer("🗂 **Выберите действие:**", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
 
 # Функция для отображения меню удаления реквизитов
 async def delete_payment_details_menu(callback_query: CallbackQuery, state: FSMContext):
-    async with async_session() as session:
-        result = await session.execute(select(PaymentDetails))
-        payment_details = result.scalars().all()
-        if not payment_details:
-            await callback_query.message.edit_text("❌ Нет доступных реквизитов для удаления.", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
-            await state.set_state(AdminStates.MainMenu)
-            await log_admin_action(callback_query.from_user.id, "Удаление реквизитов: реквизиты отсутствуют")
-            return
+    payment_details = payment_catalog.details()
+    if not payment_details:
+        await callback_query.message.edit_text("❌ Нет доступных реквизитов для удаления.", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
+        await state.set_state(AdminStates.MainMenu)
+        await log_admin_action(callback_query.from_user.id, "Удаление реквизитов: реквизиты отсутствуют")
+        return
 
-        # Создаём InlineKeyboardMarkup с кнопками "Удалить" для каждого реквизита
-        inline_kb = admin_delete_payment_kb(payment_details)
+    # Создаём InlineKeyboardMarkup с кнопками "Удалить" для каждого реквизита
+    inline_kb = admin_delete_payment_kb(payment_details)
 
-        await callback_query.message.edit_text("🗑 **Выберите реквизиты для удаления:**", reply_markup=inline_kb, parse_mode="Markdown")
+    await callback_query.message.edit_text("🗑 **Выберите реквизиты для удаления:**", reply_markup=inline_kb, parse_mode="Markdown")
 
 # Хендлер для удаления реквизитов через Inline кнопки
 @admin_router.callback_query(F.data.startswith("delete_payment_"), IsAdminCallbackQueryFilter())
-async def delete_payment_callback(callback_query: CallbackQuery, state: FSMContext):
+async def delete_payment_callback(callback_query: CallbackQuery, state: FSMContext, session: AsyncSession):
     data = callback_query.data
     try:
         # Извлекаем ID реквизита
@@ -276,22 +345,22 @@ async def delete_payment_callback(callback_query: CallbackQuery, state: FSMConte
         await callback_query.answer("❌ Некорректный ID реквизита.", show_alert=True)
         return
 
-    async with async_session() as session:
-        result = await session.execute(select(PaymentDetails).where(PaymentDetails.id == detail_id))
-        payment_detail = result.scalar_one_or_none()
-        if payment_detail:
-            await session.delete(payment_detail)
-            await session.commit()
-            await callback_query.answer("✅ Реквизиты успешно удалены.", show_alert=True)
-            await log_admin_action(callback_query.from_user.id, f"Удалены реквизиты ID: {detail_id}")
-        else:
-            await callback_query.answer("❌ Реквизиты не найдены.", show_alert=True)
-            return
+    result = await session.execute(select(PaymentDetails).where(PaymentDetails.id == detail_id))
+    payment_detail = result.scalar_one_or_none()
+    if not payment_detail:
+        await callback_query.answer("❌ Реквизиты не найдены.", show_alert=True)
+        return
 
-        # Получаем оставшиеся реквизиты
-        remaining_details = await session.execute(select(PaymentDetails))
-        remaining_details = remaining_details.scalars().all()
+    await session.delete(payment_detail)
+    await session.flush()
+    after_commit(session, lambda: cluster_bus.broadcast(PAYMENT_CATALOG_CHANGED))
 
+    # Ответ и обновлённое меню уходят после commit, не удерживая транзакцию
+    async def finish():
+        await log_admin_action(callback_query.from_user.id, f"Удалены реквизиты ID: {detail_id}")
+        await callback_query.answer("✅ Реквизиты успешно удалены.", show_alert=True)
+        # Оставшиеся реквизиты (каталог перечитывается предыдущим колбэком; удалённые исключаем и при его ошибке)
+        remaining_details = [detail for detail in payment_catalog.details() if detail.id != detail_id]
         if remaining_details:
             # Создаём обновлённый InlineKeyboardMarkup
             updated_inline_kb = admin_delete_payment_kb(remaining_details)
@@ -300,61 +369,58 @@ async def delete_payment_callback(callback_query: CallbackQuery, state: FSMConte
             # Если реквизитов нет, информируем администратора и возвращаемся в главное меню
             await callback_query.message.edit_text("✅ Все реквизиты успешно удалены.", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
 
+    after_commit(session, finish)
+
 # Хендлер для кнопки "Статистика"
 @admin_router.callback_query(F.data == "admin_statistics", IsAdminCallbackQueryFilter())
-async def show_statistics(callback_query: CallbackQuery, state: FSMContext):
+async def show_statistics(callback_query: CallbackQuery, state: FSMContext, session: AsyncSession):
     try:
-        async with async_session() as session:
-            # Общий оборот: сумма amount_rub для завершённых заявок
-            result = await session.execute(
-                select(func.sum(Application.amount_rub)).where(Application.status == 'completed')
-            )
-            total_turnover = result.scalar() or 0.0
-
-            # Получение последней комиссии
-            result = await session.execute(
-                select(Commission.rate).order_by(Commission.id.desc()).limit(1)
-            )
-            latest_commission_rate = result.scalar() or 0.0
-
-            # Заработок с комиссий
-            total_commission = total_turnover * (latest_commission_rate / 100)
-
-            # Количество пользователей
-            result = await session.execute(select(func.count(User.id)))
-            user_count = result.scalar()
-
-            # Количество заявок
-            result = await session.execute(select(func.count(Application.id)))
-            total_applications = result.scalar()
-
-            # Количество заявок по статусам
-            result = await session.execute(
-                select(Application.status, func.count(Application.id)).group_by(Application.status)
-            )
-            status_counts = result.fetchall()
-
-            # Формируем строку с количеством заявок по статусам
-            status_summary = ""
-            for status, count in status_counts:
-                status_summary += f"**{status.capitalize()}**: {count}\n"
-
-            # Отправляем статистику
-            stats_message = (
-                f"📊 **Статистика за всё время:**\n\n"
-                f"**💸 Общий оборот:** `{total_turnover:.2f} ₽`\n"
-                f"**💰 Заработок с комиссий ({latest_commission_rate}%):** `{total_commission:.2f} ₽`\n"
-                f"**👥 Количество пользователей:** `{user_count}`\n"
-                f"**📄 Количество заявок:** `{total_applications}`\n\n"
-                f"**📈 Статусы заявок:**\n{status_summary}"
-            )
+        counters = await get_counters(session)
+        if not counters:
+            # Счётчики ещё не заполнялись: считаем их один раз по таблицам
+            counters = await rebuild_counters(session)
+
+        # Общий оборот: сумма amount_rub для завершённых заявок
+        total_turnover = counters.get(TURNOVER, 0.0)
+
+        # Текущая комиссия
+        latest_commission_rate = commission_cache.get()
+
+        # Заработок с комиссий
+        total_commission = total_turnover * (latest_commission_rate / 100)
+
+        # Количество пользователей и заявок
+        user_count = int(counters.get(USERS, 0))
+        total_applications = int(counters.get(APPLICATIONS, 0))
+
+        # Количество заявок по статусам
+        status_counts = [
+            (name[len(STATUS_PREFIX):], int(value))
+            for name, value in sorted(counters.items())
+            if name.startswith(STATUS_PREFIX) and value
+        ]
+
+        # Формируем строку с количеством заявок по статусам
+        status_summary = ""
+        for status, count in status_counts:
+            status_summary += f"**{status.capitalize()}**: {count}\n"
+
+        # Отправляем статистику
+        stats_message = (
+            f"📊 **Статистика за всё время:**\n\n"
+            f"**💸 Общий оборот:** `{total_turnover:.2f} ₽`\n"
+            f"**💰 Заработок с комиссий ({latest_commission_rate}%):** `{total_commission:.2f} ₽`\n"
+            f"**👥 Количество пользователей:** `{user_count}`\n"
+            f"**📄 Количество заявок:** `{total_applications}`\n\n"
+            f"**📈 Статусы заявок:**\n{status_summary}"
+        )
 
-            await callback_query.message.edit_text(
-                stats_message,
-                parse_mode="Markdown",
-                reply_markup=stats_back_kb()
-            )
-            await log_admin_action(callback_query.from_user.id, "Просмотр статистики")
+        await callback_query.message.edit_text(
+            stats_message,
+            parse_mode="Markdown",
+            reply_markup=stats_back_kb()
+        )
+        await log_admin_action(callback_query.from_user.id, "Просмотр статистики")
     except Exception:
         await callback_query.message.edit_text(
             "⚠️ Произошла ошибка при получении статистики.",
@@ -364,35 +430,34 @@ async def show_statistics(callback_query: CallbackQuery, state: FSMContext):
         await callback_query.answer("⚠️ Произошла ошибка при получении статистики.", show_alert=True)
 
 # Функция для отображения списка заблокированных пользователей
-async def view_blocked_users(callback_query: CallbackQuery, state: FSMContext):
-    async with async_session() as session:
-        result = await session.execute(select(User).where(User.is_blocked == True))
-        blocked_users = result.scalars().all()
-        if not blocked_users:
-            await callback_query.message.edit_text("✅ Нет заблокированных пользователей.", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
-            await state.set_state(AdminStates.MainMenu)
-            await log_admin_action(callback_query.from_user.id, "Просмотр заблокированных пользователей: нет пользователей")
-            return
-
-        # Формируем список заблокированных пользователей
-        blocked_list = ""
-        for user in blocked_users:
-            blocked_list += f"🔹 **ID:** `{user.id}` | **Telegram ID:** `{user.telegram_id}` | **Имя:** {user.first_name or user.username or 'Неизвестно'}\n"
-
-        blocked_message = (
-            f"🚫 **Заблокированные пользователи:**\n\n"
-            f"{blocked_list}\n"
-            f"Чтобы разблокировать пользователя, отправьте команду:\n"
-            f"`/unban <telegram_id>`\n\n"
-            f"🔙 Нажмите **Назад**, чтобы вернуться в главное меню."
-        )
+async def view_blocked_users(callback_query: CallbackQuery, state: FSMContext, session: AsyncSession):
+    result = await session.execute(select(User).where(User.is_blocked == True))
+    blocked_users = result.scalars().all()
+    if not blocked_users:
+        await callback_query.message.edit_text("✅ Нет заблокированных пользователей.", reply_markup=admin_main_menu_kb(), parse_mode="Markdown")
+        await state.set_state(AdminStates.MainMenu)
+        await log_admin_action(callback_query.from_user.id, "Просмотр заблокированных пользователей: нет пользователей")
+        return
 
-        await callback_query.message.edit_text(
-            blocked_message,
-            parse_mode="Markdown",
-            reply_markup=blocked_users_back_kb()
-        )
-        await log_admin_action(callback_query.from_user.id, "Просмотр заблокированных пользователей")
+    # Формируем список заблокированных пользователей
+    blocked_list = ""
+    for user in blocked_users:
+        blocked_list += f"🔹 **ID:** `{user.id}` | **Telegram ID:** `{user.telegram_id}` | **Имя:** {user.first_name or user.username or 'Неизвестно'}\n"
+
+    blocked_message = (
+        f"🚫 **Заблокированные пользователи:**\n\n"
+        f"{blocked_list}\n"
+        f"Чтобы разблокировать пользователя, отправьте команду:\n"
+        f"`/unban <telegram_id>`\n\n"
+        f"🔙 Нажмите **Назад**, чтобы вернуться в главное меню."
+    )
+
+    await callback_query.message.edit_text(
+        blocked_message,
+        parse_mode="Markdown",
+        reply_markup=blocked_users_back_kb()
+    )
+    await log_admin_action(callback_query.from_user.id, "Просмотр заблокированных пользователей")
 
 # Хендлер для кнопки "Назад" из статистики и заблокированных пользователей
 @admin_router.callback_query(F.data == "admin_back_main_menu", IsAdminCallbackQueryFilter())
@@ -404,7 +469,7 @@ async def back_to_main_menu(callback_query: CallbackQuery, state: FSMContext):
 
 # Хендлер для команды /unban ID
 @admin_router.message(Command("unban"), IsAdminMessageFilter())
-async def unban_user(message: Message, state: FSMContext):
+async def unban_user(message: Message, state: FSMContext, bot: Bot, session: AsyncSession):
     try:
         # Извлекаем telegram_id из команды
         parts = message.text.split()
@@ -417,45 +482,129 @@ async def unban_user(message: Message, state: FSMContext):
         await message.answer("❌ Неправильный формат команды.\n\nИспользуйте: `/unban <telegram_id>`", parse_mode="Markdown")
         return
 
-    async with async_session() as session:
-        # Ищем пользователя по telegram_id
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-        user = result.scalar_one_or_none()
-        if not user:
-            await message.answer(f"❌ Пользователь с Telegram ID `{telegram_id}` не найден.", parse_mode="Markdown")
-            return
+    # Ищем пользователя по telegram_id
+    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    user = result.scalar_one_or_none()
+    if not user:
+        await message.answer(f"❌ Пользователь с Telegram ID `{telegram_id}` не найден.", parse_mode="Markdown")
+        return
 
-        if not user.is_blocked:
-            await message.answer(f"ℹ️ Пользователь `{telegram_id}` не заблокирован.", parse_mode="Markdown")
-            return
+    if not user.is_blocked:
+        await message.answer(f"ℹ️ Пользователь `{telegram_id}` не заблокирован.", parse_mode="Markdown")
+        return
 
-        # Разблокируем пользователя
-        user.is_blocked = False
-        await session.commit()
-        await message.answer(f"✅ Пользователь `{telegram_id}` успешно разблокирован.", parse_mode="Markdown")
-        await log_admin_action(message.from_user.id, f"Разблокирован пользователь Telegram ID: {telegram_id}")
+    # Разблокируем пользователя
+    user.is_blocked = False
+    await session.flush()
+    after_commit(session, lambda: cluster_bus.broadcast(USER_CHANGED, telegram_id))
 
+    # Подтверждение и уведомление уходят после commit, не удерживая транзакцию
+    async def finish():
+        await log_admin_action(message.from_user.id, f"Разблокирован пользователь Telegram ID: {telegram_id}")
+        await message.answer(f"✅ Пользователь `{telegram_id}` успешно разблокирован.", parse_mode="Markdown")
         # Уведомляем пользователя о разблокировке (если требуется)
-        bot = Bot(token=BOT_TOKEN)
         try:
             await bot.send_message(
-                user.telegram_id,
+                telegram_id,
                 "✅ Ваш доступ к боту был восстановлен. Теперь вы можете пользоваться всеми функциями.",
                 parse_mode="Markdown"
             )
         except Exception:
             pass  # Можно добавить обработку ошибок, если необходимо
-        finally:
-            await bot.close()
+
+    after_commit(session, finish)
+
+# Хендлер для команды /rebuild_stats — полный пересчёт счётчиков статистики
+@admin_router.message(Command("rebuild_stats"), IsAdminMessageFilter())
+async def rebuild_statistics(message: Message, state: FSMContext, session: AsyncSession):
+    try:
+        counters = await rebuild_counters(session)
+        await session.flush()
+    except Exception:
+        await session.rollback()
+        await message.answer("⚠️ Произошла ошибка при пересчёте статистики. Попробуйте позже.")
+        return
+    await message.answer(
+        f"✅ Статистика пересчитана.\n\n"
+        f"**👥 Пользователей:** `{int(counters[USERS])}`\n"
+        f"**📄 Заявок:** `{int(counters[APPLICATIONS])}`",
+        parse_mode="Markdown"
+    )
+    await log_admin_action(message.from_user.id, "Пересчёт статистики")
+
+# Хендлер для команды /audit_wallets — перепроверка адресов кошельков во всех заявках
+@admin_router.message(Command("audit_wallets"), IsAdminMessageFilter())
+async def audit_wallets(message: Message, state: FSMContext):
+    audit = await audit_wallet_addresses()
+    kinds = ", ".join(f"{kind}: {count}" for kind, count in audit.kinds.most_common()) or "нет"
+    text = (
+        f"🔎 **Проверка адресов кошельков**\n\n"
+        f"**Заявок проверено:** `{audit.checked}`\n"
+        f"**Типы адресов:** {kinds}\n"
+        f"**Некорректных адресов:** `{len(audit.invalid)}`\n"
+    )
+    # Первые 20 заявок, чтобы сообщение уложилось в лимит длины Telegram
+    limit = 20
+    if audit.invalid:
+        text += "\n"
+        for application_id, crypto, address, error in audit.invalid[:limit]:
+            # Адрес и текст ошибки - в code span: в них бывают _ и *, ломающие разметку Markdown
+            address = address[:64].replace('`', "'")
+            error = str(error).replace('`', "'")
+            text += f"#{application_id} {crypto} `{address}` — `{error}`\n"
+        if len(audit.invalid) > limit:
+            text += f"... и ещё {len(audit.invalid) - limit}\n"
+    await message.answer(text, parse_mode="Markdown")
+    await log_admin_action(message.from_user.id, f"Проверка адресов кошельков: {len(audit.invalid)} некорректных")
+
+# Хендлер для команды /metrics — сводка метрик текущего процесса
+@admin_router.message(Command("metrics"), IsAdminMessageFilter())
+async def show_metrics(message: Message, state: FSMContext):
+    await message.answer(await format_metrics_summary(), parse_mode="Markdown")
+    await log_admin_action(message.from_user.id, "Просмотр метрик")
+
+def format_latency_lines(histogram, limit: int = 10) -> str:
+    # Самые затратные серии по суммарному времени: число, среднее и p95 в мс
+    series = sorted(histogram.series().items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    lines = ""
+    for label_values, (count, total) in series:
+        name = '.'.join(str(value).replace('handlers.', '') for value in label_values) or 'all'
+        lines += (
+            f"`{name}`: {count} шт., ср. `{total / count * 1000:.1f}` мс, "
+            f"p95 `{histogram.quantile(0.95, *label_values) * 1000:.1f}` мс\n"
+        )
+    return lines or "нет данных\n"
+
+async def format_metrics_summary() -> str:
+    collected = await metrics.collect()
+    user_cache_stats = collected.get('user_cache', {})
+    rate_cache_stats = collected.get('rate_cache', {})
+    fsm_stats = collected.get('fsm', {})
+    queue_stats = collected.get('telegram_queue', {})
+
+    states = "".join(
+        f"`{name}`: {count}\n" for name, count in sorted(fsm_stats.get('states', {}).items())
+    ) or "нет активных\n"
+
+    return (
+        f"📈 **Метрики процесса**\n\n"
+        f"**Апдейты:**\n{format_latency_lines(update_latency)}\n"
+        f"**Хендлеры:**\n{format_latency_lines(handler_latency)}\n"
+        f"**SQL-запросы:**\n{format_latency_lines(db_statement_latency)}\n"
+        f"**Курсы CoinGecko:**\n{format_latency_lines(rate_fetch_latency)}"
+        f"ошибок: {int(rate_fetch_errors.value())}\n\n"
+        f"**Bot API:**\n{format_latency_lines(telegram_request_latency)}"
+        f"очередь отправки: {queue_stats.get('queue_depth', 0)}, "
+        f"ср. ожидание `{queue_stats.get('avg_latency', 0.0) * 1000:.1f}` мс\n\n"
+        f"**Кэши (доля попаданий):**\n"
+        f"пользователи: `{user_cache_stats.get('hit_ratio', 0.0):.1%}`, "
+        f"курсы: `{rate_cache_stats.get('hit_ratio', 0.0):.1%}`, "
+        f"FSM в памяти: {fsm_stats.get('cached', 0)}\n\n"
+        f"**Состояния FSM:**\n{states}"
+    )
 
 # --- Функция для Логирования Действий ---
 
 async def log_admin_action(admin_id: int, action: str):
-    async with async_session() as session:
-        log_entry = AdminActionLog(
-            admin_id=admin_id,
-            action=action,
-            timestamp=datetime.utcnow()
-        )
-        session.add(log_entry)
-        await session.commit()
+    # Запись попадает в буфер и сохраняется в базу пакетом
+    action_log.log_admin(admin_id, action)
@@ -10,23 +10,32 @@ from aiogram.types import (
 from aiogram.filters import Command, BaseFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from sqlalchemy import select, func
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo  # Для работы с часовыми поясами
-from database import async_session
-from models import User, Commission, PaymentDetails, Application
+from models import User, Application
 from utils.captcha import generate_captcha, verify_captcha
 from config import (
     CAPTCHA_TIMEOUT,
-    COMMISSION_RATE,
     ADMIN_USERNAME,
     ADMIN_IDS,  # Добавляем список администраторов
     WORKER_ID,
-    BOT_TOKEN,
+    QUOTE_TTL,
 )
 from utils.crypto_rate import get_crypto_rate
+from utils.user_cache import get_cached_user, cache_user, USER_CHANGED
+from utils.commission import commission_cache
+from utils.payment_catalog import payment_catalog
+from utils.action_log import action_log
+from utils.cluster_bus import cluster_bus
+from utils.wallet import check_wallet_address
+from utils.pricing import Quote, make_quote, to_decimal
+from utils.tracing import tracer
+from utils.stats import record_user_created, record_application_created, record_status_change, get_user_stats
+from middlewares.db import after_commit
 import re
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 
 user_router = Router()
 
@@ -45,13 +54,9 @@ class BuyCryptoStates(StatesGroup):
 
 # Кастомный фильтр для проверки, что пользователь не заблокирован
 class IsNotBlocked(BaseFilter):
-    async def __call__(self, message: Message):
-        telegram_id = message.from_user.id
-        async with async_session() as session:
-            result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = result.scalar_one_or_none()
+    async def __call__(self, message: Message, session: AsyncSession):
+        with tracer.span('filter.IsNotBlocked'):
+            user = await get_cached_user(message.from_user.id, session)
             if user and user.is_blocked:
                 await message.answer("⛔ Ваш доступ к боту заблокирован.")
                 return False
@@ -80,81 +85,67 @@ async def delete_message(bot: Bot, chat_id: int, message_id: int):
 
 # Хендлер для команды /start
 @user_router.message(Command('start'))
-async def user_start(message: Message, state: FSMContext):
+async def user_start(message: Message, state: FSMContext, session: AsyncSession):
     telegram_id = message.from_user.id
     first_name = message.from_user.first_name
     username = message.from_user.username
-    async with async_session() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
-        )
-        user = result.scalar_one_or_none()
-        if not user:
-            # Новый пользователь
-            user = User(telegram_id=telegram_id, first_name=first_name, username=username)
-            session.add(user)
-            try:
-                await session.commit()
-            except Exception:
-                await session.rollback()
-                await message.answer("❌ Произошла ошибка при регистрации. Попробуйте снова позже.")
-                return
-        else:
-            # Обновляем данные пользователя
-            user.first_name = first_name
-            user.username = username
-            try:
-                await session.commit()
-            except Exception:
-                await session.rollback()
-                await message.answer("❌ Произошла ошибка. Попробуйте снова позже.")
-                return
-
-        if user.is_blocked:
-            await message.answer("⛔ Ваш доступ к боту заблокирован.")
+    result = await session.execute(
+        select(User).where(User.telegram_id == telegram_id)
+    )
+    user = result.scalar_one_or_none()
+    if not user:
+        # Новый пользователь
+        user = User(telegram_id=telegram_id, first_name=first_name, username=username)
+        session.add(user)
+        try:
+            await session.flush()
+            # Счётчик - после flush: autoflush внутри его upsert вставил бы пользователя вне try,
+            # и ошибка (например, дубль telegram_id при двух /start подряд) не была бы обработана
+            await record_user_created(session)
+        except Exception:
+            await session.rollback()
+            await message.answer("❌ Произошла ошибка при регистрации. Попробуйте снова позже.")
             return
+    else:
+        # Обновляем данные пользователя
+        user.first_name = first_name
+        user.username = username
+    after_commit(session, lambda: cache_user(user))
+    action_log.log_user(telegram_id, "Команда /start")
+
+    if user.is_blocked:
+        await message.answer("⛔ Ваш доступ к боту заблокирован.")
+        return
 
-        await message.answer("👋 Добро пожаловать в обменник криптовалют!")
+    await message.answer("👋 Добро пожаловать в обменник криптовалют!")
 
-        now = datetime.utcnow()
-        last_action = (
-            user.last_action
-            if user.last_action
-            else now - timedelta(minutes=CAPTCHA_TIMEOUT + 1)
-        )
+    now = datetime.utcnow()
+    last_action = (
+        user.last_action
+        if user.last_action
+        else now - timedelta(minutes=CAPTCHA_TIMEOUT + 1)
+    )
 
-        if now - last_action > timedelta(minutes=CAPTCHA_TIMEOUT):
-            # Генерируем капчу
-            captcha_code = await generate_captcha()
-            user.captcha_code = captcha_code
-            user.captcha_expiration = now + timedelta(minutes=CAPTCHA_TIMEOUT)
-            try:
-                await session.commit()
-            except Exception:
-                await session.rollback()
-                await message.answer("❌ Произошла ошибка. Попробуйте снова позже.")
-                return
-
-            sent_message = await message.answer(
-                f"🔒 Пожалуйста, введите капчу для подтверждения:\n\n**{captcha_code}**",
-                parse_mode="Markdown"
-            )
-            await state.update_data(last_message_id=sent_message.message_id)
-            await state.set_state(CaptchaStates.WaitingForCaptcha)
-        else:
-            # Продолжаем работу
-            user.last_action = now
-            try:
-                await session.commit()
-            except Exception:
-                await session.rollback()
-                await message.answer("❌ Произошла ошибка. Попробуйте снова позже.")
-                return
-            await main_menu(message, state)
+    if now - last_action > timedelta(minutes=CAPTCHA_TIMEOUT):
+        # Генерируем капчу
+        captcha_code = await generate_captcha()
+        user.captcha_code = captcha_code
+        user.captcha_expiration = now + timedelta(minutes=CAPTCHA_TIMEOUT)
+
+        sent_message = await message.answer(
+            f"🔒 Пожалуйста, введите капчу для подтверждения:\n\n**{captcha_code}**",
+            parse_mode="Markdown"
+        )
+        await state.update_data(last_message_id=sent_message.message_id)
+        await state.set_state(CaptchaStates.WaitingForCaptcha)
+    else:
+        # Продолжаем работу
+        user.last_action = now
+        await main_menu(message, state)
 
 # Хендлер для обработки капчи
 @user_router.message(CaptchaStates.WaitingForCaptcha)
-async def process_captcha(message: Message, state: FSMContext):
+async def process_captcha(message: Message, state: FSMContext, session: AsyncSession):
     telegram_id = message.from_user.id
     user_data = await state.get_data()
     last_message_id = user_data.get('last_message_id')
@@ -163,54 +154,43 @@ async def process_captcha(message: Message, state: FSMContext):
     if last_message_id:
         await remove_buttons(message.bot, message.chat.id, last_message_id)
 
-    async with async_session() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
-        )
-        user = result.scalar_one_or_none()
+    result = await session.execute(
+        select(User).where(User.telegram_id == telegram_id)
+    )
+    user = result.scalar_one_or_none()
 
-        if not user or not user.captcha_code:
-            sent_message = await message.answer("❌ Капча не найдена. Пожалуйста, начните снова командой /start.")
-            await state.update_data(last_message_id=sent_message.message_id)
-            return
+    if not user or not user.captcha_code:
+        sent_message = await message.answer("❌ Капча не найдена. Пожалуйста, начните снова командой /start.")
+        await state.update_data(last_message_id=sent_message.message_id)
+        return
 
-        now = datetime.utcnow()
+    now = datetime.utcnow()
 
-        if now > user.captcha_expiration:
-            # Капча истекла
-            captcha_code = await generate_captcha()
-            user.captcha_code = captcha_code
-            user.captcha_expiration = now + timedelta(minutes=CAPTCHA_TIMEOUT)
-            try:
-                await session.commit()
-            except Exception:
-                await session.rollback()
-                await message.answer("❌ Произошла ошибка. Попробуйте снова позже.")
-                return
-
-            sent_message = await message.answer(
-                f"⏰ Капча истекла. Пожалуйста, введите новую капчу:\n\n**{captcha_code}**",
-                parse_mode="Markdown"
-            )
-            await state.update_data(last_message_id=sent_message.message_id)
-            return
+    if now > user.captcha_expiration:
+        # Капча истекла
+        captcha_code = await generate_captcha()
+        user.captcha_code = captcha_code
+        user.captcha_expiration = now + timedelta(minutes=CAPTCHA_TIMEOUT)
 
-        if verify_captcha(message.text, user.captcha_code):
-            # Капча верна
-            user.captcha_code = None
-            user.captcha_expiration = None
-            user.last_action = now
-            try:
-                await session.commit()
-            except Exception:
-                await session.rollback()
-                await message.answer("❌ Произошла ошибка. Попробуйте снова позже.")
-                return
-            await message.answer("✅ Капча введена верно! Добро пожаловать.")
-            await main_menu(message, state)
-        else:
-            sent_message = await message.answer("❌ Неверная капча. Пожалуйста, попробуйте снова.")
-            await state.update_data(last_message_id=sent_message.message_id)
+        sent_message = await message.answer(
+            f"⏰ Капча истекла. Пожалуйста, введите новую капчу:\n\n**{captcha_code}**",
+            parse_mode="Markdown"
+        )
+        await state.update_data(last_message_id=sent_message.message_id)
+        return
+
+    if verify_captcha(message.text, user.captcha_code):
+        # Капча верна
+        user.captcha_code = None
+        user.captcha_expiration = None
+        user.last_action = now
+        after_commit(session, lambda: cache_user(user))
+        action_log.log_user(telegram_id, "Капча пройдена")
+        await message.answer("✅ Капча введена верно! Добро пожаловать.")
+        await main_menu(message, state)
+    else:
+        sent_message = await message.answer("❌ Неверная капча. Пожалуйста, попробуйте снова.")
+        await state.update_data(last_message_id=sent_message.message_id)
 
 # Функция для отображения главного меню
 async def main_menu(message: Message, state: FSMContext):
@@ -236,7 +216,7 @@ def main_menu_inline_keyboard():
 
 # Хендлер для выбора действия в главном меню
 @user_router.callback_query(CaptchaStates.MainMenu, IsNotBlocked())
-async def main_menu_selection_callback(callback_query: CallbackQuery, state: FSMContext):
+async def main_menu_selection_callback(callback_query: CallbackQuery, state: FSMContext, session: AsyncSession):
     data = callback_query.data
     await callback_query.answer()
 
@@ -249,7 +229,7 @@ async def main_menu_selection_callback(callback_query: CallbackQuery, state: FSM
     if data == "menu_buy_crypto":
         await buy_crypto_start(callback_query.message, state)
     elif data == "menu_profile":
-        await personal_account(callback_query.message, state)
+        await personal_account(callback_query.message, state, session)
     else:
         # Если действие неизвестно, возвращаем в главное меню
         await main_menu(callback_query.message, state)
@@ -298,6 +278,34 @@ async def choose_crypto_callback(callback_query: CallbackQuery, state: FSMContex
     await state.update_data(last_message_id=sent_message.message_id)
     await state.set_state(BuyCryptoStates.EnterAmount)
 
+# Сумма и необязательная валюта: "0.00041 BTC", "1000 ₽" или просто "1000"
+AMOUNT_PATTERN = re.compile(r'^(\d+(\.\d+)?)\s*(BTC|LTC|₽)?$', re.IGNORECASE)
+
+def parse_amount(text):
+    """Разбирает ввод суммы: возвращает (сумма Decimal, валюта или None) либо None, если ввод некорректен"""
+    match = AMOUNT_PATTERN.match(text)
+    if not match:
+        return None
+    currency = match.group(3).upper() if match.group(3) else None
+    return Decimal(match.group(1)), currency
+
+def stored_quote(user_data):
+    """Цена, зафиксированная в enter_amount, из данных FSM"""
+    quote = user_data.get('quote')
+    if quote is not None:
+        return Quote.from_dict(quote)
+    if 'amount_to_pay' in user_data:
+        # Сценарий начат до появления фиксированных цен: суммы уже показаны пользователю,
+        # поэтому они сохраняются в заявку, но цена считается истёкшей
+        commission = to_decimal(user_data['commission'])
+        amount_to_pay = to_decimal(user_data['amount_to_pay'])
+        return Quote(
+            user_data['crypto'], to_decimal(user_data['crypto_rub_rate']), to_decimal(commission_cache.get()),
+            to_decimal(user_data['amount_crypto']), amount_to_pay - commission, commission, amount_to_pay,
+            user_data['is_rub'], 0.0,
+        )
+    return None
+
 # Хендлер для ввода суммы
 @user_router.message(BuyCryptoStates.EnterAmount)
 async def enter_amount(message: Message, state: FSMContext):
@@ -310,14 +318,13 @@ async def enter_amount(message: Message, state: FSMContext):
         await remove_buttons(message.bot, message.chat.id, last_message_id)
 
     # Разделение суммы и валюты
-    match = re.match(r'^(\d+(\.\d+)?)\s*(BTC|LTC|₽)?$', user_input, re.IGNORECASE)
-    if not match:
+    parsed = parse_amount(user_input)
+    if parsed is None:
         sent_message = await message.answer("❌ Пожалуйста, введите корректную сумму.\nНапример: 0.00041 BTC или 1000 ₽")
         await state.update_data(last_message_id=sent_message.message_id)
         return
 
-    amount = float(match.group(1))
-    currency = match.group(3).upper() if match.group(3) else None
+    amount, currency = parsed
 
     if amount <= 0:
         sent_message = await message.answer("❌ Сумма должна быть положительной.")
@@ -335,69 +342,28 @@ async def enter_amount(message: Message, state: FSMContext):
         await state.update_data(last_message_id=sent_message.message_id)
         return
 
-    # Получаем комиссию из базы данных
-    async with async_session() as session:
-        result = await session.execute(
-            select(Commission).order_by(Commission.id.desc())
-        )
-        commission_entry = result.scalar_one_or_none()
-        if commission_entry:
-            commission_rate = commission_entry.rate
-        else:
-            commission_rate = COMMISSION_RATE  # Значение по умолчанию из config.py
-
-    commission_rate_percent = commission_rate / 100
-
-    if currency == "₽":
-        # Пользователь ввёл сумму в RUB
-        amount_rub = amount
-        commission = amount_rub * commission_rate_percent
-        amount_to_pay = amount_rub + commission  # Добавляем комиссию к сумме оплаты
-        amount_crypto = amount_rub / crypto_rub_rate
-        is_rub = True
-    elif currency in ["BTC", "LTC"]:
-        # Пользователь ввёл сумму в криптовалюте
-        amount_crypto = amount
-        amount_rub_before_commission = amount_crypto * crypto_rub_rate
-        commission = amount_rub_before_commission * commission_rate_percent
-        amount_to_pay = amount_rub_before_commission + commission  # Добавляем комиссию к сумме оплаты
-        amount_rub = amount_to_pay
-        is_rub = False
-    else:
-        # Пользователь не указал валюту, предполагаем рубли, если сумма >=1
-        if amount >= 1:
-            amount_rub = amount
-            commission = amount_rub * commission_rate_percent
-            amount_to_pay = amount_rub + commission
-            amount_crypto = amount_rub / crypto_rub_rate
-            is_rub = True
-        else:
-            amount_crypto = amount
-            amount_rub_before_commission = amount_crypto * crypto_rub_rate
-            commission = amount_rub_before_commission * commission_rate_percent
-            amount_to_pay = amount_rub_before_commission + commission
-            amount_rub = amount_to_pay
-            is_rub = False
-
-    # Сохраняем данные в состоянии
-    await state.update_data(
-        amount_crypto=amount_crypto,
-        amount_rub=amount_rub,
-        commission=commission,
-        amount_to_pay=amount_to_pay,
-        crypto_rub_rate=crypto_rub_rate,
-        is_rub=is_rub,
-    )
+    # Фиксируем цену по текущему курсу и комиссии (из памяти, либо значение по умолчанию из config.py)
+    try:
+        quote = make_quote(amount, currency, crypto, crypto_rub_rate, commission_cache.get())
+    except InvalidOperation:
+        quote = None
+    if quote is None or quote.amount_crypto <= 0 or quote.amount_rub <= 0:
+        sent_message = await message.answer("❌ Сумма слишком мала или слишком велика. Введите другую сумму.")
+        await state.update_data(last_message_id=sent_message.message_id)
+        return
+
+    # Сохраняем цену в состоянии: следующие шаги используют её, не пересчитывая
+    await state.update_data(quote=quote.to_dict())
 
     # Формирование красиво отформатированного сообщения
     message_text = (
-        f"💰 **Вы получите:** `{amount_crypto:.8f} {crypto}`\n"
-        f"💵 **К оплате:** `{amount_to_pay:.2f} ₽`"
+        f"💰 **Вы получите:** `{quote.amount_crypto:.8f} {crypto}`\n"
+        f"💵 **К оплате:** `{quote.amount_to_pay:.2f} ₽`"
     )
 
     # Получаем доступные способы оплаты
     try:
-        payment_methods = await get_payment_methods()
+        payment_methods = get_payment_methods()
     except Exception:
         sent_message = await message.answer("⚠️ Не удалось получить способы оплаты. Попробуйте позже.")
         await state.update_data(last_message_id=sent_message.message_id)
@@ -413,11 +379,8 @@ async def enter_amount(message: Message, state: FSMContext):
     await state.update_data(last_message_id=sent_message.message_id)
 
 # Функция для получения способов оплаты
-async def get_payment_methods():
-    async with async_session() as session:
-        result = await session.execute(select(PaymentDetails.bank_name).distinct())
-        methods = [row[0] for row in result.fetchall()]
-        return methods
+def get_payment_methods():
+    return payment_catalog.methods()
 
 # Инлайн-клавиатура выбора способов оплаты
 def payment_methods_inline_keyboard(methods):
@@ -448,7 +411,7 @@ async def choose_payment_method_callback(callback_query: CallbackQuery, state: F
     if data.startswith("payment_method_"):
         payment_method = data[len("payment_method_"):].replace('_', ' ')
         # Проверяем, что способ оплаты доступен
-        payment_methods = await get_payment_methods()
+        payment_methods = get_payment_methods()
         if payment_method not in payment_methods:
             sent_message = await callback_query.message.answer("❌ Пожалуйста, выберите способ оплаты из списка.")
             await state.update_data(last_message_id=sent_message.message_id)
@@ -464,10 +427,10 @@ async def choose_payment_method_callback(callback_query: CallbackQuery, state: F
 
     await state.update_data(payment_method=payment_method)
     user_data = await state.get_data()
-    amount_to_pay = user_data['amount_to_pay']
+    quote = stored_quote(user_data)
     crypto = user_data['crypto']
     sent_message = await callback_query.message.answer(
-        f"🔑 Для получения `{user_data['amount_crypto']:.8f} {crypto}`\n"
+        f"🔑 Для получения `{quote.amount_crypto:.8f} {crypto}`\n"
         f"🖥 Укажите адрес вашего `{crypto}` кошелька, куда будут направлены средства:",
         reply_markup=cancel_inline_keyboard(callback_data="cancel_choose_payment_method"),
         parse_mode="Markdown"
@@ -488,22 +451,33 @@ async def enter_wallet_address(message: Message, state: FSMContext):
 
     crypto = user_data['crypto']
 
-    # Проверка валидности адреса кошелька
-    if not validate_wallet_address(wallet_address, crypto):
+    # Проверка адреса кошелька с контрольной суммой
+    wallet_check = check_wallet_address(wallet_address, crypto)
+    if not wallet_check.valid:
         sent_message = await message.answer(
-            f"❌ Некорректный `{crypto}` адрес, попробуйте еще раз.",
+            f"❌ Некорректный `{crypto}` адрес: {wallet_check.error}. Попробуйте еще раз.",
             reply_markup=cancel_inline_keyboard(callback_data="cancel_enter_wallet_address_error"),
             parse_mode="Markdown"
         )
         await state.update_data(last_message_id=sent_message.message_id)
         return
 
+    # Реквизиты показываются только по действующей цене: за QUOTE_TTL курс мог заметно измениться
+    quote = stored_quote(user_data)
+    if quote.is_expired():
+        sent_message = await message.answer(
+            f"⌛ Цена действует {QUOTE_TTL // 60} минут и уже устарела. Введите сумму заново:",
+            reply_markup=cancel_inline_keyboard(callback_data="cancel_choose_crypto"),
+        )
+        await state.update_data(last_message_id=sent_message.message_id)
+        await state.set_state(BuyCryptoStates.EnterAmount)
+        return
+
     await state.update_data(wallet_address=wallet_address)
 
     # Получаем реквизиты оплаты
     payment_method = user_data['payment_method']
-    payment_details = await get_payment_details(payment_method)
-    amount_to_pay = user_data['amount_to_pay']
+    payment_details = get_payment_details(payment_method)
 
     if not payment_details:
         sent_message = await message.answer("⚠️ Реквизиты не найдены. Обратитесь к администратору.")
@@ -519,7 +493,7 @@ async def enter_wallet_address(message: Message, state: FSMContext):
         f"**Банк получатель:** {payment_details['bank_name']}\n"
         f"**ФИО получателя:** {payment_details['recipient_name']}\n"
         f"**Номер карты:** `{payment_details['card_number']}`\n"
-        f"💵 **К оплате:** `{amount_to_pay:.2f} ₽`"
+        f"💵 **К оплате:** `{quote.amount_to_pay:.2f} ₽`"
     )
 
     sent_message = await message.answer(
@@ -530,33 +504,17 @@ async def enter_wallet_address(message: Message, state: FSMContext):
     await state.update_data(last_message_id=sent_message.message_id)
     await state.set_state(BuyCryptoStates.ConfirmPayment)
 
-# Функция для проверки валидности адреса кошелька
-def validate_wallet_address(address, crypto):
-    # Улучшенная валидация с использованием регулярных выражений
-    patterns = {
-        "BTC": r'^(1|3|bc1)[a-zA-Z0-9]{25,39}$',
-        "LTC": r'^(L|M|ltc1)[a-zA-Z0-9]{25,39}$',
-    }
-    pattern = patterns.get(crypto)
-    if not pattern:
-        return False
-    return re.match(pattern, address) is not None
-
 # Функция для получения реквизитов оплаты
-async def get_payment_details(payment_method):
-    async with async_session() as session:
-        result = await session.execute(
-            select(PaymentDetails).where(PaymentDetails.bank_name == payment_method)
-        )
-        payment_detail = result.scalar_one_or_none()
-        if payment_detail:
-            return {
-                'bank_name': payment_detail.bank_name,
-                'card_number': payment_detail.card_number,
-                'recipient_name': payment_detail.recipient_name,
-            }
-        else:
-            return None
+def get_payment_details(payment_method):
+    payment_detail = payment_catalog.details_for(payment_method)
+    if payment_detail:
+        return {
+            'bank_name': payment_detail.bank_name,
+            'card_number': payment_detail.card_number,
+            'recipient_name': payment_detail.recipient_name,
+        }
+    else:
+        return None
 
 # Функция для создания Inline-клавиатуры подтверждения оплаты
 def payment_confirmation_inline_keyboard():
@@ -573,10 +531,20 @@ def payment_confirmation_inline_keyboard():
 
 # Хендлер для кнопки "Оплатил"
 @user_router.callback_query(F.data == "payment_confirmed")
-async def payment_confirmed(callback_query: CallbackQuery, state: FSMContext):
+async def payment_confirmed(callback_query: CallbackQuery, state: FSMContext, session: AsyncSession):
     await callback_query.answer()
     user_data = await state.get_data()
-    amount_to_pay = user_data['amount_to_pay']
+    quote = stored_quote(user_data)
+    if quote is None or 'payment_details' not in user_data:
+        # Повторное нажатие после оформления заявки или сценарий, брошенный дольше FSM_STATE_TTL
+        await remove_buttons(callback_query.message.bot, callback_query.message.chat.id, callback_query.message.message_id)
+        await callback_query.message.answer(
+            "⌛ Цена по этой заявке больше не действует: заявка уже оформлена или сценарий устарел. "
+            "Начните покупку заново из главного меню."
+        )
+        await main_menu(callback_query.message, state)
+        await state.set_state(CaptchaStates.MainMenu)
+        return
     payment_details = user_data['payment_details']
     bank_name = payment_details['bank_name']
     card_number = payment_details['card_number']
@@ -593,7 +561,7 @@ async def payment_confirmed(callback_query: CallbackQuery, state: FSMContext):
 
     # Формируем красиво отформатированное сообщение
     new_message_text = (
-        f"✅ **Оплата получена:** `{amount_to_pay:.2f} ₽` в {current_time} по МСК\n\n"
+        f"✅ **Оплата получена:** `{quote.amount_to_pay:.2f} ₽` в {current_time} по МСК\n\n"
         f"**🏦 Банк получатель:** {bank_name}\n"
         f"**ФИО получателя:** {recipient_name}\n"
         f"**Номер карты:** `{card_number}`\n\n"
@@ -616,7 +584,7 @@ async def payment_confirmed(callback_query: CallbackQuery, state: FSMContext):
     await state.update_data(last_message_id=sent_message.message_id)
 
     # Сохраняем информацию о заявке в базе данных
-    await confirm_payment(callback_query.message, state)
+    await confirm_payment(callback_query.message, state, session)
 
     await state.clear()
 
@@ -631,6 +599,8 @@ async def payment_cancelled(callback_query: CallbackQuery, state: FSMContext):
     if last_message_id:
         await remove_buttons(callback_query.message.bot, callback_query.message.chat.id, last_message_id)
 
+    action_log.log_user(callback_query.from_user.id, "Отказ от оплаты")
+
     # Улучшенное сообщение
     cancellation_message = (
         "❗️ **Отказ от оплаты**\n\n"
@@ -645,91 +615,84 @@ async def payment_cancelled(callback_query: CallbackQuery, state: FSMContext):
     await state.set_state(CaptchaStates.MainMenu)
 
 # Функция подтверждения платежа и уведомления воркера
-async def confirm_payment(message: Message, state: FSMContext):
+async def confirm_payment(message: Message, state: FSMContext, session: AsyncSession):
     user_data = await state.get_data()
     crypto = user_data['crypto']
     payment_method = user_data['payment_method']
     wallet_address = user_data['wallet_address']
-    amount_to_pay = user_data['amount_to_pay']
-    amount_crypto = user_data['amount_crypto']
-    crypto_rub_rate = user_data['crypto_rub_rate']
+    # Пользователь уже оплатил показанную сумму: заявка создаётся по зафиксированной цене
+    quote = stored_quote(user_data)
     telegram_id = message.chat.id
 
-    async with async_session() as session:
-        # Получаем пользователя
-        result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
-        )
-        user = result.scalar_one_or_none()
-        if not user:
-            # Регистрируем пользователя
-            user = User(telegram_id=telegram_id, first_name=message.from_user.first_name, username=message.from_user.username)
-            session.add(user)
-            try:
-                await session.commit()
-            except Exception:
-                await session.rollback()
-                await message.answer("❌ Произошла ошибка при регистрации. Попробуйте снова позже.")
-                return
-
-        # Создаем заявку
-        application = Application(
-            user_id=user.id,
-            crypto_type=crypto,
-            amount=Decimal(amount_crypto),
-            amount_rub=Decimal(amount_to_pay),
-            crypto_rub_rate=Decimal(crypto_rub_rate),
-            wallet_address=wallet_address,
-            payment_method=payment_method,
-            status='pending',
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow(),
-        )
-        session.add(application)
+    # Получаем пользователя из кэша
+    user = await get_cached_user(telegram_id, session)
+
+    if not user:
+        # Регистрируем пользователя
+        user = User(telegram_id=telegram_id, first_name=message.chat.first_name, username=message.chat.username)
+        session.add(user)
         try:
-            await session.commit()
+            await session.flush()
+            await record_user_created(session)
         except Exception:
             await session.rollback()
-            await message.answer("❌ Произошла ошибка при создании заявки. Попробуйте снова позже.")
+            await message.answer("❌ Произошла ошибка при регистрации. Попробуйте снова позже.")
             return
+        registered_user = user
+        after_commit(session, lambda: cache_user(registered_user))
+
+    # Создаем заявку
+    application = Application(
+        user_id=user.id,
+        crypto_type=crypto,
+        amount=quote.amount_crypto,
+        amount_rub=quote.amount_to_pay,
+        crypto_rub_rate=quote.rate,
+        wallet_address=wallet_address,
+        payment_method=payment_method,
+        status='pending',
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow(),
+    )
+    session.add(application)
+    await record_application_created(session, application)
+    try:
+        await session.flush()
+    except Exception:
+        await session.rollback()
+        await message.answer("❌ Произошла ошибка при создании заявки. Попробуйте снова позже.")
+        return
+
+    action_log.log_user(telegram_id, f"Создана заявка №{application.id}: {quote.amount_crypto:.8f} {crypto} за {quote.amount_to_pay:.2f} ₽")
 
-        # Уведомляем воркера
-        await notify_worker(application)
+    # Уведомляем воркера через бота, обрабатывающего текущий апдейт
+    await notify_worker(message.bot, application, session)
 
-    await message.answer("📩 Дождитесь подтверждения оплаты.\n🕒 В среднем до 15 минут.")
+    # Сообщения отправляются после commit: очередь отправки в Telegram
+    # не должна удерживать транзакцию (и блокировку записи SQLite)
+    after_commit(session, lambda: message.answer("📩 Дождитесь подтверждения оплаты.\n🕒 В среднем до 15 минут."))
     await state.clear()
 
 # Функция для уведомления воркера о новой заявке
-async def notify_worker(application):
-    bot = Bot(token=BOT_TOKEN)
-    # Получаем данные пользователя
-    async with async_session() as session:
-        # Получаем пользователя, который создал заявку
-        result = await session.execute(
-            select(User).where(User.id == application.user_id)
-        )
-        user = result.scalar_one_or_none()
-        if user is None:
-            username = "Unknown"
-            total_apps = 0
-            successful_apps = 0
-        else:
-            username = user.first_name or user.username or f"User {user.telegram_id}"
-            # Получаем количество заявок и успешных заявок
-            total_apps_result = await session.execute(
-                select(func.count(Application.id)).where(Application.user_id == user.id)
-            )
-            total_apps = total_apps_result.scalar()
-            successful_apps_result = await session.execute(
-                select(func.count(Application.id)).where(
-                    Application.user_id == user.id,
-                    Application.status == 'completed'
-                )
-            )
-            successful_apps = successful_apps_result.scalar()
+async def notify_worker(bot: Bot, application, session: AsyncSession):
+    # Получаем пользователя, который создал заявку
+    result = await session.execute(
+        select(User).where(User.id == application.user_id)
+    )
+    user = result.scalar_one_or_none()
+    if user is None:
+        username = "Unknown"
+        total_apps = 0
+        successful_apps = 0
+    else:
+        username = user.first_name or user.username or f"User {user.telegram_id}"
+        # Получаем количество заявок и успешных заявок из сводки
+        stats = await get_user_stats(session, user.id)
+        total_apps = stats.total_count
+        successful_apps = stats.completed_count
 
     # Получаем реквизиты оплаты
-    payment_details = await get_payment_details(application.payment_method)
+    payment_details = get_payment_details(application.payment_method)
     card_number = payment_details['card_number'] if payment_details else 'Unknown'
     recipient_name = payment_details['recipient_name'] if payment_details else 'Unknown'
 
@@ -758,18 +721,17 @@ async def notify_worker(application):
         ]
     ])
 
-    # Отправляем сообщение воркеру с поддержкой Markdown
-    await bot.send_message(
+    # Отправляем сообщение воркеру с поддержкой Markdown после записи заявки
+    after_commit(session, lambda: bot.send_message(
         WORKER_ID,
         message_text,
         reply_markup=inline_kb,
         parse_mode="Markdown"
-    )
-    await bot.close()
+    ))
 
 # Хендлер для кнопки "Выполнено"
 @user_router.callback_query(F.data.startswith('application_') & F.data.endswith('_completed'))
-async def application_completed_callback(callback_query: CallbackQuery):
+async def application_completed_callback(callback_query: CallbackQuery, session: AsyncSession):
     data = callback_query.data
     # Извлекаем ID заявки
     try:
@@ -778,11 +740,11 @@ async def application_completed_callback(callback_query: CallbackQuery):
     except (IndexError, ValueError):
         await callback_query.answer("❌ Некорректные данные заявки.", show_alert=True)
         return
-    await process_application_action(callback_query, application_id, 'completed')
+    await process_application_action(callback_query, application_id, 'completed', session)
 
 # Хендлер для кнопки "Отказать"
 @user_router.callback_query(F.data.startswith('application_') & F.data.endswith('_rejected'))
-async def application_rejected_callback(callback_query: CallbackQuery):
+async def application_rejected_callback(callback_query: CallbackQuery, session: AsyncSession):
     data = callback_query.data
     # Извлекаем ID заявки
     try:
@@ -791,11 +753,11 @@ async def application_rejected_callback(callback_query: CallbackQuery):
     except (IndexError, ValueError):
         await callback_query.answer("❌ Некорректные данные заявки.", show_alert=True)
         return
-    await process_application_action(callback_query, application_id, 'rejected')
+    await process_application_action(callback_query, application_id, 'rejected', session)
 
 # Хендлер для кнопки "Заблокировать пользователя"
 @user_router.callback_query(F.data.startswith('application_') & F.data.endswith('_block_user'))
-async def block_user_callback(callback_query: CallbackQuery):
+async def block_user_callback(callback_query: CallbackQuery, session: AsyncSession):
     data = callback_query.data
     # Извлекаем ID заявки
     try:
@@ -804,53 +766,58 @@ async def block_user_callback(callback_query: CallbackQuery):
     except (IndexError, ValueError):
         await callback_query.answer("❌ Некорректные данные заявки.", show_alert=True)
         return
-    await block_user_action(callback_query, application_id)
+    await block_user_action(callback_query, application_id, session)
 
-async def process_application_action(callback_query: CallbackQuery, application_id: int, action: str):
+async def process_application_action(callback_query: CallbackQuery, application_id: int, action: str, session: AsyncSession):
     # Проверяем, что действие выполняет воркер
     if callback_query.from_user.id != WORKER_ID:
         await callback_query.answer("⚠️ Вы не можете выполнить это действие.", show_alert=True)
         return
 
-    async with async_session() as session:
-        # Получаем заявку
-        result = await session.execute(
-            select(Application).where(Application.id == application_id)
-        )
-        application = result.scalar_one_or_none()
-        if not application:
-            await callback_query.answer("❌ Заявка не найдена.", show_alert=True)
-            return
+    # Получаем заявку
+    result = await session.execute(
+        select(Application).where(Application.id == application_id)
+    )
+    application = result.scalar_one_or_none()
+    if not application:
+        await callback_query.answer("❌ Заявка не найдена.", show_alert=True)
+        return
 
-        # Обновляем статус заявки
-        application.status = action
-        application.updated_at = datetime.utcnow()
-        try:
-            await session.commit()
-        except Exception:
-            await session.rollback()
-            await callback_query.answer("❌ Произошла ошибка при обновлении заявки.", show_alert=True)
-            return
+    # Обновляем статус заявки
+    old_status = application.status
+    application.status = action
+    application.updated_at = datetime.utcnow()
+    await record_status_change(session, application, old_status)
+    try:
+        await session.flush()
+    except Exception:
+        await session.rollback()
+        await callback_query.answer("❌ Произошла ошибка при обновлении заявки.", show_alert=True)
+        return
+
+    action_log.log_user(callback_query.from_user.id, f"Заявка №{application.id}: статус {old_status} → {action}")
 
-        # Уведомляем пользователя
-        await notify_user(application, action)
+    # Уведомляем пользователя
+    await notify_user(callback_query.bot, application, action, session)
 
-        # Редактируем сообщение
-        status_text = "✅ Выполнено" if action == 'completed' else "❌ Отказано"
+    # Редактируем сообщение после commit, не удерживая транзакцию
+    status_text = "✅ Выполнено" if action == 'completed' else "❌ Отказано"
+
+    async def finish():
         await callback_query.message.edit_text(
             f"📄 **Заявка №{application.id}** обработана.\n**Статус:** {status_text}",
             parse_mode="Markdown"
         )
         await callback_query.answer("✅ Действие выполнено.", show_alert=True)
 
-async def notify_user(application: Application, action: str):
-    bot = Bot(token=BOT_TOKEN)
+    after_commit(session, finish)
+
+async def notify_user(bot: Bot, application: Application, action: str, session: AsyncSession):
     # Получаем telegram_id пользователя
-    async with async_session() as session:
-        result = await session.execute(
-            select(User).where(User.id == application.user_id)
-        )
-        user = result.scalar_one_or_none()
+    result = await session.execute(
+        select(User).where(User.id == application.user_id)
+    )
+    user = result.scalar_one_or_none()
 
     if user:
         if action == 'completed':
@@ -860,60 +827,71 @@ async def notify_user(application: Application, action: str):
         else:
             message_text = f"ℹ️ **Обновлен статус вашей заявки №{application.id}:** {action}"
 
-        try:
-            await bot.send_message(
-                user.telegram_id,
-                message_text,
-                parse_mode="Markdown"
-            )
-        except Exception:
-            pass  # Игнорируем ошибки при отправке уведомления
-    await bot.close()
+        async def send():
+            try:
+                await bot.send_message(
+                    user.telegram_id,
+                    message_text,
+                    parse_mode="Markdown"
+                )
+            except Exception:
+                pass  # Игнорируем ошибки при отправке уведомления
+
+        # Уведомление уходит только после записи нового статуса
+        after_commit(session, send)
 
-async def block_user_action(callback_query: CallbackQuery, application_id: int):
+async def block_user_action(callback_query: CallbackQuery, application_id: int, session: AsyncSession):
     # Проверяем, что действие выполняет воркер
     if callback_query.from_user.id != WORKER_ID:
         await callback_query.answer("⚠️ Вы не можете выполнить это действие.", show_alert=True)
         return
 
-    async with async_session() as session:
-        # Получаем заявку
-        result = await session.execute(
-            select(Application).where(Application.id == application_id)
-        )
-        application = result.scalar_one_or_none()
-        if not application:
-            await callback_query.answer("❌ Заявка не найдена.", show_alert=True)
-            return
+    # Получаем заявку
+    result = await session.execute(
+        select(Application).where(Application.id == application_id)
+    )
+    application = result.scalar_one_or_none()
+    if not application:
+        await callback_query.answer("❌ Заявка не найдена.", show_alert=True)
+        return
 
-        # Получаем пользователя
-        result = await session.execute(
-            select(User).where(User.id == application.user_id)
-        )
-        user = result.scalar_one_or_none()
-        if not user:
-            await callback_query.answer("❌ Пользователь не найден.", show_alert=True)
-            return
+    # Получаем пользователя
+    result = await session.execute(
+        select(User).where(User.id == application.user_id)
+    )
+    user = result.scalar_one_or_none()
+    if not user:
+        await callback_query.answer("❌ Пользователь не найден.", show_alert=True)
+        return
 
-        # Блокируем пользователя
-        user.is_blocked = True
-        try:
-            await session.commit()
-        except Exception:
-            await session.rollback()
-            await callback_query.answer("❌ Произошла ошибка при блокировке пользователя.", show_alert=True)
-            return
+    # Блокируем пользователя
+    user.is_blocked = True
+    try:
+        await session.flush()
+    except Exception:
+        await session.rollback()
+        await callback_query.answer("❌ Произошла ошибка при блокировке пользователя.", show_alert=True)
+        return
+    blocked_telegram_id = user.telegram_id
+    # Апдейты заблокированного пользователя может обрабатывать другой процесс
+    after_commit(session, lambda: cluster_bus.broadcast(USER_CHANGED, blocked_telegram_id))
+    action_log.log_user(callback_query.from_user.id, f"Заблокирован пользователь Telegram ID: {user.telegram_id}")
+
+    # Редактируем сообщение после commit, не удерживая транзакцию
+    blocked_message = (
+        f"🚫 **Пользователь {user.first_name or user.username or user.telegram_id} заблокирован.**"
+    )
 
-        # Редактируем сообщение
-        blocked_message = (
-            f"🚫 **Пользователь {user.first_name or user.username or user.telegram_id} заблокирован.**"
-        )
+    async def finish():
         await callback_query.message.edit_text(blocked_message, parse_mode="Markdown")
         await callback_query.answer("✅ Пользователь заблокирован.", show_alert=True)
 
+    after_commit(session, finish)
+
 # Функция для получения личного кабинета пользователя
-async def personal_account(message: Message, state: FSMContext):
-    telegram_id = message.from_user.id
+async def personal_account(message: Message, state: FSMContext, session: AsyncSession):
+    # Сообщение принадлежит боту, поэтому пользователя определяем по чату
+    telegram_id = message.chat.id
     user_data = await state.get_data()
     last_message_id = user_data.get('last_message_id')
 
@@ -921,82 +899,71 @@ async def personal_account(message: Message, state: FSMContext):
     if last_message_id:
         await delete_message(message.bot, message.chat.id, last_message_id)
 
-    async with async_session() as session:
-        # Получаем пользователя
-        result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
-        )
-        user = result.scalar_one_or_none()
-        if not user:
-            # Регистрируем пользователя
-            user = User(telegram_id=telegram_id, first_name=message.from_user.first_name, username=message.from_user.username)
-            session.add(user)
-            try:
-                await session.commit()
-            except Exception:
-                await session.rollback()
-                await message.answer("❌ Произошла ошибка при регистрации. Попробуйте снова позже.")
-                return
-
-        # Получаем статистику пользователя
-        stats_result = await session.execute(
-            select(
-                func.count(Application.id).label("total_exchanges"),
-                func.coalesce(func.sum(Application.amount_rub), 0).label("total_amount")
-            ).where(Application.user_id == user.id)
-        )
-        stats = stats_result.fetchone()
-        total_exchanges = stats.total_exchanges
-        total_amount = stats.total_amount
-
-        if total_exchanges == 0:
-            # Если у пользователя нет обменов
-            profile_message = (
-                "📊 **Ваш профиль**\n\n"
-                "Вы пока не совершали обменов."
-            )
-            sent_message = await message.answer(
-                profile_message,
-                parse_mode="Markdown",
-                reply_markup=main_menu_inline_keyboard()
-            )
-            await state.update_data(last_message_id=sent_message.message_id)
-            return
-
-        # Получаем последний обмен для получения последнего кошелька и курса
-        last_exchange_result = await session.execute(
-            select(Application).where(Application.user_id == user.id).order_by(Application.created_at.desc()).limit(1)
-        )
-        last_exchange = last_exchange_result.scalar_one_or_none()
+    # Получаем пользователя из кэша
+    user = await get_cached_user(telegram_id, session)
 
-        if last_exchange:
-            last_wallet = last_exchange.wallet_address
-            last_crypto = last_exchange.crypto_type
-            last_rate = f"{last_exchange.crypto_rub_rate:.4f} ₽/{last_crypto}"
-        else:
-            last_wallet = "Неизвестно"
-            last_crypto = "Неизвестно"
-            last_rate = "Неизвестно"
+    if not user:
+        # Регистрируем пользователя
+        user = User(telegram_id=telegram_id, first_name=message.chat.first_name, username=message.chat.username)
+        session.add(user)
+        try:
+            await session.flush()
+            await record_user_created(session)
+        except Exception:
+            await session.rollback()
+            await message.answer("❌ Произошла ошибка при регистрации. Попробуйте снова позже.")
+            return
+        registered_user = user
+        after_commit(session, lambda: cache_user(registered_user))
 
-        # Форматирование общей суммы с двумя знаками после запятой
-        total_amount_formatted = f"{total_amount:.2f} ₽"
+    # Получаем сводку пользователя
+    stats = await get_user_stats(session, user.id)
+    total_exchanges = stats.total_count
+    total_amount = stats.amount_rub_sum
 
-        # Формирование красиво отформатированного сообщения
+    if total_exchanges == 0:
+        # Если у пользователя нет обменов
         profile_message = (
-            f"📊 **Ваш профиль**\n\n"
-            f"**📈 Количество обменов:** {total_exchanges}\n"
-            f"**💰 Общая сумма обменов:** {total_amount_formatted}\n"
-            f"**🔑 Последний использованный кошелёк:** `{last_wallet}`\n"
-            f"**💱 Последняя криптовалюта:** {last_crypto}\n"
-            f"**📉 Курс обмена:** {last_rate}"
+            "📊 **Ваш профиль**\n\n"
+            "Вы пока не совершали обменов."
         )
-
         sent_message = await message.answer(
             profile_message,
             parse_mode="Markdown",
             reply_markup=main_menu_inline_keyboard()
         )
         await state.update_data(last_message_id=sent_message.message_id)
+        return
+
+    # Последний кошелёк и курс хранятся в сводке
+    if stats.last_wallet:
+        last_wallet = stats.last_wallet
+        last_crypto = stats.last_crypto
+        last_rate = f"{stats.last_rate:.4f} ₽/{last_crypto}"
+    else:
+        last_wallet = "Неизвестно"
+        last_crypto = "Неизвестно"
+        last_rate = "Неизвестно"
+
+    # Форматирование общей суммы с двумя знаками после запятой
+    total_amount_formatted = f"{total_amount:.2f} ₽"
+
+    # Формирование красиво отформатированного сообщения
+    profile_message = (
+        f"📊 **Ваш профиль**\n\n"
+        f"**📈 Количество обменов:** {total_exchanges}\n"
+        f"**💰 Общая сумма обменов:** {total_amount_formatted}\n"
+        f"**🔑 Последний использованный кошелёк:** `{last_wallet}`\n"
+        f"**💱 Последняя криптовалюта:** {last_crypto}\n"
+        f"**📉 Курс обмена:** {last_rate}"
+    )
+
+    sent_message = await message.answer(
+        profile_message,
+        parse_mode="Markdown",
+        reply_markup=main_menu_inline_keyboard()
+    )
+    await state.update_data(last_message_id=sent_message.message_id)
 
 # Хендлер для кнопок "Отмена" и "Назад"
 @user_router.callback_query(lambda c: c.data and c.data.startswith('cancel_'))
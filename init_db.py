@@ -1,20 +1,25 @@
 # init_db.py
 
-from sqlalchemy import create_engine
-from models import Base
+import asyncio
+from database import engine
+from migrations import run_migrations, get_schema_version
 from rich import print
 from rich.console import Console
 
 console = Console()
 
-def init_db(db_url='sqlite:///database.db'):
+async def init_db():
     try:
-        engine = create_engine(db_url, echo=False)
-        Base.metadata.create_all(engine)
-        console.print("[bold green]База данных успешно инициализирована.[/bold green]")
+        applied = await run_migrations(engine)
+        version = await get_schema_version(engine)
+        if applied:
+            console.print(f"[bold green]Применены миграции: {', '.join(map(str, applied))}.[/bold green]")
+        console.print(f"[bold green]База данных {engine.dialect.name} успешно инициализирована (версия схемы {version}).[/bold green]")
     except Exception as e:
         console.print(f"[bold red]Ошибка при инициализации базы данных: {e}[/bold red]")
         exit(1)
+    finally:
+        await engine.dispose()
 
 if __name__ == "__main__":
-    init_db()
+    asyncio.run(init_db())
@@ -0,0 +1,56 @@
+# middlewares/db.py
+
+import inspect
+import logging
+from aiogram import BaseMiddleware
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+AFTER_COMMIT_KEY = 'after_commit'
+
+def after_commit(session, callback):
+    """
+    Откладывает вызов ``callback`` до успешного commit сессии апдейта.
+    Используется для обновления кэшей в памяти только после записи в базу.
+    Если транзакция откатится, callback не вызывается.
+    """
+    session.info.setdefault(AFTER_COMMIT_KEY, []).append(callback)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_commit(session):
+    # Откат отменяет и отложенные обновления кэшей
+    session.info.pop(AFTER_COMMIT_KEY, None)
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Открывает одну сессию базы данных на апдейт и передаёт её в фильтры и
+    хендлеры как аргумент ``session``. В конце апдейта выполняется один
+    commit, при исключении — rollback.
+    """
+
+    def __init__(self, session_pool):
+        self.session_pool = session_pool
+
+    async def __call__(self, handler, event, data):
+        async with self.session_pool() as session:
+            data['session'] = session
+            try:
+                result = await handler(event, data)
+                with tracer.span('db.commit'):
+                    await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+            callbacks = session.info.pop(AFTER_COMMIT_KEY, [])
+
+        for callback in callbacks:
+            try:
+                outcome = callback()
+                if inspect.isawaitable(outcome):
+                    await outcome
+            except Exception:
+                logger.exception("After-commit callback failed")
+        return result
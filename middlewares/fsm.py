@@ -0,0 +1,32 @@
+# middlewares/fsm.py
+
+from aiogram import BaseMiddleware
+
+class FsmBufferMiddleware(BaseMiddleware):
+    """
+    Открывает буфер хранилища FSM на время апдейта: состояние читается
+    из базы один раз, а изменения записываются одним запросом в конце.
+    До этой записи ключ пользователя занят апдейтом (см. ``DbStorage.buffer``).
+
+    Должен стоять раньше FSMContextMiddleware диспетчера, чтобы чтение
+    ``raw_state`` тоже попадало в буфер, и раньше DbSessionMiddleware:
+    запись состояния идёт после commit апдейта и не ждёт блокировку SQLite,
+    которую держит его транзакция (см. ``setup_fsm_buffer``).
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def __call__(self, handler, event, data):
+        async with self.storage.buffer():
+            return await handler(event, data)
+
+def setup_fsm_buffer(dp):
+    # FSMContextMiddleware регистрируется в конструкторе Dispatcher;
+    # переставляем его после буфера, чтобы буфер охватывал весь апдейт.
+    # Вызывается до регистрации DbSessionMiddleware: состояние пишется после
+    # commit апдейта. Middleware трассировки, метрик и профилировщика SQL
+    # регистрируются раньше и охватывают буфер вместе с записью состояния
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(FsmBufferMiddleware(dp.storage))
+    dp.update.outer_middleware(dp.fsm)
@@ -0,0 +1,67 @@
+# middlewares/metrics.py
+
+import time
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from utils.metrics import (
+    update_latency,
+    update_errors,
+    handler_latency,
+    telegram_request_latency,
+    telegram_request_errors,
+)
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Время обработки апдейта целиком (FSM, транзакция базы, хендлер) по типу апдейта"""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            update_errors.inc(event.event_type)
+            raise
+        finally:
+            update_latency.observe(time.perf_counter() - started, event.event_type)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware роутера: время конкретного хендлера. Вызывается
+    только для апдейта, который прошёл фильтры, и знает найденный хендлер.
+    """
+
+    async def __call__(self, handler, event, data):
+        callback = data['handler'].callback
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_latency.observe(time.perf_counter() - started, callback.__module__, callback.__name__)
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: время запросов к Bot API по методу. Регистрируется
+    после очереди отправки, поэтому ожидание лимитов Telegram сюда не входит.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            telegram_request_errors.inc(name)
+            raise
+        finally:
+            telegram_request_latency.observe(time.perf_counter() - started, name)
+
+telegram_metrics = TelegramMetricsMiddleware()
+
+def setup_metrics(dp, *routers):
+    # Вызывается сразу после создания диспетчера, чтобы замер апдейта
+    # охватывал буфер FSM и транзакцию базы (см. setup_fsm_buffer)
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_metrics = HandlerMetricsMiddleware()
+    for router in routers:
+        router.message.middleware(handler_metrics)
+        router.callback_query.middleware(handler_metrics)
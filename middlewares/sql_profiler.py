@@ -0,0 +1,33 @@
+# middlewares/sql_profiler.py
+
+from aiogram import BaseMiddleware
+from utils.sql_profiler import sql_profiler
+
+class SqlProfilerMiddleware(BaseMiddleware):
+    """Открывает профиль SQL-запросов на апдейт (включая буфер FSM и commit)"""
+
+    async def __call__(self, handler, event, data):
+        started = sql_profiler.begin_update(f"update:{event.event_type}")
+        try:
+            return await handler(event, data)
+        finally:
+            sql_profiler.end_update(started)
+
+class SqlProfilerHandlerMiddleware(BaseMiddleware):
+    """Приписывает запросы апдейта хендлеру, который его обработал"""
+
+    async def __call__(self, handler, event, data):
+        callback = data['handler'].callback
+        sql_profiler.set_handler(f"{callback.__module__}.{callback.__name__}")
+        return await handler(event, data)
+
+def setup_sql_profiler(dp, *routers):
+    # Профилировщик выключен по умолчанию и тогда ничего не добавляет к апдейту.
+    # Вызывается до setup_fsm_buffer, чтобы запись FSM попадала в профиль апдейта
+    if not sql_profiler.enabled:
+        return
+    dp.update.outer_middleware(SqlProfilerMiddleware())
+    handler_middleware = SqlProfilerHandlerMiddleware()
+    for router in routers:
+        router.message.middleware(handler_middleware)
+        router.callback_query.middleware(handler_middleware)
@@ -0,0 +1,54 @@
+# middlewares/tracing.py
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from utils.tracing import tracer
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """Корневой участок трассы на апдейт: FSM, транзакция базы, фильтры, хендлер и отправка после commit"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        with tracer.trace(f"update.{event.event_type}", update_id=event.update_id,
+                          user_id=user.id if user else None):
+            return await handler(event, data)
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: участок хендлера, прошедшего фильтры"""
+
+    async def __call__(self, handler, event, data):
+        callback = data['handler'].callback
+        name = f"{callback.__module__}.{callback.__name__}"
+        tracer.annotate(handler=name)
+        with tracer.span('handler', handler=name):
+            return await handler(event, data)
+
+class TelegramTracingMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: участок на запрос к Bot API. Регистрируется
+    раньше очереди отправки, поэтому ожидание лимитов Telegram входит в участок.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        span = tracer.start_span(f"telegram.{type(method).__name__}",
+                                 chat_id=getattr(method, 'chat_id', None))
+        try:
+            result = await make_request(bot, method)
+        except BaseException as e:
+            tracer.end_span(span, e)
+            raise
+        tracer.end_span(span)
+        return result
+
+telegram_tracing = TelegramTracingMiddleware()
+
+def setup_tracing(dp, *routers):
+    # Трассировка выключена по умолчанию и тогда ничего не добавляет к апдейту.
+    # Вызывается первой из setup_*, чтобы корневой участок охватывал остальные middleware
+    if not tracer.enabled:
+        return
+    dp.update.outer_middleware(UpdateTracingMiddleware())
+    handler_middleware = HandlerTracingMiddleware()
+    for router in routers:
+        router.message.middleware(handler_middleware)
+        router.callback_query.middleware(handler_middleware)
@@ -0,0 +1,80 @@
+# migrations.py
+
+import logging
+from datetime import datetime
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Base, SchemaVersion, User, Application, FsmState
+from utils.stats import rebuild_counters
+
+logger = logging.getLogger(__name__)
+
+# Зарегистрированные миграции: (версия, описание, функция)
+MIGRATIONS = []
+
+def migration(version: int, description: str):
+    """
+    Регистрирует функцию миграции схемы.
+
+    Функция получает ``AsyncConnection`` внутри транзакции и должна быть
+    идемпотентной: на новой базе версия 1 уже создаёт актуальную схему.
+    """
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+@migration(1, "Базовая схема")
+async def create_base_schema(conn):
+    await conn.run_sync(Base.metadata.create_all)
+
+@migration(2, "Составные индексы для профиля, карточки воркера и статистики")
+async def create_composite_indexes(conn):
+    # CREATE INDEX на существующей таблице не требует её пересоздания
+    for table in (User.__table__, Application.__table__):
+        for index in table.indexes:
+            await conn.run_sync(index.create, checkfirst=True)
+
+@migration(3, "Заполнение счётчиков статистики и сводок пользователей")
+async def fill_statistics(conn):
+    session = AsyncSession(bind=conn)
+    try:
+        await rebuild_counters(session)
+        await session.flush()
+    finally:
+        await session.close()
+
+@migration(4, "Хранилище состояний FSM")
+async def create_fsm_states(conn):
+    await conn.run_sync(FsmState.__table__.create, checkfirst=True)
+
+async def get_schema_version(engine) -> int:
+    async with engine.begin() as conn:
+        await conn.run_sync(SchemaVersion.__table__.create, checkfirst=True)
+        result = await conn.execute(select(SchemaVersion.version))
+        return max(result.scalars().all(), default=0)
+
+async def run_migrations(engine) -> list:
+    """
+    Применяет по порядку все миграции новее текущей версии схемы.
+    Каждая миграция выполняется в отдельной транзакции.
+
+    :return: Список применённых версий.
+    """
+    current = await get_schema_version(engine)
+    applied = []
+    for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        logger.info(f"Applying schema migration {version}: {description}")
+        async with engine.begin() as conn:
+            await func(conn)
+            await conn.execute(
+                insert(SchemaVersion).values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.utcnow(),
+                )
+            )
+        applied.append(version)
+    return applied
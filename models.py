@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Float, Boolean, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 
@@ -9,7 +9,7 @@ class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, nullable=False, unique=True)
+    telegram_id = Column(BigInteger, nullable=False, unique=True)  # ID Telegram не помещаются в 32 бита
     first_name = Column(String)
     username = Column(String)
     is_blocked = Column(Boolean, default=False)
@@ -18,6 +18,10 @@ class User(Base):
     last_action = Column(DateTime)
     applications = relationship('Application', back_populates='user')
 
+    __table_args__ = (
+        Index('ix_users_is_blocked', 'is_blocked'),  # Список заблокированных в админ-панели
+    )
+
     def __repr__(self):
         return f"<User(id={self.id}, telegram_id={self.telegram_id}, username='{self.username}')>"
 
@@ -38,6 +42,12 @@ class Application(Base):
 
     user = relationship('User', back_populates='applications')
 
+    __table_args__ = (
+        Index('ix_applications_user_id_created_at', 'user_id', 'created_at'),  # История пользователя
+        Index('ix_applications_user_id_status', 'user_id', 'status'),  # Заявки пользователя по статусу
+        Index('ix_applications_status_created_at', 'status', 'created_at'),  # Статистика по статусам
+    )
+
     def __repr__(self):
         return (f"<Application(id={self.id}, user_id={self.user_id}, crypto_type='{self.crypto_type}', "
                 f"amount={self.amount}, amount_rub={self.amount_rub}, status='{self.status}')>")
@@ -67,7 +77,7 @@ class ActionLog(Base):
     __tablename__ = 'action_logs'
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=True)
+    user_id = Column(BigInteger, nullable=True)  # Telegram ID пользователя
     action = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
@@ -75,10 +85,57 @@ class AdminActionLog(Base):
     __tablename__ = 'admin_action_logs'
 
     id = Column(Integer, primary_key=True)
-    admin_id = Column(Integer, nullable=False)
+    admin_id = Column(BigInteger, nullable=False)  # Telegram ID администратора
     action = Column(String, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return (f"<AdminActionLog(id={self.id}, admin_id={self.admin_id}, "
                 f"action='{self.action}', timestamp={self.timestamp})>")
+
+class StatCounter(Base):
+    __tablename__ = 'stat_counters'
+
+    name = Column(String, primary_key=True)  # Название счётчика, например 'applications' или 'status:completed'
+    value = Column(Float, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<StatCounter(name='{self.name}', value={self.value})>"
+
+class UserStats(Base):
+    __tablename__ = 'user_stats'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    total_count = Column(Integer, nullable=False, default=0)  # Всего заявок
+    completed_count = Column(Integer, nullable=False, default=0)  # Выполненных заявок
+    amount_rub_sum = Column(Float, nullable=False, default=0)  # Сумма amount_rub по всем заявкам
+    last_wallet = Column(String)
+    last_crypto = Column(String)
+    last_rate = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return (f"<UserStats(user_id={self.user_id}, total_count={self.total_count}, "
+                f"completed_count={self.completed_count}, amount_rub_sum={self.amount_rub_sum})>")
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SchemaVersion(version={self.version}, description='{self.description}')>"
+
+class FsmState(Base):
+    __tablename__ = 'fsm_states'
+
+    key = Column(String, primary_key=True)  # Ключ FSM: бот, чат, пользователь и назначение
+    state = Column(String)
+    data = Column(Text)  # Данные состояния в JSON
+    expires_at = Column(DateTime, nullable=False, index=True)  # После этого момента состояние считается брошенным
+
+    def __repr__(self):
+        return f"<FsmState(key='{self.key}', state='{self.state}', expires_at={self.expires_at})>"
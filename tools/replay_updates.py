@@ -0,0 +1,66 @@
+"""
+Отправляет записанные апдейты Telegram на локальный вебхук бота.
+
+Принимает файлы с одним апдейтом (JSON), списком апдейтов (JSON-массив)
+или по апдейту на строку (JSONL). Бот должен быть запущен с RUN_MODE = 'webhook';
+WEBHOOK_URL можно оставить пустым, чтобы вебхук не регистрировался в Telegram.
+
+    python -m tools.replay_updates updates.jsonl [--url http://127.0.0.1:8080/webhook] [--concurrency 10]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+
+def load_updates(paths):
+    updates = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            text = f.read().strip()
+        if not text:
+            continue
+        if text[0] == '[':
+            updates.extend(json.loads(text))
+        elif path.endswith('.jsonl'):
+            updates.extend(json.loads(line) for line in text.splitlines() if line.strip())
+        else:
+            updates.append(json.loads(text))
+    return updates
+
+
+async def replay(updates, url, secret, concurrency):
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(update):
+            async with semaphore:
+                async with session.post(url, json=update) as response:
+                    await response.read()
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    print(f"posted {len(updates)} updates in {elapsed:.2f} s, responses: {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('files', nargs='+', help="JSON или JSONL файлы с апдейтами")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument('--secret', default=WEBHOOK_SECRET)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(replay(load_updates(args.files), args.url, args.secret, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Показывает трассы апдейтов из JSONL-файлов трассировки (TRACING_FILE) деревом участков.
+
+По умолчанию печатает самые долгие трассы; их можно отобрать по хендлеру,
+пользователю или минимальной длительности. Файлы после ротации
+(traces.jsonl.1 и т.д.) и файлы процессов кластера передаются списком.
+
+    python -m tools.show_traces traces.jsonl traces.jsonl.1 [--top 5] [--handler confirm_payment]
+    python -m tools.show_traces traces-worker*.jsonl --user 123456789 --min-ms 1000
+    python -m tools.show_traces traces.jsonl --trace <trace_id>
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def load_traces(paths):
+    """Возвращает {trace_id: [участки]} из всех файлов"""
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    span = json.loads(line)
+                    traces[span['trace_id']].append(span)
+    return traces
+
+
+def find_root(spans):
+    for span in spans:
+        if span['parent_id'] is None:
+            return span
+    return None
+
+
+def print_trace(spans):
+    root = find_root(spans)
+    children = defaultdict(list)
+    for span in spans:
+        if span['parent_id'] is not None:
+            children[span['parent_id']].append(span)
+
+    def show(span, depth):
+        offset = (span['start'] - root['start']) * 1000
+        duration = '?' if span['duration_ms'] is None else f"{span['duration_ms']:.1f}"
+        attributes = ' '.join(f"{key}={value}" for key, value in span['attributes'].items())
+        error = f"  ERROR {span['error']}" if span['error'] else ''
+        print(f"{offset:>9.1f} ms {duration:>9} ms  {'  ' * depth}{span['name']}  {attributes}{error}")
+        for child in sorted(children[span['span_id']], key=lambda item: item['start']):
+            show(child, depth + 1)
+
+    print(f"trace {root['trace_id']}")
+    print(f"{'start':>12} {'duration':>12}  span")
+    show(root, 0)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show update traces written by the tracer")
+    parser.add_argument('paths', nargs='+', help="файлы трасс (JSONL)")
+    parser.add_argument('--top', type=int, default=10, help="сколько самых долгих трасс показать")
+    parser.add_argument('--handler', default='', help="только трассы хендлеров с подстрокой в имени")
+    parser.add_argument('--user', type=int, help="только апдейты пользователя с этим Telegram ID")
+    parser.add_argument('--min-ms', type=float, default=0, help="только трассы не короче (мс)")
+    parser.add_argument('--trace', help="показать одну трассу по trace_id")
+    args = parser.parse_args()
+
+    traces = load_traces(args.paths)
+    if args.trace:
+        if args.trace not in traces:
+            raise SystemExit(f"trace {args.trace} not found")
+        print_trace(traces[args.trace])
+        return
+
+    selected = []
+    for spans in traces.values():
+        root = find_root(spans)
+        attributes = root['attributes']
+        if args.handler not in attributes.get('handler', ''):
+            continue
+        if args.user is not None and attributes.get('user_id') != args.user:
+            continue
+        if root['duration_ms'] < args.min_ms:
+            continue
+        selected.append((root['duration_ms'], spans))
+
+    selected.sort(key=lambda item: item[0], reverse=True)
+    print(f"{len(selected)} of {len(traces)} traces match\n")
+    for _, spans in selected[:args.top]:
+        print_trace(spans)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# utils/action_log.py
+
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import insert
+from database import async_session
+from models import ActionLog, AdminActionLog
+from config import ACTION_LOG_FLUSH_INTERVAL, ACTION_LOG_BATCH_SIZE, ACTION_LOG_MAX_BUFFER
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько параметров допускает один запрос: SQLite до версии 3.32 - не больше 999
+MAX_QUERY_PARAMS = 999
+
+class ActionLogSink:
+    """
+    Буферизованная запись журналов действий пользователей и администраторов.
+
+    Записи копятся в памяти и сбрасываются в базу многострочным INSERT одной
+    транзакцией — раз в ``flush_interval`` секунд, при накоплении
+    ``batch_size`` записей и при остановке бота.
+    """
+
+    def __init__(self, flush_interval: float = ACTION_LOG_FLUSH_INTERVAL,
+                 batch_size: int = ACTION_LOG_BATCH_SIZE, max_buffer: int = ACTION_LOG_MAX_BUFFER):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffers = {AdminActionLog: [], ActionLog: []}
+        self._task = None
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def log_admin(self, admin_id: int, action: str):
+        self._append(AdminActionLog, {'admin_id': admin_id, 'action': action, 'timestamp': datetime.utcnow()})
+
+    def log_user(self, user_id: int, action: str):
+        self._append(ActionLog, {'user_id': user_id, 'action': action, 'timestamp': datetime.utcnow()})
+
+    def pending(self) -> int:
+        return sum(len(rows) for rows in self._buffers.values())
+
+    def _append(self, model, row: dict):
+        buffer = self._buffers[model]
+        if len(buffer) >= self.max_buffer:
+            # База недоступна слишком долго: не даём буферу расти бесконечно
+            self.dropped += 1
+            return
+        buffer.append(row)
+        if self.pending() >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+            except RuntimeError:
+                pass  # Нет работающего цикла событий: запись уйдёт при следующем сбросе
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="action-log-sink")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batches = {model: rows for model, rows in self._buffers.items() if rows}
+            if not batches:
+                return
+            self._buffers = {model: [] for model in self._buffers}
+            try:
+                async with async_session() as session:
+                    for model, rows in batches.items():
+                        # Каждая строка занимает по параметру на столбец
+                        chunk_size = MAX_QUERY_PARAMS // len(rows[0])
+                        for start in range(0, len(rows), chunk_size):
+                            await session.execute(insert(model).values(rows[start:start + chunk_size]))
+                    await session.commit()
+            except Exception:
+                logger.exception("Failed to flush action logs, keeping them for the next attempt")
+                for model, rows in batches.items():
+                    # Несохранённые записи встают перед пришедшими во время сброса;
+                    # сверх max_buffer отбрасываются самые старые
+                    buffer = rows + self._buffers[model]
+                    overflow = max(len(buffer) - self.max_buffer, 0)
+                    self.dropped += overflow
+                    self._buffers[model] = buffer[overflow:]
+                return
+            self.written += sum(len(rows) for rows in batches.values())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.pending(),
+            'written': self.written,
+            'dropped': self.dropped,
+        }
+
+action_log = ActionLogSink()
+metrics.collector('action_log', action_log.stats)
@@ -0,0 +1,44 @@
+# utils/cluster_bus.py
+
+import inspect
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ClusterBus:
+    """
+    Рассылка событий об изменении общих данных между процессами бота.
+
+    Кэши в памяти (комиссия, реквизиты, пользователи) подписываются на свои
+    события. ``broadcast`` применяет событие в текущем процессе и, если бот
+    запущен в режиме кластера, отправляет его остальным процессам. В одном
+    процессе шина просто вызывает локальные обработчики.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._send = None
+
+    def subscribe(self, topic: str, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def attach(self, send):
+        """Подключает отправку событий другим процессам (вызывается воркером кластера)"""
+        self._send = send
+
+    async def broadcast(self, topic: str, payload=None):
+        await self.deliver(topic, payload)
+        if self._send is not None:
+            self._send(topic, payload)
+
+    async def deliver(self, topic: str, payload=None):
+        """Применяет событие только в текущем процессе"""
+        for handler in self._handlers.get(topic, ()):
+            try:
+                outcome = handler(payload)
+                if inspect.isawaitable(outcome):
+                    await outcome
+            except Exception:
+                logger.exception(f"Cluster bus handler for {topic} failed")
+
+cluster_bus = ClusterBus()
@@ -0,0 +1,44 @@
+# utils/commission.py
+
+import logging
+from sqlalchemy import select
+from database import async_session
+from models import Commission
+from config import COMMISSION_RATE
+from utils.cluster_bus import cluster_bus
+
+logger = logging.getLogger(__name__)
+
+# Событие шины: комиссия изменена, payload — новая ставка
+COMMISSION_CHANGED = 'commission_changed'
+
+class CommissionCache:
+    """
+    Текущая комиссия в памяти процесса.
+
+    Загружается из базы при старте и обновляется сквозной записью из
+    админ-панели, поэтому расчёт цены не обращается к базе. Если записи
+    в таблице нет, используется ``config.COMMISSION_RATE``.
+    """
+
+    def __init__(self):
+        self._rate = COMMISSION_RATE
+
+    async def load(self):
+        async with async_session() as session:
+            result = await session.execute(
+                select(Commission.rate).order_by(Commission.id.desc()).limit(1)
+            )
+            rate = result.scalar()
+        self._rate = rate if rate is not None else COMMISSION_RATE
+        logger.info(f"Commission rate loaded: {self._rate}%")
+
+    def get(self) -> float:
+        return self._rate
+
+    def set(self, rate: float):
+        # Вызывается после успешного commit новой комиссии
+        self._rate = rate
+
+commission_cache = CommissionCache()
+cluster_bus.subscribe(COMMISSION_CHANGED, commission_cache.set)
@@ -1,51 +1,243 @@
 # utils/crypto_rate.py
 
-import aiohttp
+import asyncio
 import logging
+import random
+import time
+from config import (
+    COINGECKO_API_URL,
+    CRYPTO_RATE_TTL,
+    CRYPTO_RATE_MAX_STALE,
+    CRYPTO_RATE_REFRESH_INTERVAL,
+    CRYPTO_RATE_MAX_BACKOFF,
+)
+from utils.http_client import http_client
+from utils.metrics import metrics, rate_fetch_latency, rate_fetch_errors
+from utils.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
-async def get_crypto_rate(crypto: str) -> float:
+# Соответствие символов криптовалют идентификаторам CoinGecko
+SUPPORTED_CRYPTOS = {
+    'btc': 'bitcoin',
+    'ltc': 'litecoin',
+}
+
+async def fetch_crypto_rates(cryptos) -> dict:
     """
-    Получает текущий курс указанной криптовалюты к RUB.
+    Запрашивает у CoinGecko курсы нескольких криптовалют к RUB одним запросом.
 
-    :param crypto: Символ криптовалюты (например, 'BTC', 'LTC').
-    :return: Курс криптовалюты в RUB.
+    :param cryptos: Символы криптовалют (например, ['BTC', 'LTC']).
+    :return: Словарь {символ в нижнем регистре: курс в RUB}.
     :raises ValueError: Если криптовалюта не поддерживается или данные не найдены.
     :raises Exception: При ошибках запроса к API.
     """
-    crypto = crypto.lower()
-    supported_cryptos = {
-        'btc': 'bitcoin',
-        'ltc': 'litecoin'
-    }
-
-    if crypto not in supported_cryptos:
-        logger.error(f"Unsupported crypto type requested: {crypto}")
-        raise ValueError(f"Unsupported crypto type: {crypto}")
+    cryptos = [crypto.lower() for crypto in cryptos]
+    for crypto in cryptos:
+        if crypto not in SUPPORTED_CRYPTOS:
+            logger.error(f"Unsupported crypto type requested: {crypto}")
+            raise ValueError(f"Unsupported crypto type: {crypto}")
 
-    crypto_id = supported_cryptos[crypto]
-    url = 'https://api.coingecko.com/api/v3/simple/price'
     params = {
-        'ids': crypto_id,
+        'ids': ','.join(SUPPORTED_CRYPTOS[crypto] for crypto in cryptos),
         'vs_currencies': 'rub',
     }
+    symbols = ', '.join(crypto.upper() for crypto in cryptos)
 
+    started = time.perf_counter()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as resp:
-                if resp.status != 200:
-                    logger.error(f"Failed to fetch rate for {crypto.upper()}: Status {resp.status}")
-                    raise Exception(f"API request failed with status {resp.status}")
-
-                data = await resp.json()
-                rate = data.get(crypto_id, {}).get('rub')
+        session = await http_client.get_session()
+        async with session.get(COINGECKO_API_URL, params=params) as resp:
+            if resp.status != 200:
+                logger.error(f"Failed to fetch rates for {symbols}: Status {resp.status}")
+                raise Exception(f"API request failed with status {resp.status}")
+
+            data = await resp.json()
+            rates = {}
+            for crypto in cryptos:
+                rate = data.get(SUPPORTED_CRYPTOS[crypto], {}).get('rub')
                 if rate is None:
                     logger.error(f"RUB rate not found for {crypto.upper()}")
                     raise ValueError(f"RUB rate not found for {crypto.upper()}")
+                rates[crypto] = rate
 
-                logger.info(f"Fetched rate for {crypto.upper()}: {rate} RUB")
-                return rate
+            logger.info(f"Fetched rates for {symbols}: {rates}")
+            return rates
     except Exception as e:
-        logger.exception(f"Error fetching crypto rate for {crypto.upper()}: {e}")
+        rate_fetch_errors.inc()
+        logger.exception(f"Error fetching crypto rates for {symbols}: {e}")
         raise
+    finally:
+        rate_fetch_latency.observe(time.perf_counter() - started)
+
+async def fetch_crypto_rate(crypto: str) -> float:
+    """
+    Запрашивает у CoinGecko текущий курс указанной криптовалюты к RUB.
+
+    :param crypto: Символ криптовалюты (например, 'BTC', 'LTC').
+    :return: Курс криптовалюты в RUB.
+    :raises ValueError: Если криптовалюта не поддерживается или данные не найдены.
+    :raises Exception: При ошибках запроса к API.
+    """
+    rates = await fetch_crypto_rates([crypto])
+    return rates[crypto.lower()]
+
+class CryptoRateService:
+    """
+    Кэш курсов криптовалют к RUB с ограниченным временем жизни.
+
+    Свежее значение (моложе ``ttl``) отдаётся сразу. Устаревшее, но не старше
+    ``max_stale``, тоже отдаётся сразу, а в фоне запускается обновление.
+    Одновременные промахи по одной монете объединяются в один запрос к API.
+    """
+
+    def __init__(self, ttl: float = CRYPTO_RATE_TTL, max_stale: float = CRYPTO_RATE_MAX_STALE, fetcher=fetch_crypto_rate):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._fetcher = fetcher
+        self._rates = {}  # символ -> (курс, время получения по time.monotonic())
+        self._inflight = {}  # символ -> asyncio.Task текущего запроса
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get_rate(self, crypto: str) -> float:
+        """
+        Возвращает курс из кэша, при необходимости дожидаясь запроса к API.
+
+        :param crypto: Символ криптовалюты (например, 'BTC', 'LTC').
+        :return: Курс криптовалюты в RUB.
+        :raises ValueError: Если криптовалюта не поддерживается или данные не найдены.
+        :raises Exception: При ошибках запроса к API.
+        """
+        crypto = crypto.lower()
+        if crypto not in SUPPORTED_CRYPTOS:
+            logger.error(f"Unsupported crypto type requested: {crypto}")
+            raise ValueError(f"Unsupported crypto type: {crypto}")
+
+        entry = self._rates.get(crypto)
+        if entry is not None:
+            rate, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return rate
+            if age < self.max_stale:
+                # Отдаём последнее известное значение и обновляем его в фоне
+                self.stale_hits += 1
+                self._refresh(crypto)
+                return rate
+
+        self.misses += 1
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(self._refresh(crypto))
+
+    def set_rate(self, crypto: str, rate: float):
+        # Записывает курс, полученный извне (например, пакетным запросом)
+        self._rates[crypto.lower()] = (rate, time.monotonic())
+
+    def _refresh(self, crypto: str) -> asyncio.Task:
+        task = self._inflight.get(crypto)
+        if task is None:
+            task = asyncio.create_task(self._fetch(crypto))
+            self._inflight[crypto] = task
+            task.add_done_callback(lambda t: self._on_fetch_done(crypto, t))
+        return task
+
+    async def _fetch(self, crypto: str) -> float:
+        rate = await self._fetcher(crypto)
+        self.set_rate(crypto, rate)
+        return rate
+
+    def _on_fetch_done(self, crypto: str, task: asyncio.Task):
+        self._inflight.pop(crypto, None)
+        # Забираем исключение, чтобы фоновые обновления не засоряли лог предупреждениями
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+            'ages': {crypto.upper(): now - fetched_at for crypto, (_, fetched_at) in self._rates.items()},
+        }
+
+class RatePrefetcher:
+    """
+    Фоновая задача, которая по расписанию обновляет курсы всех поддерживаемых
+    криптовалют одним пакетным запросом и складывает их в кэш ``rate_service``.
+
+    Интервал между запросами слегка рандомизируется, при ошибках он растёт
+    экспоненциально до ``max_backoff``.
+    """
+
+    def __init__(self, service: CryptoRateService, interval: float = CRYPTO_RATE_REFRESH_INTERVAL,
+                 max_backoff: float = CRYPTO_RATE_MAX_BACKOFF, jitter: float = 0.1, fetcher=fetch_crypto_rates):
+        self.service = service
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self._fetcher = fetcher
+        self._task = None
+        self.failures = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="rate-prefetcher")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def refresh(self):
+        rates = await self._fetcher(SUPPORTED_CRYPTOS.keys())
+        for crypto, rate in rates.items():
+            self.service.set_rate(crypto, rate)
+
+    def next_delay(self) -> float:
+        if self.failures:
+            delay = min(self.interval * 2 ** self.failures, self.max_backoff)
+        else:
+            delay = self.interval
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+                self.failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failures += 1
+                logger.warning(f"Rate prefetch failed ({self.failures} in a row), backing off")
+            await asyncio.sleep(self.next_delay())
+
+rate_service = CryptoRateService()
+rate_prefetcher = RatePrefetcher(rate_service)
+metrics.collector('rate_cache', rate_service.stats)
+
+async def get_crypto_rate(crypto: str) -> float:
+    """
+    Получает текущий курс указанной криптовалюты к RUB через общий кэш.
+
+    :param crypto: Символ криптовалюты (например, 'BTC', 'LTC').
+    :return: Курс криптовалюты в RUB.
+    :raises ValueError: Если криптовалюта не поддерживается или данные не найдены.
+    :raises Exception: При ошибках запроса к API.
+    """
+    # В трассе видно, отдан ли курс из кэша или пришлось ждать CoinGecko
+    with tracer.span('crypto_rate.get', crypto=crypto):
+        return await rate_service.get_rate(crypto)
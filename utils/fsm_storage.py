@@ -0,0 +1,239 @@
+# utils/fsm_storage.py
+
+import asyncio
+import json
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from sqlalchemy import select, delete, func
+from database import async_session, dialect_insert
+from models import FsmState
+from config import FSM_STATE_TTL, FSM_PURGE_INTERVAL, FSM_CACHE_SIZE, FSM_CACHE_TTL
+from utils.cache import TTLCache
+from utils.metrics import metrics
+from utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Буфер текущего апдейта
+_update_buffer = ContextVar('fsm_update_buffer', default=None)
+
+class _Entry:
+    __slots__ = ('state', 'data')
+
+    def __init__(self, state=None, data=None):
+        self.state = state
+        self.data = data or {}
+
+class _UpdateBuffer:
+    __slots__ = ('entries', 'changed', 'locks')
+
+    def __init__(self):
+        self.entries = {}   # Ключи, прочитанные апдейтом: {ключ: _Entry}
+        self.changed = set()
+        self.locks = []     # Блокировки этих ключей, снимаются после записи
+
+class DbStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в базе данных: позиция пользователя в сценарии
+    покупки переживает перезапуск и доступна всем процессам бота.
+
+    Внутри ``buffer()`` (один апдейт) состояние ключа читается из базы одним
+    запросом, а изменения записываются одним upsert в конце апдейта.
+    Прочитанный ключ до этой записи остаётся за апдейтом: следующий апдейт
+    того же пользователя в этом процессе ждёт и читает уже записанное
+    состояние. Состояние, которое не менялось дольше ``ttl`` секунд,
+    считается брошенным: оно не читается и удаляется фоновой задачей.
+
+    ``enable_cache()`` оставляет прочитанные состояния в памяти процесса
+    между апдейтами. Это верно, только если апдейты пользователя всегда
+    обрабатывает один процесс (режим кластера); за балансировщиком без
+    привязки пользователей к процессу каждый апдейт читает состояние из базы.
+    """
+
+    def __init__(self, session_pool=async_session, ttl: float = FSM_STATE_TTL,
+                 purge_interval: float = FSM_PURGE_INTERVAL):
+        self.session_pool = session_pool
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._entries = None
+        # Блокировки ключей; запись пропадает, когда блокировку никто не держит и не ждёт
+        self._locks = weakref.WeakValueDictionary()
+        self._task = None
+        self.reads = 0
+        self.writes = 0
+        self.cached_reads = 0
+        self.lock_waits = 0
+        self.purged = 0
+
+    @asynccontextmanager
+    async def buffer(self):
+        """Объединяет записи FSM внутри одного апдейта в один запрос"""
+        buffer = _UpdateBuffer()
+        token = _update_buffer.set(buffer)
+        try:
+            yield
+        finally:
+            _update_buffer.reset(token)
+            try:
+                if buffer.changed:
+                    await self._write({raw_key: buffer.entries[raw_key] for raw_key in buffer.changed})
+            finally:
+                # Ключи освобождаются только после записи: иначе следующий апдейт прочитал бы старое состояние
+                for lock in buffer.locks:
+                    lock.release()
+
+    def enable_cache(self, maxsize: int = FSM_CACHE_SIZE, ttl: float = FSM_CACHE_TTL):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _lock(self, raw_key: str) -> asyncio.Lock:
+        lock = self._locks.get(raw_key)
+        if lock is None:
+            lock = self._locks[raw_key] = asyncio.Lock()
+        return lock
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        await self._changed(key, entry)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        entry = await self._entry(key)
+        entry.data = dict(data)
+        await self._changed(key, entry)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return dict((await self._entry(key)).data)
+
+    async def _entry(self, key: StorageKey) -> _Entry:
+        raw_key = self.key_builder.build(key)
+        buffer = _update_buffer.get()
+        if buffer is None:
+            return await self._load(raw_key)
+        entry = buffer.entries.get(raw_key)
+        if entry is None:
+            lock = self._lock(raw_key)
+            if lock.locked():
+                self.lock_waits += 1
+            await lock.acquire()
+            buffer.locks.append(lock)
+            entry = buffer.entries[raw_key] = await self._load(raw_key)
+        return entry
+
+    async def _load(self, raw_key: str) -> _Entry:
+        if self._entries is not None:
+            entry = self._entries.get(raw_key)
+            if entry is not None:
+                self.cached_reads += 1
+                return entry
+
+        self.reads += 1
+        with tracer.span('fsm.load'):
+            async with self.session_pool() as session:
+                result = await session.execute(
+                    select(FsmState.state, FsmState.data)
+                    .where(FsmState.key == raw_key, FsmState.expires_at > datetime.utcnow())
+                )
+                row = result.first()
+        entry = _Entry(row.state, json.loads(row.data) if row.data else None) if row else _Entry()
+        if self._entries is not None:
+            self._entries.set(raw_key, entry)
+        return entry
+
+    async def _changed(self, key: StorageKey, entry: _Entry):
+        raw_key = self.key_builder.build(key)
+        buffer = _update_buffer.get()
+        if buffer is not None:
+            buffer.changed.add(raw_key)
+        else:
+            # Вне апдейта (фоновые задачи) пишем сразу, не мешая апдейту, который держит ключ
+            async with self._lock(raw_key):
+                await self._write({raw_key: entry})
+
+    async def _write(self, entries: dict):
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+        with tracer.span('fsm.write', keys=len(entries)):
+            async with self.session_pool() as session:
+                upsert = dialect_insert(session)
+                for raw_key, entry in entries.items():
+                    if entry.state is None and not entry.data:
+                        await session.execute(delete(FsmState).where(FsmState.key == raw_key))
+                        continue
+                    values = {
+                        'state': entry.state,
+                        'data': json.dumps(entry.data, ensure_ascii=False),
+                        'expires_at': expires_at,
+                    }
+                    await session.execute(
+                        upsert(FsmState)
+                        .values(key=raw_key, **values)
+                        .on_conflict_do_update(index_elements=[FsmState.key], set_=values)
+                    )
+                await session.commit()
+        self.writes += len(entries)
+
+    async def purge_expired(self) -> int:
+        async with self.session_pool() as session:
+            result = await session.execute(
+                delete(FsmState).where(FsmState.expires_at <= datetime.utcnow())
+            )
+            await session.commit()
+        self.purged += result.rowcount
+        return result.rowcount
+
+    async def count_states(self) -> dict:
+        """Число активных (не просроченных) состояний по имени состояния"""
+        async with self.session_pool() as session:
+            result = await session.execute(
+                select(FsmState.state, func.count())
+                .where(FsmState.expires_at > datetime.utcnow())
+                .group_by(FsmState.state)
+            )
+            return {state or 'none': count for state, count in result}
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="fsm-storage-purge")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    logger.info(f"Purged {purged} expired FSM states")
+            except Exception:
+                logger.exception("Failed to purge expired FSM states")
+
+    def stats(self) -> dict:
+        return {
+            'reads': self.reads,
+            'cached_reads': self.cached_reads,
+            'lock_waits': self.lock_waits,
+            'writes': self.writes,
+            'purged': self.purged,
+            'cached': len(self._entries) if self._entries is not None else 0,
+        }
+
+    async def collect_metrics(self) -> dict:
+        return {**self.stats(), 'states': await self.count_states()}
+
+fsm_storage = DbStorage()
+metrics.collector('fsm', fsm_storage.collect_metrics)
@@ -0,0 +1,116 @@
+# utils/http_client.py
+
+import aiohttp
+import logging
+from config import (
+    HTTP_CONNECTION_LIMIT,
+    HTTP_CONNECTION_LIMIT_PER_HOST,
+    HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_REQUEST_TIMEOUT,
+)
+from utils.metrics import metrics
+from utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+class HttpClient:
+    """
+    Общий HTTP-клиент для внешних интеграций из ``utils/``.
+
+    Держит один ``aiohttp.ClientSession`` с пулом keep-alive соединений и
+    кэшем DNS на всё время работы приложения. Открывается при старте
+    (или лениво при первом запросе) и закрывается при остановке бота.
+    """
+
+    def __init__(self):
+        self._session = None
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.dns_lookups = 0
+        self.dns_cache_hits = 0
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_CONNECTION_LIMIT,
+            limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_REQUEST_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=[self._trace_config()],
+        )
+        logger.info("External HTTP client started")
+
+    async def close(self):
+        if self._session is None:
+            return
+        await self._session.close()
+        self._session = None
+        logger.info(f"External HTTP client closed: {self.stats()}")
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def stats(self) -> dict:
+        connections = self.new_connections + self.reused_connections
+        return {
+            'requests': self.requests,
+            'new_connections': self.new_connections,
+            'reused_connections': self.reused_connections,
+            'reuse_ratio': self.reused_connections / connections if connections else 0.0,
+            'dns_lookups': self.dns_lookups,
+            'dns_cache_hits': self.dns_cache_hits,
+        }
+
+    # --- Счётчики соединений и участки трасс через трассировку aiohttp ---
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_request_exception.append(self._on_request_exception)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_dns_resolvehost_end.append(self._on_dns_resolvehost_end)
+        trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        return trace_config
+
+    async def _on_request_start(self, session, context, params):
+        # Участок запроса в трассе апдейта (вне трассы ничего не записывается)
+        context.trace_span = tracer.start_span('http.request', method=params.method,
+                                               url=f"{params.url.host}{params.url.path}")
+
+    async def _on_request_end(self, session, context, params):
+        self.requests += 1
+        if context.trace_span is not None:
+            context.trace_span.attributes['status'] = params.response.status
+        tracer.end_span(context.trace_span)
+
+    async def _on_request_exception(self, session, context, params):
+        tracer.end_span(context.trace_span, params.exception)
+
+    async def _on_connection_create_end(self, session, context, params):
+        self.new_connections += 1
+
+    async def _on_connection_reuseconn(self, session, context, params):
+        self.reused_connections += 1
+
+    async def _on_dns_resolvehost_end(self, session, context, params):
+        self.dns_lookups += 1
+
+    async def _on_dns_cache_hit(self, session, context, params):
+        self.dns_cache_hits += 1
+
+http_client = HttpClient()
+metrics.collector('http_client', http_client.stats)
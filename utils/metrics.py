@@ -0,0 +1,218 @@
+# utils/metrics.py
+
+import inspect
+import logging
+import math
+from bisect import bisect_left
+from aiohttp import web
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек (в секундах)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield self.name + '_total', _format_labels(self.labels, label_values), value
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами и метками. ``observe`` стоит
+    один bisect и несколько обращений к словарю, поэтому годится для
+    замера каждого апдейта и каждого SQL-запроса.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # значения меток -> [счётчики корзин..., +Inf, сумма]
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def series(self):
+        """Возвращает {значения меток: (число наблюдений, сумма)}"""
+        return {label_values: (sum(series[:-1]), series[-1]) for label_values, series in self._series.items()}
+
+    def quantile(self, q: float, *label_values) -> float:
+        """Оценка квантиля по корзинам (линейная интерполяция, как histogram_quantile в Prometheus)"""
+        series = self._series.get(label_values)
+        if not series:
+            return 0.0
+        counts = series[:-1]
+        rank = q * sum(counts)
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def samples(self):
+        for label_values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), label_values + (_format_value(bound),))
+                yield self.name + '_bucket', labels, cumulative
+            labels = _format_labels(self.labels, label_values)
+            yield self.name + '_count', labels, cumulative
+            yield self.name + '_sum', labels, series[-1]
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса.
+
+    Счётчики и гистограммы обновляются на горячем пути. Остальное (размеры
+    и попадания кэшей, очередь отправки, состояния FSM) собирается только в
+    момент запроса из ``stats()`` компонентов через зарегистрированные
+    сборщики, поэтому не стоит ничего на каждом апдейте.
+    """
+
+    def __init__(self, prefix: str = 'cryptohand'):
+        self.prefix = prefix
+        self._metrics = {}
+        self._collectors = []
+        self._runner = None
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", documentation, labels, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str):
+        return self._metrics.get(f"{self.prefix}_{name}")
+
+    def collector(self, component: str, func):
+        """
+        Регистрирует сборщик: ``func()`` (можно корутину) возвращает словарь
+        числовых значений. Вложенные словари становятся метрикой с меткой ``key``.
+        """
+        self._collectors.append((component, func))
+
+    async def collect(self) -> dict:
+        """Возвращает {компонент: словарь значений} от всех сборщиков"""
+        collected = {}
+        for component, func in self._collectors:
+            try:
+                values = func()
+                if inspect.isawaitable(values):
+                    values = await values
+            except Exception:
+                logger.exception(f"Metrics collector {component} failed")
+                continue
+            collected[component] = values
+        return collected
+
+    async def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+
+        for component, values in (await self.collect()).items():
+            for key, value in values.items():
+                name = f"{self.prefix}_{component}_{key}"
+                if isinstance(value, dict):
+                    samples = [(_format_labels(('key',), (label,)), item) for label, item in value.items()]
+                else:
+                    samples = [('', value)]
+                samples = [(labels, item) for labels, item in samples if isinstance(item, (int, float))]
+                if not samples:
+                    continue
+                lines.append(f"# TYPE {name} gauge")
+                for labels, item in samples:
+                    lines.append(f"{name}{labels} {_format_value(item)}")
+        return '\n'.join(lines) + '\n'
+
+    # --- HTTP-эндпоинт для Prometheus ---
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=await self.render(), content_type='text/plain', charset='utf-8')
+
+    async def start_server(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        if not port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as e:
+            # Занятый порт не должен мешать боту работать
+            logger.error(f"Metrics endpoint is not available on {host}:{port}: {e}")
+            await runner.cleanup()
+            return
+        self._runner = runner
+        logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        if self._runner is None:
+            return
+        await self._runner.cleanup()
+        self._runner = None
+
+metrics = MetricsRegistry()
+
+# Метрики горячего пути; модули импортируют их отсюда
+update_latency = metrics.histogram('update_seconds', "Update processing time", ('type',))
+update_errors = metrics.counter('update_errors', "Updates that raised an exception", ('type',))
+handler_latency = metrics.histogram('handler_seconds', "Handler time by router and handler", ('router', 'handler'))
+db_statement_latency = metrics.histogram('db_statement_seconds', "SQL statement execution time", ('statement',))
+rate_fetch_latency = metrics.histogram('rate_fetch_seconds', "CoinGecko rate request time")
+rate_fetch_errors = metrics.counter('rate_fetch_errors', "Failed CoinGecko rate requests")
+telegram_request_latency = metrics.histogram('telegram_request_seconds', "Bot API request time", ('method',))
+telegram_request_errors = metrics.counter('telegram_request_errors', "Failed Bot API requests", ('method',))
@@ -0,0 +1,65 @@
+# utils/payment_catalog.py
+
+import logging
+from collections import namedtuple
+from types import MappingProxyType
+from sqlalchemy import select
+from database import async_session
+from models import PaymentDetails
+from utils.cluster_bus import cluster_bus
+
+logger = logging.getLogger(__name__)
+
+# Событие шины: реквизиты добавлены или удалены
+PAYMENT_CATALOG_CHANGED = 'payment_catalog_changed'
+
+PaymentDetail = namedtuple('PaymentDetail', ['id', 'bank_name', 'card_number', 'recipient_name'])
+
+# Неизменяемый снимок реквизитов: список, способы оплаты и реквизиты по банку
+CatalogSnapshot = namedtuple('CatalogSnapshot', ['details', 'methods', 'by_bank'])
+
+EMPTY_SNAPSHOT = CatalogSnapshot((), (), MappingProxyType({}))
+
+class PaymentCatalog:
+    """
+    Реквизиты оплаты в памяти процесса.
+
+    Таблица ``payment_details`` меняется только из админ-панели, поэтому снимок
+    пересобирается целиком после каждого добавления или удаления реквизитов,
+    а процесс покупки читает его без обращения к базе.
+    """
+
+    def __init__(self):
+        self._snapshot = EMPTY_SNAPSHOT
+
+    async def reload(self):
+        async with async_session() as session:
+            result = await session.execute(select(PaymentDetails).order_by(PaymentDetails.id))
+            rows = result.scalars().all()
+
+        details = tuple(
+            PaymentDetail(row.id, row.bank_name, row.card_number, row.recipient_name)
+            for row in rows
+        )
+        by_bank = {}
+        for detail in details:
+            # Для банка с несколькими картами используем добавленную первой
+            by_bank.setdefault(detail.bank_name, detail)
+        self._snapshot = CatalogSnapshot(details, tuple(by_bank), MappingProxyType(by_bank))
+        logger.info(f"Payment catalog reloaded: {len(details)} details, {len(by_bank)} methods")
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        return self._snapshot
+
+    def methods(self) -> tuple:
+        return self._snapshot.methods
+
+    def details(self) -> tuple:
+        return self._snapshot.details
+
+    def details_for(self, bank_name: str):
+        return self._snapshot.by_bank.get(bank_name)
+
+payment_catalog = PaymentCatalog()
+cluster_bus.subscribe(PAYMENT_CATALOG_CHANGED, lambda payload: payment_catalog.reload())
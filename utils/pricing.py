@@ -0,0 +1,91 @@
+# utils/pricing.py
+
+import time
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from typing import NamedTuple
+from config import QUOTE_TTL
+
+RUB = '₽'
+
+# Точность сумм: 8 знаков (сатоши) для криптовалюты, копейки для рублей
+CRYPTO_STEP = Decimal('0.00000001')
+RUB_STEP = Decimal('0.01')
+_ONE = Decimal(1)
+_HUNDRED = Decimal(100)
+
+class Quote(NamedTuple):
+    """
+    Зафиксированная цена заявки: курс и комиссия на момент ввода суммы и
+    суммы в обеих валютах. Считается один раз в enter_amount, хранится в
+    данных FSM, а следующие шаги показывают и сохраняют в заявку те же суммы.
+    """
+    crypto: str
+    rate: Decimal             # Курс, ₽ за монету
+    commission_rate: Decimal  # Комиссия, %
+    amount_crypto: Decimal    # Сколько криптовалюты получит пользователь
+    amount_rub: Decimal       # Стоимость криптовалюты по курсу, без комиссии
+    commission: Decimal       # Комиссия, ₽
+    amount_to_pay: Decimal    # К оплате, ₽
+    is_rub: bool              # Сумма введена в рублях
+    expires_at: float         # До какого момента (time.time()) действует цена
+
+    def is_expired(self, now: float = None) -> bool:
+        return (time.time() if now is None else now) >= self.expires_at
+
+    def to_dict(self) -> dict:
+        """Для данных FSM (JSON): Decimal сохраняются строками без потери точности"""
+        return {field: str(value) if field in _DECIMAL_FIELDS else value for field, value in zip(self._fields, self)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Quote':
+        return cls(**{
+            field: Decimal(data[field]) if field in _DECIMAL_FIELDS else data[field]
+            for field in cls._fields
+        })
+
+_DECIMAL_FIELDS = frozenset(
+    field for field, annotation in Quote.__annotations__.items() if annotation is Decimal
+)
+
+def to_decimal(value) -> Decimal:
+    # float переводится через str: 5000000.1 остаётся 5000000.1, а не 5000000.0999999996...
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+def price_many(amounts, currency, crypto: str, rate, commission_rate,
+               ttl: float = QUOTE_TTL, now: float = None) -> list:
+    """
+    Считает цены для многих сумм по одному курсу и одной комиссии
+    (commission_rate в процентах). Курс и множитель комиссии переводятся в
+    Decimal один раз на весь список.
+
+    Сумма криптовалюты округляется вниз до 8 знаков, рубли - до копеек:
+    к оплате = стоимость по курсу + комиссия.
+
+    :raises decimal.InvalidOperation: Если сумма не помещается в точность Decimal.
+    """
+    rate = to_decimal(rate)
+    commission_rate = to_decimal(commission_rate)
+    factor = commission_rate / _HUNDRED
+    expires_at = (time.time() if now is None else now) + ttl
+    quotes = []
+    for amount in amounts:
+        amount = to_decimal(amount)
+        # Без указания валюты сумма от 1 считается рублями, меньше 1 - криптовалютой
+        is_rub = currency == RUB or (currency is None and amount >= _ONE)
+        if is_rub:
+            amount_rub = amount.quantize(RUB_STEP, ROUND_HALF_UP)
+            amount_crypto = (amount_rub / rate).quantize(CRYPTO_STEP, ROUND_DOWN)
+        else:
+            amount_crypto = amount.quantize(CRYPTO_STEP, ROUND_DOWN)
+            amount_rub = (amount_crypto * rate).quantize(RUB_STEP, ROUND_HALF_UP)
+        commission = (amount_rub * factor).quantize(RUB_STEP, ROUND_HALF_UP)
+        quotes.append(Quote(
+            crypto, rate, commission_rate, amount_crypto, amount_rub, commission,
+            amount_rub + commission, is_rub, expires_at,
+        ))
+    return quotes
+
+def make_quote(amount, currency, crypto: str, rate, commission_rate,
+               ttl: float = QUOTE_TTL, now: float = None) -> Quote:
+    """Цена одной суммы; см. ``price_many``"""
+    return price_many((amount,), currency, crypto, rate, commission_rate, ttl, now)[0]
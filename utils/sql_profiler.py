@@ -0,0 +1,233 @@
+# utils/sql_profiler.py
+
+import asyncio
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event
+from config import (
+    SQL_PROFILER,
+    SQL_PROFILER_QUERY_BUDGET,
+    SQL_PROFILER_MAX_REPEATS,
+    SQL_PROFILER_REPORT_INTERVAL,
+    SQL_PROFILER_TOP_N,
+)
+
+logger = logging.getLogger(__name__)
+
+# Профиль апдейта, который сейчас обрабатывается в этой задаче
+_current_profile = ContextVar('sql_profile', default=None)
+
+# Списки параметров IN (?, ?, ?) схлопываются, чтобы запросы с разным числом значений совпадали
+_PARAMETER_LIST = re.compile(r'\(\s*(?:\?|%s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%s|\$\d+|:\w+))*\s*\)')
+# Многострочный VALUES (?), (?), ... пакетной вставки схлопывается так же
+_VALUES_ROWS = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+_WHITESPACE = re.compile(r'\s+')
+
+# Запросы вне апдейтов: фоновые задачи, старт и остановка бота
+BACKGROUND = 'background'
+
+class UpdateProfile:
+    """Запросы одного апдейта: форма запроса и время выполнения"""
+
+    __slots__ = ('handler', 'statements')
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.statements = []
+
+class _ShapeStats:
+    __slots__ = ('count', 'total', 'max', 'handlers')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.handlers = Counter()
+
+class _HandlerStats:
+    __slots__ = ('updates', 'statements', 'total', 'over_budget', 'repeated')
+
+    def __init__(self):
+        self.updates = 0
+        self.statements = 0
+        self.total = 0.0
+        self.over_budget = 0
+        self.repeated = 0
+
+class SqlProfiler:
+    """
+    Профилировщик SQL-запросов на событиях движка SQLAlchemy (включается
+    настройкой ``SQL_PROFILER``).
+
+    Каждый запрос вместе с временем выполнения приписывается хендлеру,
+    апдейт которого его вызвал. Апдейт, превысивший ``query_budget``
+    запросов или выполнивший один и тот же запрос больше ``max_repeats``
+    раз (признак N+1), попадает в лог с предупреждением. Раз в
+    ``report_interval`` секунд в лог пишется отчёт: самые затратные запросы
+    и хендлеры с наибольшим числом запросов за этот период.
+    """
+
+    def __init__(self, enabled: bool = SQL_PROFILER, query_budget: int = SQL_PROFILER_QUERY_BUDGET,
+                 max_repeats: int = SQL_PROFILER_MAX_REPEATS, report_interval: float = SQL_PROFILER_REPORT_INTERVAL,
+                 top_n: int = SQL_PROFILER_TOP_N):
+        self.enabled = enabled
+        self.query_budget = query_budget
+        self.max_repeats = max_repeats
+        self.report_interval = report_interval
+        self.top_n = top_n
+        self._shapes = {}  # текст запроса -> форма
+        self._task = None
+        self.reset()
+
+    def reset(self):
+        self._by_shape = {}
+        self._by_handler = {}
+        self._window_started = time.monotonic()
+
+    # --- Сбор ---
+
+    def install(self, engine):
+        if not self.enabled:
+            return
+
+        @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+        def statement_started(conn, cursor, statement, parameters, context, executemany):
+            context._profiler_started = time.perf_counter()
+
+        @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+        def statement_finished(conn, cursor, statement, parameters, context, executemany):
+            self.record(statement, time.perf_counter() - context._profiler_started)
+
+        logger.info(f"SQL profiler enabled (budget {self.query_budget} statements per update)")
+
+    def shape(self, statement: str) -> str:
+        shape = self._shapes.get(statement)
+        if shape is None:
+            shape = _PARAMETER_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+            shape = _VALUES_ROWS.sub('(?), ...', shape)
+            if len(self._shapes) > 10000:
+                self._shapes.clear()
+            self._shapes[statement] = shape
+        return shape
+
+    def record(self, statement: str, elapsed: float):
+        shape = self.shape(statement)
+        profile = _current_profile.get()
+        if profile is not None:
+            # Хендлер станет известен после фильтров, поэтому учитываем запрос в конце апдейта
+            profile.statements.append((shape, elapsed))
+            return
+        stats = self._handler_stats(BACKGROUND)
+        stats.statements += 1
+        stats.total += elapsed
+        self._add_shape(shape, elapsed, BACKGROUND)
+
+    def _add_shape(self, shape: str, elapsed: float, handler: str):
+        stats = self._by_shape.get(shape)
+        if stats is None:
+            stats = self._by_shape[shape] = _ShapeStats()
+        stats.count += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        stats.handlers[handler] += 1
+
+    def _handler_stats(self, handler: str) -> _HandlerStats:
+        stats = self._by_handler.get(handler)
+        if stats is None:
+            stats = self._by_handler[handler] = _HandlerStats()
+        return stats
+
+    def begin_update(self, name: str):
+        """Открывает профиль апдейта; возвращает токен для ``end_update``"""
+        profile = UpdateProfile(name)
+        return profile, _current_profile.set(profile)
+
+    def set_handler(self, name: str):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.handler = name
+
+    def end_update(self, started):
+        profile, token = started
+        _current_profile.reset(token)
+
+        statements = profile.statements
+        stats = self._handler_stats(profile.handler)
+        stats.updates += 1
+        stats.statements += len(statements)
+        for shape, elapsed in statements:
+            stats.total += elapsed
+            self._add_shape(shape, elapsed, profile.handler)
+
+        if len(statements) > self.query_budget:
+            stats.over_budget += 1
+            logger.warning(
+                f"{profile.handler}: {len(statements)} SQL statements in one update "
+                f"(budget {self.query_budget}), {sum(e for _, e in statements) * 1000:.1f} ms in DB"
+            )
+        repeats = Counter(shape for shape, _ in statements)
+        repeated = [(shape, count) for shape, count in repeats.items() if count > self.max_repeats]
+        if repeated:
+            stats.repeated += 1
+            for shape, count in repeated:
+                logger.warning(f"{profile.handler}: same SQL statement ran {count} times in one update "
+                               f"(possible N+1): {shape[:300]}")
+
+    # --- Отчёт ---
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self._window_started
+        statements = sum(stats.count for stats in self._by_shape.values())
+        lines = [f"SQL profile for the last {elapsed:.0f}s: {statements} statements"]
+
+        lines.append(f"Top {self.top_n} statements by total time:")
+        top_shapes = sorted(self._by_shape.items(), key=lambda item: item[1].total, reverse=True)[:self.top_n]
+        for position, (shape, stats) in enumerate(top_shapes, start=1):
+            handlers = ', '.join(f"{handler} x{count}" for handler, count in stats.handlers.most_common(3))
+            lines.append(
+                f"{position:>3}. total {stats.total * 1000:.1f} ms, {stats.count}x, "
+                f"avg {stats.total / stats.count * 1000:.2f} ms, max {stats.max * 1000:.1f} ms "
+                f"[{handlers}] {shape[:200]}"
+            )
+
+        lines.append(f"Top {self.top_n} handlers by statements per update:")
+        handlers = [(name, stats) for name, stats in self._by_handler.items() if stats.updates]
+        handlers.sort(key=lambda item: item[1].statements / item[1].updates, reverse=True)
+        for name, stats in handlers[:self.top_n]:
+            lines.append(
+                f"     {name}: {stats.updates} updates, {stats.statements / stats.updates:.1f} statements/update, "
+                f"{stats.total / stats.updates * 1000:.1f} ms DB/update, "
+                f"over budget {stats.over_budget}, repeated statements {stats.repeated}"
+            )
+        background = self._by_handler.get(BACKGROUND)
+        if background is not None:
+            lines.append(f"     {BACKGROUND}: {background.statements} statements, {background.total * 1000:.1f} ms DB")
+        return '\n'.join(lines)
+
+    def start(self):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(), name="sql-profiler-report")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._by_shape:
+            logger.info(self.report())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            if self._by_shape:
+                logger.info(self.report())
+            self.reset()
+
+sql_profiler = SqlProfiler()
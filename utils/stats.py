@@ -0,0 +1,184 @@
+# utils/stats.py
+
+import logging
+from datetime import datetime
+from sqlalchemy import select, update, delete, insert, func, case
+from database import dialect_insert
+from models import StatCounter, UserStats, User, Application
+
+logger = logging.getLogger(__name__)
+
+# Названия счётчиков в таблице stat_counters
+USERS = 'users'
+APPLICATIONS = 'applications'
+TURNOVER = 'turnover_completed'  # Сумма amount_rub по выполненным заявкам
+STATUS_PREFIX = 'status:'
+
+def status_counter(status: str) -> str:
+    return f"{STATUS_PREFIX}{status}"
+
+async def increment_counters(session, deltas: dict):
+    """
+    Прибавляет значения к счётчикам в рамках транзакции переданной сессии.
+    Все счётчики меняются одним upsert с несколькими строками VALUES; новый
+    счётчик создаётся тем же запросом, поэтому параллельные транзакции
+    PostgreSQL не конфликтуют при его первой записи.
+
+    :param session: Сессия, в которой выполняется изменение данных.
+    :param deltas: Словарь {название счётчика: приращение}.
+    """
+    now = datetime.utcnow()
+    # Строки упорядочены по имени: параллельные транзакции блокируют счётчики в одном порядке
+    rows = [
+        {'name': name, 'value': delta, 'updated_at': now}
+        for name, delta in sorted(deltas.items())
+        if delta
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(session)(StatCounter).values(rows)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[StatCounter.name],
+            set_={'value': StatCounter.value + stmt.excluded.value, 'updated_at': stmt.excluded.updated_at},
+        )
+    )
+
+async def record_user_created(session):
+    await increment_counters(session, {USERS: 1})
+
+async def record_application_created(session, application: Application):
+    deltas = {APPLICATIONS: 1, status_counter(application.status): 1}
+    if application.status == 'completed':
+        deltas[TURNOVER] = application.amount_rub
+    await increment_counters(session, deltas)
+
+    # Сводка по пользователю
+    completed = 1 if application.status == 'completed' else 0
+    result = await session.execute(
+        update(UserStats)
+        .where(UserStats.user_id == application.user_id)
+        .values(
+            total_count=UserStats.total_count + 1,
+            completed_count=UserStats.completed_count + completed,
+            amount_rub_sum=UserStats.amount_rub_sum + application.amount_rub,
+            last_wallet=application.wallet_address,
+            last_crypto=application.crypto_type,
+            last_rate=application.crypto_rub_rate,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        # Сводки ещё нет: строим её по уже сохранённым заявкам пользователя
+        await session.flush()
+        await rebuild_user_stats(session, application.user_id)
+
+async def record_status_change(session, application: Application, old_status: str):
+    new_status = application.status
+    if old_status == new_status:
+        return
+    deltas = {status_counter(old_status): -1, status_counter(new_status): 1}
+    if new_status == 'completed':
+        deltas[TURNOVER] = application.amount_rub
+    elif old_status == 'completed':
+        deltas[TURNOVER] = -application.amount_rub
+    await increment_counters(session, deltas)
+
+    completed = (new_status == 'completed') - (old_status == 'completed')
+    if completed:
+        await session.execute(
+            update(UserStats)
+            .where(UserStats.user_id == application.user_id)
+            .values(completed_count=UserStats.completed_count + completed)
+            .execution_options(synchronize_session=False)
+        )
+
+def _user_rollup_select(user_id=None):
+    # Агрегаты и последняя заявка по каждому пользователю (или по одному user_id)
+    aggregates = select(
+        Application.user_id,
+        func.count(Application.id).label('total_count'),
+        func.coalesce(func.sum(case((Application.status == 'completed', 1), else_=0)), 0).label('completed_count'),
+        func.coalesce(func.sum(Application.amount_rub), 0).label('amount_rub_sum'),
+        func.max(Application.id).label('last_id'),
+    ).group_by(Application.user_id)
+    if user_id is not None:
+        aggregates = aggregates.where(Application.user_id == user_id)
+    aggregates = aggregates.subquery()
+
+    return select(
+        aggregates.c.user_id,
+        aggregates.c.total_count,
+        aggregates.c.completed_count,
+        aggregates.c.amount_rub_sum,
+        Application.wallet_address,
+        Application.crypto_type,
+        Application.crypto_rub_rate,
+    ).join(Application, Application.id == aggregates.c.last_id)
+
+_USER_STATS_COLUMNS = [
+    'user_id', 'total_count', 'completed_count', 'amount_rub_sum',
+    'last_wallet', 'last_crypto', 'last_rate',
+]
+
+async def rebuild_user_stats(session, user_id: int) -> UserStats:
+    """
+    Пересчитывает сводку одного пользователя по его заявкам.
+    Для пользователя без заявок создаётся нулевая сводка.
+    """
+    await session.execute(delete(UserStats).where(UserStats.user_id == user_id))
+    result = await session.execute(_user_rollup_select(user_id))
+    row = result.first()
+    if row is None:
+        stats = UserStats(user_id=user_id, total_count=0, completed_count=0, amount_rub_sum=0)
+    else:
+        stats = UserStats(**dict(zip(_USER_STATS_COLUMNS, row)))
+    session.add(stats)
+    return stats
+
+async def get_user_stats(session, user_id: int) -> UserStats:
+    # Одно чтение по первичному ключу; сводка строится при первом обращении
+    # и сохраняется вместе с транзакцией апдейта
+    stats = await session.get(UserStats, user_id)
+    if stats is None:
+        stats = await rebuild_user_stats(session, user_id)
+    return stats
+
+async def get_counters(session) -> dict:
+    result = await session.execute(select(StatCounter.name, StatCounter.value))
+    return dict(result.fetchall())
+
+async def rebuild_counters(session) -> dict:
+    """
+    Пересчитывает все счётчики и сводки пользователей по таблицам users и applications.
+    Коммит выполняет вызывающий код.
+    """
+    counters = {}
+
+    result = await session.execute(select(func.count(User.id)))
+    counters[USERS] = result.scalar() or 0
+
+    result = await session.execute(
+        select(Application.status, func.count(Application.id)).group_by(Application.status)
+    )
+    for status, count in result.fetchall():
+        counters[status_counter(status)] = count
+    counters[APPLICATIONS] = sum(
+        value for name, value in counters.items() if name.startswith(STATUS_PREFIX)
+    )
+
+    result = await session.execute(
+        select(func.sum(Application.amount_rub)).where(Application.status == 'completed')
+    )
+    counters[TURNOVER] = result.scalar() or 0.0
+
+    await session.execute(delete(StatCounter))
+    session.add_all(StatCounter(name=name, value=value) for name, value in counters.items())
+
+    # Сводки по пользователям пересобираем одним INSERT ... SELECT
+    await session.execute(delete(UserStats))
+    await session.execute(
+        insert(UserStats).from_select(_USER_STATS_COLUMNS, _user_rollup_select())
+    )
+    logger.info(f"Statistics counters rebuilt: {counters}")
+    return counters
@@ -0,0 +1,180 @@
+# utils/telegram_limiter.py
+
+import asyncio
+import logging
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, EditMessageText, EditMessageReplyMarkup
+from config import (
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_MAX_RETRIES,
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Методы, на которые распространяются лимиты Telegram на отправку сообщений
+THROTTLED_METHODS = (SendMessage, EditMessageText, EditMessageReplyMarkup)
+# Методы, у которых важно только последнее значение: устаревшие правки можно пропускать
+MERGEABLE_METHODS = (EditMessageText, EditMessageReplyMarkup)
+
+class TokenBucket:
+    """
+    Корзина токенов с резервированием: каждый вызов ``reserve`` забирает токен
+    и возвращает, сколько секунд нужно подождать до своей очереди.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def pause(self, seconds: float):
+        # После 429 новые токены начнут появляться только через seconds
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии бота, выстраивающий исходящие сообщения в очередь.
+
+    Соблюдает общий лимит Telegram и лимит на один чат, повторяет запрос
+    после ``retry_after`` при 429, а из нескольких ожидающих правок одного
+    сообщения отправляет только последнюю.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 chat_burst: float = TELEGRAM_CHAT_BURST, max_retries: int = TELEGRAM_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._latest_edits = {}  # (метод, чат, сообщение) -> Future последней правки
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.sent = 0
+        self.merged = 0
+        self.retries = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def set_global_rate(self, rate: float):
+        # В режиме кластера общий лимит бота делится между процессами
+        self.global_bucket = TokenBucket(rate, max(rate, 1))
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, THROTTLED_METHODS) or method.chat_id is None:
+            return await make_request(bot, method)
+
+        started = time.monotonic()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            if isinstance(method, MERGEABLE_METHODS) and method.message_id is not None:
+                return await self._send_edit(make_request, bot, method)
+            return await self._send(make_request, bot, method)
+        finally:
+            self.queue_depth -= 1
+            latency = time.monotonic() - started
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    async def _send_edit(self, make_request, bot, method):
+        key = (type(method), str(method.chat_id), method.message_id)
+        future = asyncio.get_running_loop().create_future()
+        self._latest_edits[key] = future
+        try:
+            await self._wait_for_slot(method.chat_id)
+            latest = self._latest_edits.get(key)
+            if latest is not future:
+                # Пока мы ждали, пришла более новая правка того же сообщения
+                self.merged += 1
+                result = await asyncio.shield(latest)
+            else:
+                result = await self._request(make_request, bot, method)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                future.exception()  # помечаем исключение как полученное
+            raise
+        finally:
+            if self._latest_edits.get(key) is future:
+                del self._latest_edits[key]
+
+    async def _send(self, make_request, bot, method):
+        await self._wait_for_slot(method.chat_id)
+        return await self._request(make_request, bot, method)
+
+    async def _request(self, make_request, bot, method):
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                self.retries += 1
+                logger.warning(f"Flood control on {type(method).__name__} in chat {method.chat_id}, retrying in {e.retry_after}s")
+                self._chat_bucket(method.chat_id).pause(e.retry_after)
+                await self._wait_for_slot(method.chat_id)
+
+    async def _wait_for_slot(self, chat_id):
+        # Сначала очередь чата, затем общая: так один «шумный» чат не занимает общий лимит
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        delay = self.global_bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        chat_id = str(chat_id)
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Удаляем корзины чатов, которые давно ничего не отправляли
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.is_idle()}
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def stats(self) -> dict:
+        completed = self.sent + self.merged + self.failed
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'sent': self.sent,
+            'merged': self.merged,
+            'retries': self.retries,
+            'failed': self.failed,
+            'avg_latency': self.total_latency / completed if completed else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+outbound_limiter = OutboundRateLimiter()
+metrics.collector('telegram_queue', outbound_limiter.stats)
@@ -0,0 +1,304 @@
+# utils/tracing.py
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from sqlalchemy import event
+from config import (
+    TRACING_ENABLED,
+    TRACING_SAMPLE_RATE,
+    TRACING_SLOW_THRESHOLD,
+    TRACING_FILE,
+    TRACING_MAX_BYTES,
+    TRACING_BACKUP_COUNT,
+    TRACING_FLUSH_INTERVAL,
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Открытый участок трассы в текущей задаче
+_current_span = ContextVar('trace_span', default=None)
+
+# Ограничения, чтобы цикл в хендлере или зависшая база не раздували память
+MAX_SPANS_PER_TRACE = 500
+MAX_BUFFERED_SPANS = 50000
+
+# Вне трассы span() возвращает готовый пустой контекст, не создавая генератор
+_NO_SPAN = nullcontext()
+
+class _Trace:
+    __slots__ = ('trace_id', 'sampled', 'spans', 'dropped')
+
+    def __init__(self, sampled: bool):
+        self.trace_id = '%032x' % random.getrandbits(128)
+        self.sampled = sampled
+        self.spans = []
+        self.dropped = 0
+
+class Span:
+    """Участок трассы: имя, время начала, длительность и атрибуты"""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start', 'started', 'duration', 'attributes', 'error')
+
+    def __init__(self, trace: _Trace, parent_id, name: str, attributes: dict):
+        self.trace = trace
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+    def finish(self, error: BaseException = None):
+        self.duration = time.perf_counter() - self.started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"[:300]
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            # У незавершённого участка (например, фоновой задачи апдейта) длительности нет
+            'duration_ms': None if self.duration is None else round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+class JsonlExporter:
+    """
+    Пишет участки трасс в JSONL-файл, по одному участку на строку. Строки
+    копятся в памяти и дописываются в файл в отдельном потоке раз в
+    ``flush_interval`` секунд. Файл больше ``max_bytes`` переименовывается
+    в ``<file>.1`` (старые сдвигаются до ``<file>.<backup_count>``), как в
+    ``logging.handlers.RotatingFileHandler``.
+    """
+
+    def __init__(self, path: str = TRACING_FILE, max_bytes: int = TRACING_MAX_BYTES,
+                 backup_count: int = TRACING_BACKUP_COUNT, flush_interval: float = TRACING_FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._task = None
+        self._lock = asyncio.Lock()
+        self.traces = 0
+        self.spans = 0
+        self.dropped = 0
+
+    def export(self, trace: _Trace):
+        if len(self._buffer) >= MAX_BUFFERED_SPANS:
+            # Диск не успевает: теряем трассу, а не память
+            self.dropped += len(trace.spans)
+            return
+        self._buffer.extend(span.to_dict() for span in trace.spans)
+        self.traces += 1
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="trace-exporter")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            records, self._buffer = self._buffer, []
+            if not records:
+                return
+            try:
+                await asyncio.to_thread(self._write, records)
+            except OSError:
+                logger.exception(f"Failed to write traces to {self.path}")
+                self.dropped += len(records)
+                return
+            self.spans += len(records)
+
+    def _write(self, records: list):
+        data = ''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in records).encode()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, 'ab') as file:
+            file.write(data)
+
+    def _rotate(self):
+        if not self.backup_count:
+            os.remove(self.path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+class Tracer:
+    """
+    Трассировка апдейтов (включается настройкой ``TRACING_ENABLED``).
+
+    ``trace()`` открывает корневой участок апдейта, ``span()`` — вложенные
+    участки (фильтры, хендлер, FSM), а запросы к базе, внешние HTTP-запросы
+    и запросы к Bot API записываются через события SQLAlchemy, трассировку
+    aiohttp и middleware сессии бота. Вне трассы все вызовы ничего не делают.
+
+    Записывается доля ``sample_rate`` апдейтов, а при ``slow_threshold`` > 0
+    участки собираются для каждого апдейта, и трасса, которая длилась дольше
+    порога, записывается всегда — по ней можно разобрать жалобу на медленный
+    ответ, не включая полную трассировку.
+    """
+
+    def __init__(self, enabled: bool = TRACING_ENABLED, sample_rate: float = TRACING_SAMPLE_RATE,
+                 slow_threshold: float = TRACING_SLOW_THRESHOLD, exporter: JsonlExporter = None):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.exporter = exporter or JsonlExporter()
+
+    def trace(self, name: str, **attributes):
+        """Корневой участок апдейта; решает, будет ли трасса записана"""
+        sampled = random.random() < self.sample_rate
+        if not self.enabled or not (sampled or self.slow_threshold):
+            return _NO_SPAN
+        return self._trace(sampled, name, attributes)
+
+    @contextmanager
+    def _trace(self, sampled: bool, name: str, attributes: dict):
+        trace = _Trace(sampled)
+        root = Span(trace, None, name, attributes)
+        trace.spans.append(root)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.finish(e)
+            raise
+        else:
+            root.finish()
+        finally:
+            _current_span.reset(token)
+            if sampled or root.duration >= self.slow_threshold:
+                root.attributes['sampled'] = 'rate' if sampled else 'slow'
+                if trace.dropped:
+                    root.attributes['dropped_spans'] = trace.dropped
+                self.exporter.export(trace)
+
+    def span(self, name: str, **attributes):
+        """Вложенный участок, который становится текущим на время блока"""
+        span = self.start_span(name, **attributes)
+        if span is None:
+            return _NO_SPAN
+        return self._activate(span)
+
+    @staticmethod
+    @contextmanager
+    def _activate(span: Span):
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(e)
+            raise
+        else:
+            span.finish()
+        finally:
+            _current_span.reset(token)
+
+    def start_span(self, name: str, **attributes):
+        """
+        Открывает дочерний участок текущего, не делая его текущим: для
+        колбэков, где начало и конец операции приходят отдельными событиями.
+        Завершается ``end_span``. Вне трассы возвращает None.
+        """
+        parent = _current_span.get()
+        if parent is None:
+            return None
+        trace = parent.trace
+        if len(trace.spans) >= MAX_SPANS_PER_TRACE:
+            trace.dropped += 1
+            return None
+        span = Span(trace, parent.span_id, name, attributes)
+        trace.spans.append(span)
+        return span
+
+    @staticmethod
+    def end_span(span, error: BaseException = None):
+        if span is not None:
+            span.finish(error)
+
+    @staticmethod
+    def annotate(**attributes):
+        """Добавляет атрибуты текущему участку"""
+        span = _current_span.get()
+        if span is not None:
+            span.attributes.update(attributes)
+
+    def install(self, engine):
+        """Участок на каждый SQL-запрос движка (ожидание блокировки SQLite входит в него)"""
+        if not self.enabled:
+            return
+
+        @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+        def statement_started(conn, cursor, statement, parameters, context, executemany):
+            context._trace_span = self.start_span(
+                'db.' + statement.split(None, 1)[0].lower(),
+                statement=' '.join(statement.split())[:300],
+            )
+
+        @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+        def statement_finished(conn, cursor, statement, parameters, context, executemany):
+            self.end_span(context._trace_span)
+
+        @event.listens_for(engine.sync_engine, 'handle_error')
+        def statement_failed(exception_context):
+            context = exception_context.execution_context
+            if context is not None:
+                self.end_span(getattr(context, '_trace_span', None), exception_context.original_exception)
+
+    def start(self, path: str = None):
+        if not self.enabled:
+            return
+        if path:
+            self.exporter.path = path
+        self.exporter.start()
+        logger.info(f"Tracing enabled: sample rate {self.sample_rate}, slow threshold {self.slow_threshold}s, "
+                    f"writing to {self.exporter.path}")
+
+    async def stop(self):
+        if self.enabled:
+            await self.exporter.stop()
+
+    def stats(self) -> dict:
+        return {
+            'traces': self.exporter.traces,
+            'spans': self.exporter.spans,
+            'dropped_spans': self.exporter.dropped,
+            'pending_spans': len(self.exporter._buffer),
+        }
+
+tracer = Tracer()
+metrics.collector('tracing', tracer.stats)
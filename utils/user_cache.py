@@ -0,0 +1,55 @@
+# utils/user_cache.py
+
+from collections import namedtuple
+from sqlalchemy import select
+from database import async_session
+from models import User
+from config import USER_CACHE_SIZE, USER_CACHE_TTL
+from utils.cache import TTLCache
+from utils.cluster_bus import cluster_bus
+from utils.metrics import metrics
+
+# Поля пользователя, которые нужны на каждом апдейте
+CachedUser = namedtuple('CachedUser', ['id', 'is_blocked', 'last_action'])
+
+# Отметка «пользователя нет в базе», чтобы не ходить в БД за незарегистрированными
+_NOT_REGISTERED = object()
+
+# Событие шины: пользователь изменён не своим апдейтом (блокировка, разбан), payload — telegram_id
+USER_CHANGED = 'user_changed'
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+async def get_cached_user(telegram_id: int, session=None):
+    """
+    Возвращает ``CachedUser`` по telegram_id или ``None``, если пользователь
+    не зарегистрирован. При промахе читает из базы только нужные столбцы,
+    используя сессию текущего апдейта, если она передана.
+    """
+    cached = user_cache.get(telegram_id)
+    if cached is not None:
+        return None if cached is _NOT_REGISTERED else cached
+
+    query = select(User.id, User.is_blocked, User.last_action).where(User.telegram_id == telegram_id)
+    if session is not None:
+        row = (await session.execute(query)).first()
+    else:
+        async with async_session() as own_session:
+            row = (await own_session.execute(query)).first()
+
+    if row is None:
+        user_cache.set(telegram_id, _NOT_REGISTERED)
+        return None
+    cached = CachedUser(row.id, bool(row.is_blocked), row.last_action)
+    user_cache.set(telegram_id, cached)
+    return cached
+
+def cache_user(user: User):
+    # Вызывается после успешного commit, когда строка пользователя изменилась
+    user_cache.set(user.telegram_id, CachedUser(user.id, bool(user.is_blocked), user.last_action))
+
+def invalidate_user(telegram_id: int):
+    user_cache.invalidate(telegram_id)
+
+cluster_bus.subscribe(USER_CHANGED, invalidate_user)
+metrics.collector('user_cache', user_cache.stats)
@@ -0,0 +1,216 @@
+# utils/wallet.py
+
+import asyncio
+import functools
+import hashlib
+import operator
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
+from sqlalchemy import select
+from database import async_session
+from models import Application
+from config import WALLET_CACHE_SIZE, WALLET_AUDIT_BATCH_SIZE
+from utils.metrics import metrics
+
+# Параметры сетей: версии Base58Check-адресов и префикс (HRP) Bech32-адресов
+NETWORKS = {
+    'BTC': {'base58': {0x00: 'p2pkh', 0x05: 'p2sh'}, 'hrp': 'bc'},
+    'LTC': {'base58': {0x30: 'p2pkh', 0x32: 'p2sh'}, 'hrp': 'ltc'},
+}
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BECH32_ALPHABET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+_BASE58_INDEX = {char: index for index, char in enumerate(BASE58_ALPHABET)}
+
+# Быстрая проверка формы до декодирования (компилируется один раз)
+_BASE58_SHAPE = re.compile(r'[1-9A-HJ-NP-Za-km-z]{26,35}')
+_BECH32_SHAPES = {
+    # Адрес Bech32 не длиннее 90 символов, из них 6 - контрольная сумма
+    crypto: re.compile(rf"{network['hrp']}1[{BECH32_ALPHABET}]{{6,{89 - len(network['hrp'])}}}")
+    for crypto, network in NETWORKS.items()
+}
+
+# Константы контрольной суммы: BIP 173 (segwit v0) и BIP 350 (v1+, например taproot)
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+_BECH32_GENERATOR = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+# XOR генераторов для каждого значения старших 5 бит: один поиск вместо цикла на символ
+_BECH32_TABLE = tuple(
+    functools.reduce(operator.xor, (g for index, g in enumerate(_BECH32_GENERATOR) if top >> index & 1), 0)
+    for top in range(32)
+)
+
+# Причины отказа (показываются пользователю и в отчёте проверки)
+UNSUPPORTED_CRYPTO = "криптовалюта не поддерживается"
+BAD_FORMAT = "адрес не похож на адрес этой сети"
+BAD_CHECKSUM = "не сходится контрольная сумма — вероятно, опечатка"
+WRONG_NETWORK = "адрес другой сети или тестовой сети"
+BAD_PROGRAM = "неверная длина или версия адреса"
+
+class WalletCheck(NamedTuple):
+    """Результат проверки: тип адреса (p2pkh, p2sh, p2wpkh, p2wsh, p2tr) или причина отказа"""
+    valid: bool
+    kind: Optional[str] = None
+    error: Optional[str] = None
+
+def _invalid(error: str) -> WalletCheck:
+    return WalletCheck(False, error=error)
+
+# --- Base58Check ---
+
+def _check_base58(address: str, versions: dict) -> WalletCheck:
+    number = 0
+    for char in address:
+        number = number * 58 + _BASE58_INDEX[char]
+    # Ведущие '1' кодируют нулевые байты
+    zeros = len(address) - len(address.lstrip('1'))
+    body = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    raw = b'\x00' * zeros + body
+    if len(raw) != 25:
+        return _invalid(BAD_FORMAT)
+    payload, checksum = raw[:-4], raw[-4:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        return _invalid(BAD_CHECKSUM)
+    kind = versions.get(payload[0])
+    if kind is None:
+        return _invalid(WRONG_NETWORK)
+    return WalletCheck(True, kind)
+
+# --- Bech32 / Bech32m ---
+
+def _bech32_polymod(values, checksum: int = 1) -> int:
+    table = _BECH32_TABLE
+    for value in values:
+        checksum = (checksum & 0x1ffffff) << 5 ^ value ^ table[checksum >> 25]
+    return checksum
+
+def _hrp_expand(hrp: str) -> list:
+    return [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+
+# Состояние контрольной суммы после префикса сети считается один раз
+_HRP_CHECKSUMS = {network['hrp']: _bech32_polymod(_hrp_expand(network['hrp'])) for network in NETWORKS.values()}
+# Символ Bech32 -> его 5-битное значение (байтом) и -> цифра системы счисления по основанию 32 для int()
+_BECH32_VALUES = str.maketrans(BECH32_ALPHABET, ''.join(map(chr, range(32))))
+_BECH32_DIGITS = str.maketrans(BECH32_ALPHABET, '0123456789abcdefghijklmnopqrstuv')
+
+def _program_bytes(part: str):
+    """Перепаковка 5-битных символов в байты; None, если дополнение больше 4 бит или не нулевое"""
+    bits = len(part) * 5
+    padding = bits % 8
+    number = int(part.translate(_BECH32_DIGITS), 32) if part else 0
+    if padding > 4 or number & ((1 << padding) - 1):
+        return None
+    return (number >> padding).to_bytes(bits // 8, 'big')
+
+def _check_bech32(address: str, hrp: str) -> WalletCheck:
+    part = address[len(hrp) + 1:]
+    data = part.translate(_BECH32_VALUES).encode('latin-1')
+    constant = _bech32_polymod(data, _HRP_CHECKSUMS[hrp])
+    if constant not in (BECH32_CONST, BECH32M_CONST):
+        return _invalid(BAD_CHECKSUM)
+    version = data[0]
+    program = _program_bytes(part[1:-6])
+    if version > 16 or program is None or not 2 <= len(program) <= 40:
+        return _invalid(BAD_PROGRAM)
+    # v0 подписывается Bech32, v1+ — Bech32m: адрес с «чужой» суммой испорчен
+    if (version == 0) != (constant == BECH32_CONST):
+        return _invalid(BAD_CHECKSUM)
+    if version == 0:
+        kinds = {20: 'p2wpkh', 32: 'p2wsh'}
+        if len(program) not in kinds:
+            return _invalid(BAD_PROGRAM)
+        return WalletCheck(True, kinds[len(program)])
+    if version == 1 and len(program) == 32:
+        return WalletCheck(True, 'p2tr')
+    # Будущие версии SegWit формально корректны, но средства на них пока нельзя потратить
+    return _invalid(BAD_PROGRAM)
+
+# --- Проверка адреса ---
+
+@functools.lru_cache(maxsize=WALLET_CACHE_SIZE)
+def check_wallet_address(address: str, crypto: str) -> WalletCheck:
+    """
+    Проверяет адрес кошелька ``crypto`` (BTC или LTC): Base58Check (P2PKH,
+    P2SH) с контрольной суммой двойного SHA-256 или Bech32/Bech32m (SegWit,
+    Taproot) с контрольной суммой BIP 173/350. Результаты последних
+    проверок кэшируются.
+    """
+    network = NETWORKS.get(crypto)
+    if network is None:
+        return _invalid(UNSUPPORTED_CRYPTO)
+    # Bech32 допускает запись целиком заглавными буквами, но не смешанную
+    lowered = address.lower()
+    if address == lowered or address == address.upper():
+        if _BECH32_SHAPES[crypto].fullmatch(lowered):
+            return _check_bech32(lowered, network['hrp'])
+    if _BASE58_SHAPE.fullmatch(address):
+        return _check_base58(address, network['base58'])
+    return _invalid(BAD_FORMAT)
+
+def validate_wallet_address(address: str, crypto: str) -> bool:
+    return check_wallet_address(address, crypto).valid
+
+def check_many(pairs) -> list:
+    """Проверяет пары (адрес, криптовалюта); одинаковые адреса проверяются один раз"""
+    results = {}
+    checks = []
+    for pair in pairs:
+        check = results.get(pair)
+        if check is None:
+            # Мимо LRU-кэша: проверка всей базы не должна вытеснять адреса, которые вводят сейчас
+            check = results[pair] = check_wallet_address.__wrapped__(*pair)
+        checks.append(check)
+    return checks
+
+def cache_stats() -> dict:
+    info = check_wallet_address.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'size': info.currsize,
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_ratio': info.hits / lookups if lookups else 0.0,
+    }
+
+# --- Проверка адресов в заявках ---
+
+class WalletAudit(NamedTuple):
+    checked: int
+    kinds: Counter  # тип адреса -> число заявок
+    invalid: list   # [(id заявки, криптовалюта, адрес, причина)]
+
+async def audit_wallet_addresses(session_pool=async_session, batch_size: int = WALLET_AUDIT_BATCH_SIZE) -> WalletAudit:
+    """
+    Перепроверяет адреса всех заявок. Заявки читаются пачками по ``batch_size``
+    по первичному ключу (без OFFSET), каждая пачка — в своей короткой сессии,
+    поэтому проверка не держит транзакцию и не мешает работе бота.
+    """
+    checked = 0
+    kinds = Counter()
+    invalid = []
+    last_id = 0
+    while True:
+        async with session_pool() as session:
+            result = await session.execute(
+                select(Application.id, Application.crypto_type, Application.wallet_address)
+                .where(Application.id > last_id)
+                .order_by(Application.id)
+                .limit(batch_size)
+            )
+            rows = result.all()
+        if not rows:
+            break
+        checks = check_many((row.wallet_address, row.crypto_type) for row in rows)
+        for row, check in zip(rows, checks):
+            if check.valid:
+                kinds[check.kind] += 1
+            else:
+                invalid.append((row.id, row.crypto_type, row.wallet_address, check.error))
+        checked += len(rows)
+        last_id = rows[-1].id
+        # Отдаём цикл событий апдейтам между пачками
+        await asyncio.sleep(0)
+    return WalletAudit(checked, kinds, invalid)
+
+metrics.collector('wallet_cache', cache_stats)
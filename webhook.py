@@ -0,0 +1,123 @@
+# webhook.py
+
+import asyncio
+import logging
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    WEBHOOK_CONCURRENCY, WEBHOOK_MAX_PENDING, WEBHOOK_SHUTDOWN_TIMEOUT
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class ConcurrencyLimitedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука: проверяет секретный токен, сразу отвечает Telegram
+    и обрабатывает апдейты в фоне, не более ``concurrency`` одновременно.
+
+    Если принятых, но ещё не обработанных апдейтов больше ``max_pending``,
+    запрос отклоняется с 503 — Telegram повторит доставку позже.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str = WEBHOOK_SECRET,
+                 concurrency: int = WEBHOOK_CONCURRENCY, max_pending: int = WEBHOOK_MAX_PENDING,
+                 shutdown_timeout: float = WEBHOOK_SHUTDOWN_TIMEOUT, **data):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.max_pending = max_pending
+        self.shutdown_timeout = shutdown_timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.accepted = 0
+        self.rejected = 0
+        self.unauthorized = 0
+        self.processed = 0
+        self.failed = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # Повторяет BaseRequestHandler.handle, чтобы считать отказы: токен проверяется один раз
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            self.unauthorized += 1
+            return web.Response(body="Unauthorized", status=401)
+        if len(self._background_feed_update_tasks) >= self.max_pending:
+            self.rejected += 1
+            return web.Response(body="Too many pending updates", status=503)
+        self.accepted += 1
+        return await self._handle_request_background(bot=bot, request=request)
+
+    __call__ = handle
+
+    async def _background_feed_update(self, bot: Bot, update: dict) -> None:
+        async with self._semaphore:
+            try:
+                await super()._background_feed_update(bot, update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception(f"Failed to process webhook update {update.get('update_id')}")
+
+    async def close(self) -> None:
+        # Доводим до конца уже принятые апдейты: Telegram считает их доставленными
+        pending = list(self._background_feed_update_tasks)
+        if pending:
+            logger.info(f"Waiting for {len(pending)} webhook updates to finish")
+            done, not_done = await asyncio.wait(pending, timeout=self.shutdown_timeout)
+            for task in not_done:
+                task.cancel()
+            if not_done:
+                logger.warning(f"Cancelled {len(not_done)} webhook updates on shutdown")
+        await super().close()
+
+    def stats(self) -> dict:
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'unauthorized': self.unauthorized,
+            'processed': self.processed,
+            'failed': self.failed,
+            'pending': len(self._background_feed_update_tasks),
+        }
+
+async def healthcheck(request: web.Request) -> web.Response:
+    # Для балансировщика нагрузки
+    return web.Response(text="ok")
+
+def create_webhook_app(bot: Bot, dp: Dispatcher, **handler_options) -> web.Application:
+    app = web.Application()
+    handler = ConcurrencyLimitedRequestHandler(dp, bot, **handler_options)
+    handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get('/healthz', healthcheck)
+    app['webhook_handler'] = handler
+    metrics.collector('webhook', handler.stats)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Запускает веб-сервер вебхука и работает до отмены задачи.
+    Если задан WEBHOOK_URL, адрес и секрет регистрируются в Telegram.
+    """
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is empty, webhook requests are not authenticated")
+
+    app = create_webhook_app(bot, dp)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    try:
+        if WEBHOOK_URL:
+            await bot.set_webhook(
+                url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=min(WEBHOOK_CONCURRENCY, 100),
+            )
+            logger.info(f"Webhook registered at {WEBHOOK_URL}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()